@@ -3,7 +3,14 @@ import os
 from itertools import chain
 from pathlib import Path
 
-from .utils import get_prompt_from_filename, init_submodules, load_json, save_json
+from .utils import (
+    disable_frame_cache,
+    enable_frame_cache,
+    get_prompt_from_filename,
+    init_submodules,
+    load_json,
+    save_json,
+)
 
 
 class VBench(object):
@@ -238,18 +245,29 @@ class VBench(object):
             videos_path, name, dimension_list, prompt_list, mode=mode, **kwargs
         )
 
-        for dimension in dimension_list:
-            try:
-                dimension_module = importlib.import_module(f"vbench.{dimension}")
-                evaluate_func = getattr(dimension_module, f"compute_{dimension}")
-            except Exception as e:
-                raise NotImplementedError(f"UnImplemented dimension {dimension}!, {e}")
-            submodules_list = submodules_dict[dimension]
-            print(f"cur_full_info_path: {cur_full_info_path}")  # TODO: to delete
-            results = evaluate_func(
-                cur_full_info_path, self.device, submodules_list, **kwargs
-            )
-            results_dict[dimension] = results
+        # every video is decoded once and shared by all dimensions of this run, the videos beyond the
+        # memory budget are decoded again unless a dir to spill them to is given
+        enable_frame_cache(
+            max_gb=kwargs.get("frame_cache_gb", 8.0),
+            cache_dir=kwargs.get("frame_cache_dir", None),
+        )
+        try:
+            for dimension in dimension_list:
+                try:
+                    dimension_module = importlib.import_module(f"vbench.{dimension}")
+                    evaluate_func = getattr(dimension_module, f"compute_{dimension}")
+                except Exception as e:
+                    raise NotImplementedError(
+                        f"UnImplemented dimension {dimension}!, {e}"
+                    )
+                submodules_list = submodules_dict[dimension]
+                print(f"cur_full_info_path: {cur_full_info_path}")  # TODO: to delete
+                results = evaluate_func(
+                    cur_full_info_path, self.device, submodules_list, **kwargs
+                )
+                results_dict[dimension] = results
+        finally:
+            disable_frame_cache()
         output_name = os.path.join(self.output_path, name + "_eval_results.json")
         save_json(results_dict, output_name)
         print(f"Evaluation results saved to {output_name}")
@@ -7,7 +7,13 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from tqdm import tqdm
-from vbench.utils import clip_transform, load_dimension_info, load_video
+from vbench.utils import (
+    batched_features,
+    clip_transform,
+    load_dimension_info,
+    load_video,
+    prefetch_videos,
+)
 
 
 def get_aesthetic_model(cache_folder):
@@ -36,27 +42,41 @@ def get_aesthetic_model(cache_folder):
     return m
 
 
-def laion_aesthetic(aesthetic_model, clip_model, video_list, device):
+def laion_aesthetic(
+    aesthetic_model, clip_model, video_list, device, batch_size=64, num_workers=4
+):
     aesthetic_model.eval()
     clip_model.eval()
     aesthetic_avg = 0.0
     num = 0
     video_results = []
-    for video_path in tqdm(video_list):
-        images = load_video(video_path)
-        image_transform = clip_transform(224)
-        images = image_transform(images)
-        images = images.to(device)
-        image_feats = clip_model.encode_image(images).to(torch.float32)
+    image_transform = clip_transform(224)
+
+    @torch.no_grad()
+    def encode(images):
+        image_feats = clip_model.encode_image(images.to(device)).to(torch.float32)
         image_feats = F.normalize(image_feats, dim=-1, p=2)
-        aesthetic_scores = aesthetic_model(image_feats).squeeze()
-        normalized_aesthetic_scores = aesthetic_scores / 10
-        cur_avg = torch.mean(normalized_aesthetic_scores, dim=0, keepdim=True)
-        aesthetic_avg += cur_avg.item()
+        return aesthetic_model(image_feats)
+
+    # decoding runs ahead in a thread pool, the frames of several videos go through CLIP in one batch
+    videos = prefetch_videos(
+        video_list,
+        lambda video_path: image_transform(load_video(video_path)),
+        num_workers=num_workers,
+    )
+    video_paths, video_scores = [], []
+    for video_path, aesthetic_scores in tqdm(
+        batched_features(videos, encode, batch_size), total=len(video_list)
+    ):
+        normalized_aesthetic_scores = aesthetic_scores.squeeze(-1) / 10
+        video_paths.append(video_path)
+        video_scores.append(torch.mean(normalized_aesthetic_scores, dim=0))
+    # a single device sync for all videos
+    video_scores = torch.stack(video_scores).tolist() if video_scores else []
+    for video_path, cur_avg in zip(video_paths, video_scores):
+        aesthetic_avg += cur_avg
         num += 1
-        video_results.append(
-            {"video_path": video_path, "video_results": cur_avg.item()}
-        )
+        video_results.append({"video_path": video_path, "video_results": cur_avg})
     aesthetic_avg /= num
     return aesthetic_avg, video_results
 
@@ -70,6 +90,11 @@ def compute_aesthetic_quality(json_dir, device, submodules_list, **kwargs):
         json_dir, dimension="aesthetic_quality", lang="en"
     )
     all_results, video_results = laion_aesthetic(
-        aesthetic_model, clip_model, video_list, device
+        aesthetic_model,
+        clip_model,
+        video_list,
+        device,
+        batch_size=kwargs.get("batch_size", 64),
+        num_workers=kwargs.get("num_workers", 4),
     )
     return all_results, video_results
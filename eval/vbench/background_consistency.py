@@ -9,48 +9,57 @@ import torch.nn as nn
 import torch.nn.functional as F
 from PIL import Image
 from tqdm import tqdm
-from vbench.utils import clip_transform, load_dimension_info, load_video
+from vbench.utils import (
+    batched_features,
+    clip_transform,
+    consistency_similarity,
+    load_dimension_info,
+    load_video,
+    prefetch_videos,
+)
 
 
-def background_consistency(clip_model, preprocess, video_list, device, read_frame):
+def background_consistency(
+    clip_model, preprocess, video_list, device, read_frame, batch_size=64, num_workers=4
+):
     sim = 0.0
     cnt = 0
     video_results = []
     image_transform = clip_transform(224)
-    for video_path in tqdm(video_list):
-        video_sim = 0.0
+
+    def load_images(video_path):
         if read_frame:
             video_path = video_path[:-4].replace("videos", "frames").replace(" ", "_")
             tmp_paths = [
                 os.path.join(video_path, f) for f in sorted(os.listdir(video_path))
             ]
-            images = []
-            for tmp_path in tmp_paths:
-                images.append(preprocess(Image.open(tmp_path)))
-            images = torch.stack(images)
-        else:
-            images = load_video(video_path)
-            images = image_transform(images)
-        images = images.to(device)
-        image_features = clip_model.encode_image(images)
-        image_features = F.normalize(image_features, dim=-1, p=2)
-        for i in range(len(image_features)):
-            image_feature = image_features[i].unsqueeze(0)
-            if i == 0:
-                first_image_feature = image_feature
-            else:
-                sim_pre = max(
-                    0.0, F.cosine_similarity(former_image_feature, image_feature).item()
-                )
-                sim_fir = max(
-                    0.0, F.cosine_similarity(first_image_feature, image_feature).item()
-                )
-                cur_sim = (sim_pre + sim_fir) / 2
-                video_sim += cur_sim
-                cnt += 1
-            former_image_feature = image_feature
-        sim_per_image = video_sim / (len(image_features) - 1)
+            return torch.stack(
+                [preprocess(Image.open(tmp_path)) for tmp_path in tmp_paths]
+            )
+        return image_transform(load_video(video_path))
+
+    @torch.no_grad()
+    def encode(images):
+        image_features = clip_model.encode_image(images.to(device))
+        return F.normalize(image_features, dim=-1, p=2)
+
+    # decoding runs ahead in a thread pool, the frames of several videos go through CLIP in one batch
+    videos = prefetch_videos(video_list, load_images, num_workers=num_workers)
+    video_paths, num_images, video_sims = [], [], []
+    for video_path, image_features in tqdm(
+        batched_features(videos, encode, batch_size), total=len(video_list)
+    ):
+        if read_frame:
+            video_path = video_path[:-4].replace("videos", "frames").replace(" ", "_")
+        video_paths.append(video_path)
+        num_images.append(len(image_features))
+        video_sims.append(consistency_similarity(image_features))
+    # a single device sync for all videos
+    video_sims = torch.stack(video_sims).tolist() if video_sims else []
+    for video_path, n, video_sim in zip(video_paths, num_images, video_sims):
+        sim_per_image = video_sim / (n - 1)
         sim += video_sim
+        cnt += n - 1
         video_results.append({"video_path": video_path, "video_results": sim_per_image})
     # sim_per_video = sim / (len(video_list) - 1)
     sim_per_frame = sim / cnt
@@ -64,6 +73,12 @@ def compute_background_consistency(json_dir, device, submodules_list, **kwargs):
         json_dir, dimension="background_consistency", lang="en"
     )
     all_results, video_results = background_consistency(
-        clip_model, preprocess, video_list, device, read_frame
+        clip_model,
+        preprocess,
+        video_list,
+        device,
+        read_frame,
+        batch_size=kwargs.get("batch_size", 64),
+        num_workers=kwargs.get("num_workers", 4),
     )
     return all_results, video_results
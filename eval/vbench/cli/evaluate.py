@@ -108,6 +108,37 @@ def register_subparsers(subparser):
         4. 'None': no preprocessing
         """,
     )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=64,
+        help="frames per forward of the feature extractors, batched across videos",
+    )
+    parser.add_argument(
+        "--dynamic_degree_batch_size",
+        type=int,
+        default=8,
+        help="frame pairs per RAFT forward in dynamic_degree, halved on out of memory errors",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=4,
+        help="threads that decode videos ahead of the model inference",
+    )
+    parser.add_argument(
+        "--frame_cache_gb",
+        type=float,
+        default=8.0,
+        help="memory budget of the decoded frames shared by all dimensions",
+    )
+    parser.add_argument(
+        "--frame_cache_dir",
+        type=str,
+        default=None,
+        help="optional dir the decoded frames beyond --frame_cache_gb are spilled to as .npy, "
+        "they are decoded again if not given",
+    )
     parser.set_defaults(func=evaluate)
 
 
@@ -149,6 +180,11 @@ def evaluate(args):
     kwargs["imaging_quality_preprocessing_mode"] = (
         args.imaging_quality_preprocessing_mode
     )
+    kwargs["batch_size"] = args.batch_size
+    kwargs["num_workers"] = args.num_workers
+    kwargs["dynamic_degree_batch_size"] = args.dynamic_degree_batch_size
+    kwargs["frame_cache_gb"] = args.frame_cache_gb
+    kwargs["frame_cache_dir"] = args.frame_cache_dir
 
     my_VBench.evaluate(
         videos_path=args.videos_path,
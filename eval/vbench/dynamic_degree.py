@@ -13,9 +13,11 @@ from vbench.utils import load_dimension_info
 
 
 class DynamicDegree:
-    def __init__(self, args, device):
+    def __init__(self, args, device, batch_size=8):
         self.args = args
         self.device = device
+        # frame pairs per RAFT forward
+        self.batch_size = batch_size
         self.load_model()
 
     def load_model(self):
@@ -26,21 +28,11 @@ class DynamicDegree:
         self.model.to(self.device)
         self.model.eval()
 
-    def get_score(self, img, flo):
-        img = img[0].permute(1, 2, 0).cpu().numpy()
-        flo = flo[0].permute(1, 2, 0).cpu().numpy()
-
-        u = flo[:, :, 0]
-        v = flo[:, :, 1]
-        rad = np.sqrt(np.square(u) + np.square(v))
-
-        h, w = rad.shape
-        rad_flat = rad.flatten()
-        cut_index = int(h * w * 0.05)
-
-        max_rad = np.mean(abs(np.sort(-rad_flat))[:cut_index])
-
-        return max_rad.item()
+    def get_score(self, flo):
+        """mean flow magnitude of the top 5% pixels, for every flow of the batch [B, 2, H, W]"""
+        rad = torch.sqrt(torch.square(flo[:, 0]) + torch.square(flo[:, 1])).flatten(1)
+        cut_index = int(rad.shape[1] * 0.05)
+        return rad.topk(cut_index, dim=1).values.mean(dim=1)
 
     def set_params(self, frame, count):
         scale = min(list(frame.shape)[-2:])
@@ -58,15 +50,39 @@ class DynamicDegree:
             else:
                 raise NotImplementedError
             self.set_params(frame=frames[0], count=len(frames))
-            static_score = []
-            for image1, image2 in zip(frames[:-1], frames[1:]):
-                padder = InputPadder(image1.shape)
-                image1, image2 = padder.pad(image1, image2)
-                _, flow_up = self.model(image1, image2, iters=20, test_mode=True)
-                max_rad = self.get_score(image1, flow_up)
-                static_score.append(max_rad)
-            whether_move = self.check_move(static_score)
-            return whether_move
+            # all frames have the same size, so they are padded once
+            padder = InputPadder(frames.shape)
+            frames = padder.pad(frames)[0]
+
+            # the consecutive pairs run through RAFT in batches, and no more pairs are computed
+            # once the video is known to move
+            score_list = []
+            num_pairs = len(frames) - 1
+            start = 0
+            while start < num_pairs:
+                end = min(start + self.batch_size, num_pairs)
+                try:
+                    _, flow_up = self.model(
+                        frames[start:end],
+                        frames[start + 1 : end + 1],
+                        iters=20,
+                        test_mode=True,
+                    )
+                except torch.cuda.OutOfMemoryError:
+                    # the correlation volume grows with the square of the frame area
+                    if self.batch_size == 1:
+                        raise
+                    self.batch_size = max(1, self.batch_size // 2)
+                    torch.cuda.empty_cache()
+                    print(
+                        f"RAFT ran out of memory, {self.batch_size} frame pairs per forward from now on"
+                    )
+                    continue
+                score_list.extend(self.get_score(flow_up).tolist())
+                if self.check_move(score_list):
+                    return True
+                start = end
+            return False
 
     def check_move(self, score_list):
         thres = self.params["thres"]
@@ -83,28 +99,28 @@ class DynamicDegree:
         frame_list = []
         video = cv2.VideoCapture(video_path)
         fps = video.get(cv2.CAP_PROP_FPS)  # get fps
-        interval = round(fps / 8)
+        interval = max(round(fps / 8), 1)
+        index = 0
         while video.isOpened():
-            success, frame = video.read()
-            if success:
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)  # convert to rgb
-                frame = (
-                    torch.from_numpy(frame.astype(np.uint8)).permute(2, 0, 1).float()
-                )
-                frame = frame[None].to(self.device)
-                frame_list.append(frame)
-            else:
+            # subsample before decoding: the skipped frames are grabbed but never retrieved
+            if not video.grab():
                 break
+            if index % interval == 0:
+                success, frame = video.retrieve()
+                if not success:
+                    break
+                frame_list.append(
+                    cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                )  # convert to rgb
+            index += 1
         video.release()
         assert frame_list != []
-        frame_list = self.extract_frame(frame_list, interval)
-        return frame_list
+        return self.to_tensor(frame_list)
 
-    def extract_frame(self, frame_list, interval=1):
-        extract = []
-        for i in range(0, len(frame_list), interval):
-            extract.append(frame_list[i])
-        return extract
+    def to_tensor(self, frame_list):
+        """stack rgb uint8 frames (H, W, C) into one float tensor [T, C, H, W] on the device"""
+        frames = torch.from_numpy(np.stack(frame_list).astype(np.uint8))
+        return frames.to(self.device).permute(0, 3, 1, 2).float()
 
     def get_frames_from_img_folder(self, img_folder):
         exts = [
@@ -133,11 +149,9 @@ class DynamicDegree:
         for img in imgs:
             frame = cv2.imread(img, cv2.IMREAD_COLOR)
             frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frame = torch.from_numpy(frame.astype(np.uint8)).permute(2, 0, 1).float()
-            frame = frame[None].to(self.device)
             frame_list.append(frame)
         assert frame_list != []
-        return frame_list
+        return self.to_tensor(frame_list)
 
 
 def dynamic_degree(dynamic, video_list):
@@ -164,7 +178,9 @@ def compute_dynamic_degree(json_dir, device, submodules_list, **kwargs):
             "alternate_corr": False,
         }
     )
-    dynamic = DynamicDegree(args_new, device)
+    dynamic = DynamicDegree(
+        args_new, device, batch_size=kwargs.get("dynamic_degree_batch_size", 8)
+    )
     video_list, _ = load_dimension_info(json_dir, dimension="dynamic_degree", lang="en")
     all_results, video_results = dynamic_degree(dynamic, video_list)
     return all_results, video_results
@@ -12,10 +12,13 @@ import torchvision.transforms as transforms
 from PIL import Image
 from tqdm import tqdm
 from vbench.utils import (
+    batched_features,
+    consistency_similarity,
     dino_transform,
     dino_transform_Image,
     load_dimension_info,
     load_video,
+    prefetch_videos,
 )
 
 logging.basicConfig(
@@ -24,7 +27,9 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def subject_consistency(model, video_list, device, read_frame):
+def subject_consistency(
+    model, video_list, device, read_frame, batch_size=64, num_workers=4
+):
     sim = 0.0
     cnt = 0
     video_results = []
@@ -32,46 +37,40 @@ def subject_consistency(model, video_list, device, read_frame):
         image_transform = dino_transform_Image(224)
     else:
         image_transform = dino_transform(224)
-    for video_path in tqdm(video_list):
-        video_sim = 0.0
+
+    def load_images(video_path):
         if read_frame:
             video_path = video_path[:-4].replace("videos", "frames").replace(" ", "_")
             tmp_paths = [
                 os.path.join(video_path, f) for f in sorted(os.listdir(video_path))
             ]
-            images = []
-            for tmp_path in tmp_paths:
-                images.append(image_transform(Image.open(tmp_path)))
-        else:
-            images = load_video(video_path)
-            images = image_transform(images)
-        for i in range(len(images)):
-            with torch.no_grad():
-                image = images[i].unsqueeze(0)
-                image = image.to(device)
-                image_features = model(image)
-                image_features = F.normalize(image_features, dim=-1, p=2)
-                if i == 0:
-                    first_image_features = image_features
-                else:
-                    sim_pre = max(
-                        0.0,
-                        F.cosine_similarity(
-                            former_image_features, image_features
-                        ).item(),
-                    )
-                    sim_fir = max(
-                        0.0,
-                        F.cosine_similarity(
-                            first_image_features, image_features
-                        ).item(),
-                    )
-                    cur_sim = (sim_pre + sim_fir) / 2
-                    video_sim += cur_sim
-                    cnt += 1
-            former_image_features = image_features
-        sim_per_images = video_sim / (len(images) - 1)
+            return torch.stack(
+                [image_transform(Image.open(tmp_path)) for tmp_path in tmp_paths]
+            )
+        return image_transform(load_video(video_path))
+
+    @torch.no_grad()
+    def encode(images):
+        image_features = model(images.to(device))
+        return F.normalize(image_features, dim=-1, p=2)
+
+    # decoding runs ahead in a thread pool, the frames of several videos go through DINO in one batch
+    videos = prefetch_videos(video_list, load_images, num_workers=num_workers)
+    video_paths, num_images, video_sims = [], [], []
+    for video_path, image_features in tqdm(
+        batched_features(videos, encode, batch_size), total=len(video_list)
+    ):
+        if read_frame:
+            video_path = video_path[:-4].replace("videos", "frames").replace(" ", "_")
+        video_paths.append(video_path)
+        num_images.append(len(image_features))
+        video_sims.append(consistency_similarity(image_features))
+    # a single device sync for all videos
+    video_sims = torch.stack(video_sims).tolist() if video_sims else []
+    for video_path, n, video_sim in zip(video_paths, num_images, video_sims):
+        sim_per_images = video_sim / (n - 1)
         sim += video_sim
+        cnt += n - 1
         video_results.append(
             {"video_path": video_path, "video_results": sim_per_images}
         )
@@ -88,6 +87,11 @@ def compute_subject_consistency(json_dir, device, submodules_list, **kwargs):
         json_dir, dimension="subject_consistency", lang="en"
     )
     all_results, video_results = subject_consistency(
-        dino_model, video_list, device, read_frame
+        dino_model,
+        video_list,
+        device,
+        read_frame,
+        batch_size=kwargs.get("batch_size", 64),
+        num_workers=kwargs.get("num_workers", 4),
     )
     return all_results, video_results
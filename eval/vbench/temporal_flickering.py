@@ -1,7 +1,7 @@
 import cv2
 import numpy as np
 from tqdm import tqdm
-from vbench.utils import load_dimension_info
+from vbench.utils import load_dimension_info, load_video, prefetch_videos
 
 
 def get_frames(video_path):
@@ -18,11 +18,14 @@ def get_frames(video_path):
     return frames
 
 
-def mae_seq(frames):
+def mae_seq(frames, chunk_size=16):
+    """mean absolute error between consecutive frames (T, H, W, C), computed in chunks of frame pairs"""
+    frames = np.asarray(frames)
     ssds = []
-    for i in range(len(frames) - 1):
-        ssds.append(calculate_mae(frames[i], frames[i + 1]))
-    return np.array(ssds)
+    for start in range(0, len(frames) - 1, chunk_size):
+        chunk = frames[start : start + chunk_size + 1].astype(np.float32)
+        ssds.append(np.abs(chunk[1:] - chunk[:-1]).mean(axis=(1, 2, 3)))
+    return np.concatenate(ssds) if ssds else np.array([])
 
 
 def calculate_mae(img1, img2):
@@ -35,21 +38,38 @@ def calculate_mae(img1, img2):
     )
 
 
-def cal_score(video_path):
+def load_frames(video_path):
+    # uint8 (T, H, W, C) through the shared frame cache, the channel order does not change the MAE
+    frames = load_video(video_path, return_tensor=False)
+    assert len(frames) > 0
+    return frames
+
+
+def cal_score(video_path, frames=None):
     """please ensure the video is static"""
-    frames = get_frames(video_path)
+    if frames is None:
+        frames = load_frames(video_path)
     score_seq = mae_seq(frames)
     return (255.0 - np.mean(score_seq).item()) / 255.0
 
 
-def temporal_flickering(video_list):
+def safe_load_frames(video_path):
+    try:
+        return load_frames(video_path)
+    except AssertionError:
+        return None
+
+
+def temporal_flickering(video_list, num_workers=4):
     sim = []
     video_results = []
-    for video_path in tqdm(video_list):
-        try:
-            score_per_video = cal_score(video_path)
-        except AssertionError:
+    for video_path, frames in tqdm(
+        prefetch_videos(video_list, safe_load_frames, num_workers=num_workers),
+        total=len(video_list),
+    ):
+        if frames is None:
             continue
+        score_per_video = cal_score(video_path, frames)
         video_results.append(
             {"video_path": video_path, "video_results": score_per_video}
         )
@@ -62,5 +82,7 @@ def compute_temporal_flickering(json_dir, device, submodules_list, **kwargs):
     video_list, _ = load_dimension_info(
         json_dir, dimension="temporal_flickering", lang="en"
     )
-    all_results, video_results = temporal_flickering(video_list)
+    all_results, video_results = temporal_flickering(
+        video_list, num_workers=kwargs.get("num_workers", 4)
+    )
     return all_results, video_results
@@ -1,12 +1,18 @@
+import hashlib
+import itertools
 import json
 import logging
 import os
 import re
 import subprocess
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import torch
+import torch.nn.functional as F
 from decord import VideoReader, cpu
 from PIL import Image, ImageSequence
 from torchvision import transforms
@@ -136,37 +142,9 @@ def get_frame_indices(
     return frame_indices
 
 
-def load_video(
-    video_path,
-    data_transform=None,
-    num_frames=None,
-    return_tensor=True,
-    width=None,
-    height=None,
-):
+def decode_video(video_path, width=None, height=None):
     """
-    Load a video from a given path and apply optional data transformations.
-
-    The function supports loading video in GIF (.gif), PNG (.png), and MP4 (.mp4) formats.
-    Depending on the format, it processes and extracts frames accordingly.
-
-    Parameters:
-    - video_path (str): The file path to the video or image to be loaded.
-    - data_transform (callable, optional): A function that applies transformations to the video data.
-
-    Returns:
-    - frames (torch.Tensor): A tensor containing the video frames with shape (T, C, H, W),
-      where T is the number of frames, C is the number of channels, H is the height, and W is the width.
-
-    Raises:
-    - NotImplementedError: If the video format is not supported.
-
-    The function first determines the format of the video file by its extension.
-    For GIFs, it iterates over each frame and converts them to RGB.
-    For PNGs, it reads the single frame, converts it to RGB.
-    For MP4s, it reads the frames using the VideoReader class and converts them to NumPy arrays.
-    If a data_transform is provided, it is applied to the buffer before converting it to a tensor.
-    Finally, the tensor is permuted to match the expected (T, C, H, W) format.
+    Decode all frames of a GIF (.gif), PNG (.png) or MP4 (.mp4) file into a uint8 array (T, H, W, C).
     """
     if video_path.endswith(".gif"):
         frame_ls = []
@@ -200,6 +178,183 @@ def load_video(
     else:
         raise NotImplementedError
 
+    return buffer
+
+
+class FrameCache:
+    """
+    Cache of decoded videos (uint8 arrays (T, H, W, C)) shared by all dimensions of a `VBench.evaluate` run,
+    so that the cached videos are decoded once instead of once per dimension.
+
+    Every dimension scans the videos in the same order, which defeats LRU eviction once the decoded set
+    outgrows the memory budget. Videos are therefore inserted once and never evicted: the first ones are kept
+    in memory up to `max_gb`, the others are spilled to `cache_dir` as `.npy` and memory-mapped when read.
+
+    Parameters:
+    - max_gb (float): the memory budget of the videos kept in memory.
+    - cache_dir (str, optional): where the videos beyond the budget are spilled, they are decoded again if None.
+    """
+
+    def __init__(self, max_gb=8.0, cache_dir=None):
+        self.max_bytes = int(max_gb * 1024**3)
+        self.cache_dir = cache_dir
+        self.nbytes = 0
+        self.buffers = {}
+        self.lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(
+            self.cache_dir, hashlib.sha1(repr(key).encode()).hexdigest() + ".npy"
+        )
+
+    def get(self, key):
+        with self.lock:
+            if key in self.buffers:
+                return self.buffers[key]
+        if self.cache_dir is not None and os.path.exists(self._path(key)):
+            # read-only, only the frames that are indexed are read from disk
+            return np.load(self._path(key), mmap_mode="r")
+        return None
+
+    def put(self, key, buffer):
+        with self.lock:
+            if key in self.buffers:
+                return
+            if self.nbytes + buffer.nbytes <= self.max_bytes:
+                self.buffers[key] = buffer
+                self.nbytes += buffer.nbytes
+                return
+        if self.cache_dir is not None:
+            path = self._path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npy"
+            np.save(tmp_path, buffer)
+            os.replace(tmp_path, path)
+
+
+_frame_cache = None
+
+
+def enable_frame_cache(max_gb=8.0, cache_dir=None):
+    """make `load_video` read decoded videos through a shared `FrameCache`"""
+    global _frame_cache
+    _frame_cache = FrameCache(max_gb=max_gb, cache_dir=cache_dir)
+    return _frame_cache
+
+
+def disable_frame_cache():
+    global _frame_cache
+    _frame_cache = None
+
+
+def prefetch_videos(video_list, load_fn=None, num_workers=4, prefetch=8):
+    """
+    Yield `(video_path, load_fn(video_path))` in the order of `video_list`, while the next `prefetch` videos
+    are loaded by a pool of `num_workers` threads, so that decoding overlaps with the model inference.
+    """
+    load_fn = load_fn or load_video
+    videos = iter(video_list)
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        futures = deque(
+            (video_path, pool.submit(load_fn, video_path))
+            for video_path in itertools.islice(videos, prefetch)
+        )
+        while futures:
+            video_path, future = futures.popleft()
+            for next_path in itertools.islice(videos, 1):
+                futures.append((next_path, pool.submit(load_fn, next_path)))
+            yield video_path, future.result()
+
+
+def batched_features(videos, encode_fn, batch_size=64):
+    """
+    Run `encode_fn` on the frames of several videos at once.
+    `videos` yields `(key, frames)` with frames (T, C, H, W), the features are yielded per video as
+    `(key, features)` with features (T, D), in the same order.
+    """
+    keys, lengths, frames = [], [], []
+
+    def flush():
+        inputs = torch.cat(frames)
+        features = torch.cat([encode_fn(chunk) for chunk in inputs.split(batch_size)])
+        yield from zip(keys, features.split(lengths))
+        keys.clear()
+        lengths.clear()
+        frames.clear()
+
+    for key, video in videos:
+        # videos of another resolution can not be batched with the pending ones
+        if frames and video.shape[1:] != frames[0].shape[1:]:
+            yield from flush()
+        keys.append(key)
+        lengths.append(len(video))
+        frames.append(video)
+        if sum(lengths) >= batch_size:
+            yield from flush()
+    if frames:
+        yield from flush()
+
+
+def consistency_similarity(features):
+    """
+    Sum over the frames 1..T-1 of the mean of the cosine similarities (clamped at 0) to the previous and to the first frame.
+    """
+    sim_pre = F.cosine_similarity(features[1:], features[:-1]).clamp(min=0.0)
+    sim_fir = F.cosine_similarity(features[1:], features[:1]).clamp(min=0.0)
+    return ((sim_pre + sim_fir) / 2).sum()
+
+
+def load_video(
+    video_path,
+    data_transform=None,
+    num_frames=None,
+    return_tensor=True,
+    width=None,
+    height=None,
+):
+    """
+    Load a video from a given path and apply optional data transformations.
+
+    The function supports loading video in GIF (.gif), PNG (.png), and MP4 (.mp4) formats.
+    Depending on the format, it processes and extracts frames accordingly.
+
+    Parameters:
+    - video_path (str): The file path to the video or image to be loaded.
+    - data_transform (callable, optional): A function that applies transformations to the video data.
+
+    Returns:
+    - frames (torch.Tensor): A tensor containing the video frames with shape (T, C, H, W),
+      where T is the number of frames, C is the number of channels, H is the height, and W is the width.
+
+    Raises:
+    - NotImplementedError: If the video format is not supported.
+
+    The function first determines the format of the video file by its extension.
+    For GIFs, it iterates over each frame and converts them to RGB.
+    For PNGs, it reads the single frame, converts it to RGB.
+    For MP4s, it reads the frames using the VideoReader class and converts them to NumPy arrays.
+    If a data_transform is provided, it is applied to the buffer before converting it to a tensor.
+    Finally, the tensor is permuted to match the expected (T, C, H, W) format.
+    If the frame cache is enabled (see `enable_frame_cache`), every video is decoded only once.
+    """
+    buffer = None
+    if _frame_cache is not None:
+        # the file stats are part of the key, so that re-generated videos with the same name are decoded again
+        stat = os.stat(video_path)
+        cache_key = (
+            os.path.abspath(video_path),
+            stat.st_mtime_ns,
+            stat.st_size,
+            width,
+            height,
+        )
+        buffer = _frame_cache.get(cache_key)
+    if buffer is None:
+        buffer = decode_video(video_path, width=width, height=height)
+        if _frame_cache is not None:
+            _frame_cache.put(cache_key, buffer)
+
     frames = buffer
     if num_frames:
         frame_indices = get_frame_indices(num_frames, len(frames), sample="middle")
@@ -9,6 +9,7 @@ from pathlib import Path
 import numpy as np
 import torch
 from einops import rearrange, repeat
+from loguru import logger
 from omegaconf import OmegaConf
 from pytorch_lightning import seed_everything
 from tqdm import tqdm, trange
@@ -212,12 +213,26 @@ def run_inference(args, gpu_num=1, rank=0, **kwargs):
     inference_config = config.pop("inference", OmegaConf.create(flags={"allow_objects": True}))
     seed_everything(inference_config.seed)
 
+    # launched with torchrun: bind every rank to its own gpu before the flow allocates anything
+    rank, gpu_num = GenerationBase.get_dist_info()
+    if gpu_num > 1 and torch.cuda.is_available():
+        torch.cuda.set_device(int(os.getenv("LOCAL_RANK", rank)))
+
     # 1. create flow
     # 1.1 init class on meta
     # 1.2 load weight to cpu
     # 1.3 vram management (default to cuda)
     flow_config = config.pop("flow", OmegaConf.create(flags={"allow_objects": True}))
     flow : GenerationBase = instantiate_from_config(flow_config, resolve=True)
+
+    # flows running sequence/tensor parallel have initialized the process group already,
+    # the others shard the prompts over the ranks (see `InferenceBase.get_data_parallel_info`)
+    if gpu_num > 1 and not torch.distributed.is_initialized():
+        torch.distributed.init_process_group("nccl", init_method="env://")
+    flow.sync_savedir(inference_config)
+    dp_rank, dp_size = flow.get_data_parallel_info()
+    logger.info(f"Rank {rank}/{gpu_num}: data parallel rank {dp_rank}/{dp_size}")
+
     flow.from_pretrained(inference_config.ckpt_path)
     flow.enable_vram_management()
     flow.eval()
@@ -225,6 +240,8 @@ def run_inference(args, gpu_num=1, rank=0, **kwargs):
     # 2. flow inference
     decorated_inference = monitor_resources(return_metrics=True)(flow.inference)
     metrics = decorated_inference(inference_config) 
+    # videos still being encoded in the background
+    flow.flush_videos()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,71 @@
+import argparse
+import os
+import sys
+
+import torch
+from omegaconf import OmegaConf
+from pytorch_lightning import seed_everything
+from torch.utils.data import DataLoader, Subset
+
+sys.path.insert(0, os.getcwd())
+from videotuna.data.latent_cache import precompute_latent_cache
+from videotuna.utils.common_utils import instantiate_from_config
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--base",
+        "-b",
+        nargs="*",
+        metavar="base_config.yaml",
+        help="paths to the training configs, the `train.data.params.train` dataset is cached",
+        default=list(),
+    )
+    parser.add_argument(
+        "--ckpt", type=str, default=None, help="pretrained checkpoint dir"
+    )
+    parser.add_argument("--cache_dir", type=str, required=True, help="latent cache dir")
+    parser.add_argument(
+        "--shard_size", type=int, default=1024, help="samples per shard"
+    )
+    parser.add_argument("--bs", type=int, default=8, help="batch size for encoding")
+    parser.add_argument("--num_workers", type=int, default=8, help="dataloader workers")
+    parser.add_argument(
+        "--seed", type=int, default=20230211, help="seed for the augmentations"
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    args, unknown = get_parser().parse_known_args()
+    # launched with torchrun, every rank encodes a disjoint part of the dataset
+    local_rank = int(os.environ.get("LOCAL_RANK", 0))
+    global_rank = int(os.environ.get("RANK", 0))
+    num_rank = int(os.environ.get("WORLD_SIZE", 1))
+    seed_everything(args.seed + global_rank)
+
+    configs = [OmegaConf.load(cfg) for cfg in args.base]
+    config = OmegaConf.merge(*configs, OmegaConf.from_dotlist(unknown))
+    train_config = config.pop("train", OmegaConf.create())
+
+    flow = instantiate_from_config(config.flow)
+    flow.from_pretrained(args.ckpt)
+    # only the frozen encoders are needed
+    flow.denoiser.cpu()
+    flow.first_stage_model.to(f"cuda:{local_rank}")
+    flow.cond_stage_model.to(f"cuda:{local_rank}")
+    flow.eval()
+
+    dataset = instantiate_from_config(train_config.data.params.train)
+    dataset = Subset(dataset, list(range(global_rank, len(dataset), num_rank)))
+    dataloader = DataLoader(
+        dataset, batch_size=args.bs, num_workers=args.num_workers, shuffle=False
+    )
+    with torch.autocast("cuda", dtype=torch.bfloat16):
+        writer = precompute_latent_cache(
+            flow, dataloader, args.cache_dir, args.shard_size, rank=global_rank
+        )
+    print(
+        f"[rank{global_rank}] cached {len(writer.samples)} samples in {len(writer.shards)} shards."
+    )
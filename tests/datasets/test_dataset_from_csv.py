@@ -65,6 +65,22 @@ class TestDatasets(unittest.TestCase):
         self.assertEqual(len(dataset), 128)
         self.assertEqual(dataset[0]["video"].shape[2], 256)
 
+    def test_video_dataset_partial_decode(self):
+        if not os.path.exists("videotuna/data/toy_videos"):
+            self.skipTest("toy videos are not available")
+        for decode_downscale in [False, True]:
+            dataset = DatasetFromCSV(
+                "videotuna/data/anno_files/toy_video_dataset.csv",
+                "videotuna/data/toy_videos",
+                num_frames=16,
+                decode_downscale=decode_downscale,
+            )
+            for i in range(min(3, len(dataset))):
+                video = dataset[i]["video"]
+                self.assertEqual(tuple(video.shape), (3, 16, 256, 256))
+                self.assertGreaterEqual(video.min().item(), -1)
+                self.assertLessEqual(video.max().item(), 1)
+
     def test_image_dataset_from_csv(self):
         transform_image = transforms.get_transforms_image()
         if not os.path.exists("videotuna/data/toy_images"):
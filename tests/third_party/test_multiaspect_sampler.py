@@ -0,0 +1,90 @@
+import sys
+
+sys.path.append(".")
+
+import unittest
+from unittest import mock
+
+import videotuna.third_party.flux.multiaspect.sampler as sampler_module
+from videotuna.third_party.flux.multiaspect.sampler import MultiAspectSampler
+
+
+class FakeMetadataBackend:
+    def __init__(self, buckets):
+        self.id = "test"
+        self.instance_data_dir = "/data"
+        self.aspect_ratio_bucket_indices = buckets
+        self.seen_images = {}
+
+    def is_seen(self, image_path):
+        return image_path in self.seen_images
+
+    def mark_batch_as_seen(self, image_paths):
+        for image_path in image_paths:
+            self.seen_images[image_path] = True
+
+    def reset_seen_images(self):
+        self.seen_images = {}
+
+    def get_metadata_by_filepath(self, image_path):
+        return {"crop_coordinates": (0, 0)}
+
+
+class TestMultiAspectSampler(unittest.TestCase):
+
+    def setUp(self):
+        state_tracker = mock.Mock()
+        state_tracker.get_args.return_value.model_type = "flux"
+        state_tracker.get_conditioning_dataset.return_value = None
+        prompt_handler = mock.Mock()
+        prompt_handler.magic_prompt.return_value = "a prompt"
+        for name, value in [
+            ("StateTracker", state_tracker),
+            ("PromptHandler", prompt_handler),
+        ]:
+            patcher = mock.patch.object(sampler_module, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make_sampler(self, buckets, batch_size):
+        metadata_backend = FakeMetadataBackend(buckets)
+        sampler = MultiAspectSampler(
+            id="test",
+            metadata_backend=metadata_backend,
+            data_backend=mock.Mock(id="test"),
+            accelerator=mock.Mock(),
+            batch_size=batch_size,
+        )
+        sampler.logger = mock.Mock()
+        return sampler
+
+    def test_unseen_images_are_a_copy(self):
+        sampler = self.make_sampler({"1.0": [f"a{i}.png" for i in range(4)]}, 2)
+        unseen = sampler._get_unseen_images("1.0")
+        unseen.clear()
+        self.assertEqual(len(sampler._get_unseen_images("1.0")), 4)
+        sampler._mark_batch_as_seen(["/data/a0.png", "/data/a1.png"], "1.0")
+        self.assertEqual(
+            sorted(sampler._get_unseen_images("1.0")), ["/data/a2.png", "/data/a3.png"]
+        )
+
+    def test_next_bucket_is_not_exhausted_after_a_full_batch(self):
+        # the first bucket has fewer than two batches, drawing from it must not
+        # retire the bucket that is chosen after the batch is yielded
+        sampler = self.make_sampler(
+            {
+                "1.0": [f"a{i}.png" for i in range(6)],
+                "1.5": [f"b{i}.png" for i in range(8)],
+            },
+            4,
+        )
+        batches = iter(sampler)
+        first = next(batches)
+        second = next(batches)
+        self.assertTrue(all("/a" in sample["image_path"] for sample in first))
+        self.assertTrue(all("/b" in sample["image_path"] for sample in second))
+        self.assertNotIn("1.5", sampler.exhausted_buckets)
+
+
+if __name__ == "__main__":
+    unittest.main()
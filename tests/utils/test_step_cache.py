@@ -0,0 +1,131 @@
+import sys
+
+sys.path.append(".")
+
+import unittest
+
+import torch
+import torch.nn as nn
+
+from videotuna.utils.step_cache import StepCache
+
+
+class TinyDiT(nn.Module):
+    """A toy DiT whose first block input is modulated by the timestep, like the video DiTs."""
+
+    def __init__(self, dim=8, num_blocks=2):
+        super().__init__()
+        self.time_in = nn.Linear(1, 2 * dim)
+        self.blocks = nn.ModuleList([nn.Linear(dim, dim) for _ in range(num_blocks)])
+        self.step_cache = None
+        self.calls = []
+
+    def forward(self, x, t):
+        shift, scale = self.time_in(t[:, None]).chunk(2, dim=-1)
+
+        def run_blocks(x, index):
+            self.calls.append(index)
+            for block in self.blocks:
+                x = x + torch.tanh(block(x))
+            return x
+
+        if self.step_cache is None:
+            return run_blocks(x, None)
+        modulated = x * (1 + scale[:, None]) + shift[:, None]
+        return self.step_cache(x, modulated, run_blocks)
+
+
+def denoise(model, x, timesteps):
+    outputs = []
+    for t in timesteps:
+        out = model(x, t)
+        outputs.append(out)
+        x = x - 0.1 * out
+    return outputs
+
+
+class TestStepCache(unittest.TestCase):
+
+    def setUp(self):
+        torch.manual_seed(0)
+        self.model = TinyDiT().eval()
+        self.x = torch.randn(2, 4, 8)
+        self.timesteps = [torch.full((2,), 1.0 - i / 6) for i in range(6)]
+
+    @torch.no_grad()
+    def test_zero_threshold_matches_uncached(self):
+        reference = denoise(self.model, self.x, self.timesteps)
+        self.model.step_cache = StepCache(threshold=0.0)
+        self.model.step_cache.reset(len(self.timesteps))
+        cached = denoise(self.model, self.x, self.timesteps)
+        for ref, out in zip(reference, cached):
+            self.assertTrue(torch.equal(ref, out))
+        report = self.model.step_cache.report()
+        self.assertEqual(report["steps"], 6)
+        self.assertEqual(report["computed"], [6, 6])
+        self.assertEqual(report["skipped"], [0, 0])
+
+    @torch.no_grad()
+    def test_warmup_and_cooldown_are_computed(self):
+        cache = StepCache(threshold=1e9, warmup_steps=2, cooldown_steps=1)
+        self.model.step_cache = cache
+        cache.reset(len(self.timesteps))
+        denoise(self.model, self.x, self.timesteps)
+        self.assertEqual(self.model.calls, [None, None, None])
+        self.assertEqual(cache.report()["computed"], [3, 3])
+        self.assertEqual(cache.report()["skipped"], [3, 3])
+
+        # a skipped step adds the residual of the last computed step
+        cache.reset(len(self.timesteps))
+        x = self.x
+        outputs = []
+        for t in self.timesteps[:3]:
+            outputs.append(self.model(x, t))
+        residual = outputs[1] - x
+        self.assertTrue(torch.allclose(outputs[2], x + residual))
+
+    @torch.no_grad()
+    def test_max_consecutive_skips(self):
+        cache = StepCache(
+            threshold=1e9, warmup_steps=1, cooldown_steps=0, max_consecutive_skips=1
+        )
+        self.model.step_cache = cache
+        cache.reset(len(self.timesteps))
+        denoise(self.model, self.x, self.timesteps)
+        self.assertEqual(cache.report()["computed"], [3, 3])
+        self.assertEqual(cache.report()["skipped"], [3, 3])
+
+    @torch.no_grad()
+    def test_batch_slots_are_cached_separately(self):
+        reference = TinyDiT()
+        reference.load_state_dict(self.model.state_dict())
+        cache = StepCache(threshold=0.5, warmup_steps=1, cooldown_steps=0)
+        self.model.step_cache = cache
+        cache.reset(2)
+        self.model(self.x, torch.tensor([1.0, 1.0]))
+        # the first slot keeps its input, the second one changes completely
+        x = self.x.clone()
+        x[1] = torch.randn(4, 8) * 10
+        out = self.model(x, torch.tensor([1.0, 1.0]))
+        self.assertEqual(self.model.calls, [None, [1]])
+        self.assertEqual(cache.report()["computed"], [1, 2])
+        self.assertEqual(cache.report()["skipped"], [1, 0])
+        self.assertTrue(
+            torch.allclose(out[1], reference(x, torch.tensor([1.0, 1.0]))[1])
+        )
+        self.assertTrue(
+            torch.allclose(out[0], reference(self.x, torch.tensor([1.0, 1.0]))[0])
+        )
+
+    def test_from_config(self):
+        self.assertIsNone(StepCache.from_config(None))
+        self.assertIsNone(StepCache.from_config({"enabled": False, "threshold": 0.2}))
+        cache = StepCache.from_config(
+            {"enabled": True, "threshold": 0.2, "coefficients": [2.0, 0.0]}
+        )
+        self.assertEqual(cache.threshold, 0.2)
+        self.assertAlmostEqual(cache._rescale(0.1), 0.2)
+
+
+if __name__ == "__main__":
+    unittest.main()
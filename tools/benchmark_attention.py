@@ -0,0 +1,169 @@
+"""
+Micro-benchmark of the LVDM attention backends (einsum / sdpa / xformers).
+For every backend it reports the latency and, on GPU, the peak memory of one forward of
+a spatial self-attention, a spatial cross-attention and a temporal attention layer,
+and the max abs difference to the einsum reference.
+
+    python tools/benchmark_attention.py --device cuda --dtype fp16
+    python tools/benchmark_attention.py --device cpu --height 16 --width 16
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.getcwd())
+from videotuna.models.lvdm.modules.attention import (
+    XFORMERS_IS_AVAILBLE,
+    CrossAttention,
+)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu"
+    )
+    parser.add_argument(
+        "--dtype", type=str, default="fp32", choices=["fp32", "fp16", "bf16"]
+    )
+    parser.add_argument("--batch_size", type=int, default=2, help="videos per batch")
+    parser.add_argument("--frames", type=int, default=16, help="latent frames")
+    parser.add_argument("--height", type=int, default=40, help="latent height")
+    parser.add_argument("--width", type=int, default=64, help="latent width")
+    parser.add_argument(
+        "--dim", type=int, default=320, help="channels of the attention layer"
+    )
+    parser.add_argument("--heads", type=int, default=5)
+    parser.add_argument("--context_dim", type=int, default=1024)
+    parser.add_argument("--context_len", type=int, default=77)
+    parser.add_argument(
+        "--relative_position",
+        action="store_true",
+        help="temporal attention with relative positions",
+    )
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--iters", type=int, default=10)
+    return parser
+
+
+def synchronize(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+
+@torch.no_grad()
+def benchmark(layer, inputs, device, warmup, iters):
+    for _ in range(warmup):
+        layer(*inputs)
+    synchronize(device)
+    if device.type == "cuda":
+        torch.cuda.reset_peak_memory_stats(device)
+        base_memory = torch.cuda.memory_allocated(device)
+    start = time.perf_counter()
+    for _ in range(iters):
+        out = layer(*inputs)
+    synchronize(device)
+    latency = (time.perf_counter() - start) / iters * 1000
+    peak_memory = None
+    if device.type == "cuda":
+        peak_memory = (torch.cuda.max_memory_allocated(device) - base_memory) / 1024**2
+    return out, latency, peak_memory
+
+
+def run_case(name, build_layer, inputs, backends, args, device, dtype):
+    print(f"\n[{name}] input {tuple(inputs[0].shape)}")
+    reference = None
+    state_dict = None
+    for backend in backends:
+        layer = build_layer(backend)
+        if layer.attention_backend != backend:
+            print(f"  {backend:>8}: not available")
+            continue
+        if state_dict is None:
+            state_dict = layer.state_dict()
+        layer.load_state_dict(state_dict)
+        layer = layer.to(device=device, dtype=dtype).eval()
+        try:
+            out, latency, peak_memory = benchmark(
+                layer, inputs, device, args.warmup, args.iters
+            )
+        except RuntimeError as e:
+            # e.g. the einsum similarity matrix does not fit in memory
+            print(f"  {backend:>8}: failed ({str(e).splitlines()[0]})")
+            continue
+        if reference is None:
+            reference = out.float()
+        diff = (out.float() - reference).abs().max().item()
+        memory = f"{peak_memory:9.1f} MB" if peak_memory is not None else "      n/a"
+        print(f"  {backend:>8}: {latency:9.2f} ms  peak {memory}  max diff {diff:.2e}")
+        del layer, out
+        if device.type == "cuda":
+            torch.cuda.empty_cache()
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+    device = torch.device(args.device)
+    dtype = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}[
+        args.dtype
+    ]
+    backends = ["einsum", "sdpa"] + (["xformers"] if XFORMERS_IS_AVAILBLE else [])
+    d_head = args.dim // args.heads
+    b, t, h, w = args.batch_size, args.frames, args.height, args.width
+    torch.manual_seed(0)
+
+    # spatial attention runs on (b t) images of h*w tokens
+    x = torch.randn(b * t, h * w, args.dim, device=device, dtype=dtype)
+    context = torch.randn(
+        b * t, args.context_len, args.context_dim, device=device, dtype=dtype
+    )
+    run_case(
+        "spatial self-attention",
+        lambda backend: CrossAttention(
+            args.dim, heads=args.heads, dim_head=d_head, attention_backend=backend
+        ),
+        (x,),
+        backends,
+        args,
+        device,
+        dtype,
+    )
+    run_case(
+        "spatial cross-attention",
+        lambda backend: CrossAttention(
+            args.dim,
+            context_dim=args.context_dim,
+            heads=args.heads,
+            dim_head=d_head,
+            attention_backend=backend,
+        ),
+        (x, context),
+        backends,
+        args,
+        device,
+        dtype,
+    )
+    del x, context
+
+    # temporal attention runs on (b h w) sequences of t tokens
+    x = torch.randn(b * h * w, t, args.dim, device=device, dtype=dtype)
+    run_case(
+        "temporal",
+        lambda backend: CrossAttention(
+            args.dim,
+            heads=args.heads,
+            dim_head=d_head,
+            relative_position=args.relative_position,
+            temporal_length=t,
+            attention_backend=backend,
+        ),
+        (x,),
+        backends,
+        args,
+        device,
+        dtype,
+    )
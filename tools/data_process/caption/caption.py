@@ -1,9 +1,14 @@
 import argparse
 import copy
 import glob
+import itertools
 import json
 import os
+import subprocess
+import sys
 import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from operator import attrgetter
 
 import cv2
@@ -83,6 +88,94 @@ def load_video(video_path, max_frames_num):
     return spare_frames  # (frames, height, width, channels)
 
 
+def load_sample(video_path, max_frames_num):
+    """decode the sampled frames and read the metadata of a video with a single open"""
+    vr = VideoReader(video_path, ctx=cpu(0))
+    total_frame_num = len(vr)
+    video_fps = vr.get_avg_fps()
+    frame_idx = np.linspace(0, total_frame_num - 1, max_frames_num, dtype=int).tolist()
+    frames = vr.get_batch(frame_idx).asnumpy()  # (frames, height, width, channels)
+    return {
+        "video_path": video_path,
+        "frames": frames,
+        "duration": total_frame_num / video_fps,
+        "fps": video_fps,
+        "height": frames.shape[1],
+        "width": frames.shape[2],
+    }
+
+
+def prefetch_samples(video_list, num_frame, num_workers=4, prefetch=16):
+    """yield the samples of `video_list` in order, while a pool of threads decodes the next `prefetch` videos"""
+    videos = iter(video_list)
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        futures = deque(
+            (video_path, pool.submit(load_sample, video_path, num_frame))
+            for video_path in itertools.islice(videos, prefetch)
+        )
+        while futures:
+            video_path, future = futures.popleft()
+            for next_path in itertools.islice(videos, 1):
+                futures.append(
+                    (next_path, pool.submit(load_sample, next_path, num_frame))
+                )
+            try:
+                yield future.result()
+            except Exception as e:
+                print(f"An error occurred while loading {video_path}:", e)
+
+
+def batched(iterable, batch_size):
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, batch_size)):
+        yield batch
+
+
+def load_done_videos(out_dir):
+    """the index of already captioned videos, from the jsonl shards and the legacy per-video json files"""
+    done = set()
+    for name in os.listdir(out_dir):
+        path = os.path.join(out_dir, name)
+        if name.endswith(".jsonl"):
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        done.add(json.loads(line)["basic"]["clip_path"])
+                    except (json.JSONDecodeError, KeyError):
+                        # a line cut by an interrupted run
+                        continue
+        elif name.endswith(".json"):
+            done.add(os.path.splitext(name)[0])
+    return done
+
+
+def build_input_ids(tokenizer, device):
+    conv_template = "qwen_1_5"
+    question = f"{DEFAULT_IMAGE_TOKEN}\nPlease use no more than two sentences to generate a detailed video caption that describes the scene comprehensively and accurately. The caption should include specific elements such as the individuals, the setting, any notable objects or weather conditions, and the general atmosphere. The focus should be on providing a clear and precise description to help someone who cannot see the video understand the scene fully. Just describe the video content without making any comment or interpretation on it."
+    conv = copy.deepcopy(conv_templates[conv_template])
+    conv.append_message(conv.roles[0], question)
+    conv.append_message(conv.roles[1], None)
+    prompt_question = conv.get_prompt()
+    return (
+        tokenizer_image_token(
+            prompt_question, tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt"
+        )
+        .unsqueeze(0)
+        .to(device)
+    )
+
+
+def left_pad(input_ids_list, pad_token_id):
+    """left pad a list of [1, L] prompts into a batch, with the attention mask"""
+    max_len = max(ids.shape[1] for ids in input_ids_list)
+    input_ids = input_ids_list[0].new_full((len(input_ids_list), max_len), pad_token_id)
+    attention_mask = torch.zeros_like(input_ids, dtype=torch.bool)
+    for i, ids in enumerate(input_ids_list):
+        input_ids[i, max_len - ids.shape[1] :] = ids[0]
+        attention_mask[i, max_len - ids.shape[1] :] = True
+    return input_ids, attention_mask
+
+
 def inference(args):
     warnings.filterwarnings("ignore")
     # Load the OneVision model
@@ -97,89 +190,112 @@ def inference(args):
     model.eval()
     num = args.num_process
     no = args.mp_no
-    save_path = args.out_dir
     video_list = sorted(glob.glob(args.vid_dir + "/*mp4"))
     length = len(video_list)
     if no != num - 1:
         video_list = video_list[length // num * no : length // num * (no + 1)]
     else:
         video_list = video_list[length // num * no :]
+    done = load_done_videos(args.out_dir)
     video_list = [
         data
         for data in video_list
-        if not os.path.exists(
-            save_path + "/" + os.path.splitext(os.path.basename(data))[0] + ".json"
-        )
+        if data not in done and os.path.splitext(os.path.basename(data))[0] not in done
     ]
 
-    for video in tqdm.tqdm(video_list):
-        try:
-            video_path = video
-            # Load and process video
-            video_frames = load_video(video_path, args.num_frame)
-            # print(video_frames.shape) # (16, 1024, 576, 3)
-            image_tensors = []
-            frames = (
-                image_processor.preprocess(video_frames, return_tensors="pt")[
-                    "pixel_values"
+    # the prompt is the same for every video
+    input_ids = build_input_ids(tokenizer, device)
+    pad_token_id = (
+        tokenizer.pad_token_id
+        if tokenizer.pad_token_id is not None
+        else tokenizer.eos_token_id
+    )
+    out_path = os.path.join(args.out_dir, f"captions_{no:03d}.jsonl")
+
+    with open(out_path, "a") as out_file:
+        samples = prefetch_samples(
+            video_list, args.num_frame, num_workers=args.num_workers
+        )
+        for batch in tqdm.tqdm(
+            batched(samples, args.bs), total=(len(video_list) + args.bs - 1) // args.bs
+        ):
+            try:
+                image_tensors = [
+                    image_processor.preprocess(sample["frames"], return_tensors="pt")[
+                        "pixel_values"
+                    ]
+                    .half()
+                    .cuda()
+                    for sample in batch
                 ]
-                .half()
-                .cuda()
-            )
-            image_tensors.append(frames)
-
-            # Prepare conversation input
-            conv_template = "qwen_1_5"
-            question = f"{DEFAULT_IMAGE_TOKEN}\nPlease use no more than two sentences to generate a detailed video caption that describes the scene comprehensively and accurately. The caption should include specific elements such as the individuals, the setting, any notable objects or weather conditions, and the general atmosphere. The focus should be on providing a clear and precise description to help someone who cannot see the video understand the scene fully. Just describe the video content without making any comment or interpretation on it."
-            conv = copy.deepcopy(conv_templates[conv_template])
-            conv.append_message(conv.roles[0], question)
-            conv.append_message(conv.roles[1], None)
-            prompt_question = conv.get_prompt()
-
-            input_ids = (
-                tokenizer_image_token(
-                    prompt_question, tokenizer, IMAGE_TOKEN_INDEX, return_tensors="pt"
+                image_sizes = [
+                    frame.size for sample in batch for frame in sample["frames"]
+                ]
+                batch_input_ids, attention_mask = left_pad(
+                    [input_ids] * len(batch), pad_token_id
+                )
+
+                # Generate response
+                cont = model.generate(
+                    batch_input_ids,
+                    attention_mask=attention_mask,
+                    images=image_tensors,
+                    image_sizes=image_sizes,
+                    do_sample=False,
+                    temperature=0,
+                    max_new_tokens=2048,
+                    modalities=["video"] * len(batch),
+                    top_p=1,
                 )
-                .unsqueeze(0)
-                .to(device)
-            )
-            image_sizes = [frame.size for frame in video_frames]
-
-            # Generate response
-            cont = model.generate(
-                input_ids,
-                images=image_tensors,
-                image_sizes=image_sizes,
-                do_sample=False,
-                temperature=0,
-                max_new_tokens=2048,
-                modalities=["video"],
-                top_p=1,
-            )
-            text_outputs = tokenizer.batch_decode(cont, skip_special_tokens=True)
-            duration, fps, h, w = get_inf(video_path)
-            result = {
-                "basic": {
-                    "clip_duration": duration,
-                    "clip_path": video_path,
-                    "video_fps": fps,
-                    "video_resolution": [h, w],
-                },
-                "misc": {
-                    "caption": text_outputs[0],
-                },
-            }
-            with open(
-                args.out_dir
-                + "/"
-                + os.path.splitext(os.path.basename(video_path))[0]
-                + ".json",
-                "w",
-            ) as f:
-                json.dump(result, f, indent=4)
-            # print(text_outputs[0])
-        except Exception as e:
-            print("An error occurred:", e)
+                text_outputs = tokenizer.batch_decode(cont, skip_special_tokens=True)
+                for sample, text_output in zip(batch, text_outputs):
+                    result = {
+                        "basic": {
+                            "clip_duration": sample["duration"],
+                            "clip_path": sample["video_path"],
+                            "video_fps": sample["fps"],
+                            "video_resolution": [sample["height"], sample["width"]],
+                        },
+                        "misc": {
+                            "caption": text_output,
+                        },
+                    }
+                    out_file.write(json.dumps(result) + "\n")
+                out_file.flush()
+            except Exception as e:
+                print("An error occurred:", e)
+
+
+def launch(args):
+    """run one captioning process per local GPU, each on its own shard of the videos"""
+    if args.gpu_ids:
+        gpus = args.gpu_ids.split(",")
+    elif "," in args.gpus:
+        gpus = args.gpus.split(",")
+    else:
+        gpus = [str(i) for i in range(int(args.gpus))]
+    procs = []
+    for i, gpu in enumerate(gpus):
+        # the arguments appended last override the ones of the launcher
+        cmd = (
+            [sys.executable, os.path.abspath(__file__)]
+            + sys.argv[1:]
+            + [
+                "--gpus",
+                "0",
+                "--gpu_ids",
+                "",
+                "--num_process",
+                str(len(gpus) * args.num_process),
+                "--mp_no",
+                str(args.mp_no * len(gpus) + i),
+            ]
+        )
+        procs.append(
+            subprocess.Popen(cmd, env={**os.environ, "CUDA_VISIBLE_DEVICES": gpu})
+        )
+    for proc in procs:
+        proc.wait()
 
 
 if __name__ == "__main__":
@@ -202,6 +318,29 @@ if __name__ == "__main__":
     parser.add_argument("--num_frame", type=int, default=32)
     parser.add_argument("--num_process", type=int, default=1)
     parser.add_argument("--mp_no", type=int, default=0)
+    parser.add_argument("--bs", type=int, default=4, help="videos per generate call")
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=4,
+        help="threads that decode videos ahead of the model",
+    )
+    parser.add_argument(
+        "--gpus",
+        type=str,
+        default="0",
+        help="number of local GPUs (or a comma separated list of GPU ids) to shard the videos across, "
+        "0 or 1 runs in this process on the visible GPUs",
+    )
+    parser.add_argument(
+        "--gpu_ids",
+        type=str,
+        default="",
+        help="comma separated GPU ids, one process is launched per id, e.g. `--gpu_ids 3` to run on GPU 3 only",
+    )
     args = parser.parse_args()
     os.makedirs(args.out_dir, exist_ok=True)
-    inference(args)
+    if args.gpu_ids or args.gpus not in ("0", "1"):
+        launch(args)
+    else:
+        inference(args)
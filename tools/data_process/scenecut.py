@@ -6,7 +6,6 @@ import subprocess
 from typing import Any, List, Tuple, Union
 
 import tqdm
-from joblib import Parallel, delayed
 
 # Standard PySceneDetect imports:
 from scenedetect import SceneManager, VideoManager, open_video
@@ -16,9 +15,30 @@ from scenedetect.detectors import AdaptiveDetector, ContentDetector
 
 # Standard PySceneDetect imports:
 from scenedetect.frame_timecode import FrameTimecode
-from scenedetect.video_splitter import split_video_ffmpeg
 from tqdm import tqdm
 
+VIDEO_EXTS = ["mp4", "avi", "mkv", "mov", "wmv", "flv", "webm", "mpeg", "mpg"]
+
+
+def get_keyframes(video_path):
+    """timestamps (seconds) of the keyframes of the first video stream, only the keyframes are decoded"""
+    command = [
+        "ffprobe",
+        "-v",
+        "error",
+        "-select_streams",
+        "v:0",
+        "-skip_frame",
+        "nokey",
+        "-show_entries",
+        "frame=pts_time",
+        "-of",
+        "csv=p=0",
+        video_path,
+    ]
+    result = subprocess.check_output(command).decode()
+    return sorted(float(t) for t in result.split() if t.strip() not in ("", "N/A"))
+
 
 def get_video_resolution(video_path):
     command = [
@@ -86,6 +106,7 @@ class MetadataDict:
         scenes: List[List[FrameTimecode]],
         out_dir: str,
         optimal_score: float = None,
+        video_resolution: List[int] = None,
     ):
         scene = scenes[index]
         self.metadata["basic"]["video_id"] = video_id
@@ -93,7 +114,11 @@ class MetadataDict:
             os.path.basename(os.path.dirname(video_path)), os.path.basename(video_path)
         )
         self.metadata["basic"]["video_duration"] = scenes[-1][1].get_seconds()
-        self.metadata["basic"]["video_resolution"] = get_video_resolution(video_path)
+        self.metadata["basic"]["video_resolution"] = (
+            video_resolution
+            if video_resolution is not None
+            else get_video_resolution(video_path)
+        )
         self.metadata["basic"]["video_fps"] = scenes[0][0].get_framerate()
         self.metadata["basic"]["clip_id"] = f'{video_id}_{"%07d" % index}'
         self.metadata["basic"]["clip_path"] = f"{self.metadata['basic']['clip_id']}.mp4"
@@ -193,10 +218,14 @@ class MetadataDict:
         return self.metadata
 
 
-def find_scenes(video_path, threshold=30.0):
+def find_scenes(video_path, threshold=30.0, downscale=None):
     # Create our video & scene managers, then add the detector.
     video = open_video(video_path)
     scene_manager = SceneManager()
+    if downscale is not None:
+        # detect on frames downscaled by this integer factor, instead of the automatic factor
+        scene_manager.auto_downscale = False
+        scene_manager.downscale = downscale
     scene_manager.add_detector(ContentDetector(threshold=threshold))
 
     scene_manager.detect_scenes(video)
@@ -205,10 +234,144 @@ def find_scenes(video_path, threshold=30.0):
     return scene_manager.get_scene_list()
 
 
+def align_scenes_to_keyframes(scenes, keyframes):
+    """
+    Move every cut to the first keyframe at or after it, as done by a stream copy split.
+    Scenes that become empty are merged into the previous one.
+    """
+    fps = scenes[0][0].get_framerate()
+    end = scenes[-1][1]
+    cuts = []
+    for scene in scenes[1:]:
+        t = scene[0].get_seconds()
+        keyframe = next((k for k in keyframes if k >= t - 0.5 / fps), None)
+        if keyframe is None or keyframe >= end.get_seconds():
+            break
+        cut = FrameTimecode(timecode=keyframe, fps=fps)
+        if (len(cuts) == 0 and cut.get_frames() > scenes[0][0].get_frames()) or (
+            len(cuts) > 0 and cut.get_frames() > cuts[-1].get_frames()
+        ):
+            cuts.append(cut)
+    bounds = [scenes[0][0]] + cuts + [end]
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+
+def split_scenes_ffmpeg(video_path, scenes, output_pattern, stream_copy=False):
+    """
+    Export all scenes of a video with a single ffmpeg call, using the segment muxer on the scene cuts.
+    The scenes must be consecutive, as returned by `find_scenes`.
+    With `stream_copy` the packets are copied without re-encoding, so every segment starts at the
+    first keyframe at or after its cut (see `align_scenes_to_keyframes`).
+    """
+    cuts = ",".join(f"{scene[0].get_seconds():.6f}" for scene in scenes[1:])
+    command = ["ffmpeg", "-nostdin", "-y", "-v", "error"]
+    start = scenes[0][0].get_seconds()
+    if start > 0:
+        command += ["-ss", f"{start:.6f}"]
+    command += [
+        "-i",
+        video_path,
+        "-t",
+        f"{scenes[-1][1].get_seconds() - start:.6f}",
+        "-map",
+        "0:v:0",
+        "-map",
+        "0:a?",
+    ]
+    if start > 0 and len(cuts) > 0:
+        # input seeking resets the timestamps to 0
+        cuts = ",".join(f"{scene[0].get_seconds() - start:.6f}" for scene in scenes[1:])
+    if stream_copy:
+        command += ["-c", "copy"]
+    else:
+        command += [
+            "-c:v",
+            "libx264",
+            "-preset",
+            "veryfast",
+            "-crf",
+            "22",
+            "-c:a",
+            "aac",
+        ]
+        if len(cuts) > 0:
+            command += ["-force_key_frames", cuts]
+    command += ["-f", "segment", "-reset_timestamps", "1"]
+    if len(cuts) > 0:
+        command += ["-segment_times", cuts]
+    else:
+        command += ["-segment_time", "1e9"]
+    command += [output_pattern]
+    subprocess.run(command, check=True, capture_output=True)
+
+
+def skipped_record(video_path, reason):
+    """metadata line of a video without clips, so that resume does not process it again"""
+    return {
+        "skipped": {
+            "video_path": os.path.join(
+                os.path.basename(os.path.dirname(video_path)),
+                os.path.basename(video_path),
+            ),
+            "reason": reason,
+        }
+    }
+
+
+def process_video(
+    vid_dir, out_dir, vid_file, threshold=30.0, stream_copy=False, downscale=None
+):
+    """
+    detect and export the scenes of one video, and return the metadata of its clips,
+    or a single `skipped_record` if it has no scenes or fails
+    """
+    vid_name, vid_ext = vid_file.rsplit(".", 1)
+    if vid_ext not in VIDEO_EXTS:
+        return []
+    vid_path = os.path.join(vid_dir, vid_file)
+    try:
+        os.makedirs(f"{out_dir}/{vid_name}", exist_ok=True)
+        # all scenes share the source, so it is probed only once
+        video_resolution = get_video_resolution(vid_path)
+        scenes = find_scenes(vid_path, threshold=threshold, downscale=downscale)
+        if len(scenes) == 0:
+            return [skipped_record(vid_path, "no scenes")]
+        if stream_copy:
+            scenes = align_scenes_to_keyframes(scenes, get_keyframes(vid_path))
+        split_scenes_ffmpeg(
+            vid_path,
+            scenes,
+            f"{out_dir}/{vid_name}/{vid_name.replace('%', '%%')}_%07d.mp4",
+            stream_copy=stream_copy,
+        )
+        metadata_list = []
+        for index in range(len(scenes)):
+            metadata = MetadataDict()
+            metadata.set_basic_info(
+                index,
+                video_id=vid_name,
+                video_path=vid_path,
+                scenes=scenes,
+                out_dir=out_dir,
+                video_resolution=video_resolution,
+            )
+            metadata_list.append(metadata.to_dict())
+        return metadata_list
+    except subprocess.CalledProcessError as e:
+        print("FFmpeg error: ", e.stderr, " :  ", vid_path)
+        return [skipped_record(vid_path, f"ffmpeg error: {e.stderr}")]
+    except Exception as e:
+        print("An error occurred:", str(e))
+        return [skipped_record(vid_path, f"error: {e}")]
+
+
 def find_breakpoint(metadata_list):
     vid_visited = dict()
     vid_finished = []
     for clip in metadata_list:
+        if "skipped" in clip:
+            vid_finished.append(os.path.basename(clip["skipped"]["video_path"]))
+            continue
         meta_clip = MetadataDict()
         meta_clip.load_from_dict(clip)
         vid_id = os.path.basename(meta_clip.get_value("basic", "video_path"))
@@ -220,134 +383,72 @@ def find_breakpoint(metadata_list):
     return vid_finished
 
 
-def main(vid_dir, out_dir, file_list):
-    threshold = 30.0
+def load_metadata(out_jsonl_path):
+    """read the clips of a metadata jsonl, skipping a line cut by an interrupted run"""
+    metadata_list = []
+    if os.path.exists(out_jsonl_path):
+        with open(out_jsonl_path, "r") as f:
+            for line in f:
+                try:
+                    metadata_list.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return metadata_list
+
 
-    with open(os.path.join(out_dir, "metadata.json"), "a") as out_file:
+def main(
+    vid_dir, out_dir, file_list, threshold=30.0, stream_copy=False, downscale=None
+):
+    with open(os.path.join(out_dir, "metadata.jsonl"), "a") as out_file:
         for vid_file in tqdm(file_list):
-            try:
-                if "." in vid_file:
-                    vid_name, vid_ext = vid_file.rsplit(".", 1)
-                    os.makedirs(f"{out_dir}/{vid_name}", exist_ok=True)
-                else:
-                    continue
-                if vid_ext in [
-                    "mp4",
-                    "avi",
-                    "mkv",
-                    "mov",
-                    "wmv",
-                    "flv",
-                    "webm",
-                    "mpeg",
-                    "mpg",
-                ]:
-                    vid_path = os.path.join(vid_dir, vid_file)
-                    scenes = find_scenes(vid_path, threshold=threshold)
-                    for index in range(len(scenes)):
-                        metadata = MetadataDict()
-                        metadata.set_basic_info(
-                            index,
-                            video_id=vid_name,
-                            video_path=vid_path,
-                            scenes=scenes,
-                            out_dir=out_dir,
-                        )
-                        split_video_ffmpeg(
-                            vid_path,
-                            [scenes[index]],
-                            f"{out_dir}/{vid_name}/{metadata.get_value('basic', 'clip_id')}.mp4",
-                        )
-
-                        output_metadata = json.dumps(metadata.to_dict())
-                        out_file.write(output_metadata + ", ")
-            except subprocess.CalledProcessError as e:
-                print("FFmpeg error: ", e.stderr, " :  ", vid_path)
-                continue
-            except Exception as e:
-                print("An error occurred:", str(e))
+            if "." not in vid_file:
                 continue
+            metadata_list = process_video(
+                vid_dir, out_dir, vid_file, threshold, stream_copy, downscale
+            )
+            # the clips of a video are written together, so that resume sees whole videos
+            out_file.write(
+                "".join(json.dumps(metadata) + "\n" for metadata in metadata_list)
+            )
+            out_file.flush()
+
 
+def _process_video_task(task):
+    return process_video(*task)
 
-def run__process(vid_dir, out_dir, num_process):
+
+def run__process(
+    vid_dir, out_dir, num_process, threshold=30.0, stream_copy=False, downscale=None
+):
     if not os.path.isabs(vid_dir):
         vid_dir = os.path.abspath(vid_dir)
     os.makedirs(out_dir, exist_ok=True)
-    out_json_path = os.path.join(out_dir, "metadata.json")
-    finished_list = []
-    if os.path.exists(out_json_path):
-        if os.path.getsize(out_json_path) > 1:
-            with open(out_json_path, "r") as oj:
-                try:
-                    line = oj.readlines()
-                    processed_list = json.loads(
-                        line[0][:-3] + line[0][-3:].replace(", ", " ]")
-                    )
-                    finished_list = find_breakpoint(processed_list)
-                except:
-                    finished_list = []
-
-    file_list = os.listdir(vid_dir)
-    file_list = list(set(file_list) - set(finished_list))
+    out_jsonl_path = os.path.join(out_dir, "metadata.jsonl")
+    finished = set(find_breakpoint(load_metadata(out_jsonl_path)))
+
+    file_list = [
+        file
+        for file in sorted(os.listdir(vid_dir))
+        if "." in file
+        and file.rsplit(".", 1)[-1] in VIDEO_EXTS
+        and file not in finished
+    ]
     if len(file_list) == 0:
         return
-    return_flag = 1
-    for file in file_list:
-        if file.rsplit(".", 1)[-1] in [
-            "mp4",
-            "avi",
-            "mkv",
-            "mov",
-            "wmv",
-            "flv",
-            "webm",
-            "mpeg",
-            "mpg",
-        ]:
-            return_flag = 0
-            break
-    if return_flag:
-        return
 
-    if len(finished_list) > 0:
-        with open(out_json_path, "r") as oj:
-            line = oj.readlines()
-            out = line[0][:-2] + line[0][-2:].replace("]", ", ")
-        with open(out_json_path, "w") as oj:
-            oj.write(out)
-    else:
-        with open(out_json_path, "w") as oj:
-            oj.write("[")
-
-    chunk_size = (
-        len(file_list) // num_process
-        if len(file_list) >= num_process
-        else len(file_list)
-    )
-    chunks = [
-        file_list[i : i + chunk_size] for i in range(0, len(file_list), chunk_size)
+    # the videos are distributed one by one over the processes, and the main process writes the metadata
+    tasks = [
+        (vid_dir, out_dir, file, threshold, stream_copy, downscale)
+        for file in file_list
     ]
-
-    # Use joblib to allocate processes on CPUs
-    Parallel(n_jobs=num_process)(
-        delayed(main)(vid_dir, out_dir, chunk) for chunk in chunks
-    )
-    # from concurrent.futures import ProcessPoolExecutor
-    # with ProcessPoolExecutor(max_workers=num_process) as executor:
-    #     futures = []
-    #     for chunk in chunks:
-    #         future = executor.submit(main, vid_dir, out_dir, chunk)
-    #         futures.append(future)
-    #
-    #     # Get results of all tasks
-    #     for future in futures:
-    #         result = future.result()
-
-    with open(out_json_path, "r") as oj:
-        line = oj.readlines()
-        out = line[0][:-2] + " ]"
-    with open(out_json_path, "w") as oj:
-        json.dump(json.loads(out), oj)
+    with open(out_jsonl_path, "a") as out_file, mp.Pool(num_process) as pool:
+        for metadata_list in tqdm(
+            pool.imap_unordered(_process_video_task, tasks), total=len(tasks)
+        ):
+            out_file.write(
+                "".join(json.dumps(metadata) + "\n" for metadata in metadata_list)
+            )
+            out_file.flush()
 
 
 if __name__ == "__main__":
@@ -359,6 +460,27 @@ if __name__ == "__main__":
     )
     parser.add_argument("--out_dir", type=str, default="/project/llmsvgen/pengjun/tmp")
     parser.add_argument("--num_process", type=str)
+    parser.add_argument(
+        "--threshold", type=float, default=30.0, help="ContentDetector threshold"
+    )
+    parser.add_argument(
+        "--downscale",
+        type=int,
+        default=None,
+        help="integer downscale factor of the frames used for detection, by default chosen from the resolution",
+    )
+    parser.add_argument(
+        "--stream_copy",
+        action="store_true",
+        help="split without re-encoding, the cuts are moved to the next keyframe",
+    )
     args = parser.parse_args()
 
-    run__process(args.vid_dir, args.out_dir, int(args.num_process))
+    run__process(
+        args.vid_dir,
+        args.out_dir,
+        int(args.num_process),
+        threshold=args.threshold,
+        stream_copy=args.stream_copy,
+        downscale=args.downscale,
+    )
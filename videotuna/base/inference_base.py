@@ -2,16 +2,19 @@ import torch
 import os
 from einops import rearrange
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 from loguru import logger
 import json
 from omegaconf import DictConfig, OmegaConf
 
 import torch
+import torch.distributed as dist
 import torchvision
 import torchvision.transforms as transforms
 
 from videotuna.utils.args_utils import VideoMode
+from videotuna.utils.step_cache import StepCache
+from videotuna.utils.video_writer import AsyncVideoWriter
 
 
 class InferenceBase:
@@ -21,6 +24,11 @@ class InferenceBase:
     methods to define their training process.
     """
 
+    # background encoder processes of `save_videos`, 0 encodes on the calling thread
+    video_writer_workers: int = 2
+    # videos in flight before `save_videos` blocks
+    video_writer_max_pending: int = 4
+
     def __init__(self):
         pass
 
@@ -106,24 +114,74 @@ class InferenceBase:
         assert batch_tensors.dim() == 6, "Invalid batch shape."
         assert n_samples * bs == len(filenames), "Number of filenames must match the batch size."
 
+        # the videos are encoded in the background, see `flush_videos`
+        writer = self.get_video_writer()
         c = 0
         for idx, vid_tensor in enumerate(batch_tensors):
             for i in range(n_samples):
                 single_vid_tensor = vid_tensor[i]
                 savepath = os.path.join(savedir, f"{filenames[c]}.mp4")
-                self.save_video(single_vid_tensor, savepath, fps=fps)
+                writer.submit(single_vid_tensor, savepath, fps=fps)
                 c += 1
+
+    def get_video_writer(self) -> AsyncVideoWriter:
+        """
+        Get the background video writer of this flow, it is started on first use.
+        """
+        writer = self.__dict__.get("_video_writer")
+        if writer is None:
+            writer = AsyncVideoWriter(
+                num_workers=self.video_writer_workers,
+                max_pending=self.video_writer_max_pending,
+            )
+            self.__dict__["_video_writer"] = writer
+        return writer
+
+    def flush_videos(self) -> Dict[str, float]:
+        """
+        Wait until every video passed to `save_videos` or `save_videos_vbench` is written.
+
+        :return: The encode latency in seconds of every saved video, by path.
+        """
+        writer = self.__dict__.get("_video_writer")
+        if writer is None:
+            return {}
+        return writer.flush()
     
+    def setup_step_cache(self, model: torch.nn.Module, config: Optional[DictConfig], **kwargs) -> Optional[StepCache]:
+        """
+        Attach a step cache built from the `step_cache` section of the inference config to the DiT `model`.
+
+        :param model: The denoiser, it reads its `step_cache` attribute in the forward.
+        :param config: The `step_cache` section, the cache is removed if it is None or not enabled.
+        :return: The cache, to be `reset` before every generation, or None.
+        """
+        cache = StepCache.from_config(config, **kwargs)
+        model.step_cache = cache
+        if cache is not None:
+            logger.info(f"Step cache enabled with a threshold of {cache.threshold}")
+        return cache
+
     def save_metrics(self,
                      gpu: List[float],
                     time: List[float],
                     config: DictConfig,
-                    savedir: str):
+                    savedir: str,
+                    step_cache: Optional[List[dict]] = None):
+        # every data parallel rank measured its own prompts, rank 0 writes all of them
+        gathered = self.gather_across_ranks({"gpu": gpu, "time": time, "step_cache": step_cache or []})
+        if self.get_dist_info()[0] != 0:
+            return
+        gpu = [g for metrics in gathered for g in metrics["gpu"]]
+        time = [t for metrics in gathered for t in metrics["time"]]
         metrics = {
             "gpu" : gpu,
             "time": time,
             "config" : OmegaConf.to_container(config, resolve=True)
         }
+        if step_cache is not None:
+            # computed and skipped block-stack evaluations of every generation
+            metrics["step_cache"] = [r for rank_metrics in gathered for r in rank_metrics["step_cache"]]
         with open(f"{savedir}/metric.json", "w") as f:
             json.dump(metrics, f, indent=4)
 
@@ -153,12 +211,95 @@ class InferenceBase:
         sub_savedir = os.path.join(savedir, "videos")
         os.makedirs(sub_savedir, exist_ok=True)
 
+        writer = self.get_video_writer()
         for idx in range(b):
             prompt = prompts[idx]
             for n in range(n_samples):
                 filename = f"{prompt}-{n}.mp4"
                 format_file[filename] = prompt
-                self.save_video(batch_tensors[idx, n], os.path.join(sub_savedir, filename), fps=fps)
+                writer.submit(batch_tensors[idx, n], os.path.join(sub_savedir, filename), fps=fps)
+
+    def save_vbench_info(self, format_file: dict, savedir: str) -> None:
+        """
+        Merge the `save_videos_vbench` file-to-prompt mapping of all ranks into `info.json` on rank 0.
+
+        :param format_file: The mapping filled by `save_videos_vbench` on this rank.
+        :param savedir: The directory where `info.json` will be saved.
+        """
+        gathered = self.gather_across_ranks(format_file)
+        if self.get_dist_info()[0] != 0:
+            return
+        merged = {}
+        for rank_format_file in gathered:
+            merged.update(rank_format_file)
+        with open(os.path.join(savedir, "info.json"), "w") as f:
+            json.dump(merged, f)
+
+    @staticmethod
+    def get_dist_info() -> Tuple[int, int]:
+        """
+        Get the global rank and world size, from the process group if it is initialized,
+        otherwise from the environment variables set by torchrun.
+        """
+        if dist.is_available() and dist.is_initialized():
+            return dist.get_rank(), dist.get_world_size()
+        return int(os.getenv("RANK", 0)), int(os.getenv("WORLD_SIZE", 1))
+
+    def get_data_parallel_info(self) -> Tuple[int, int]:
+        """
+        Get the (rank, world_size) used to shard the inference inputs.
+        Flows that split one sample over several ranks (sequence or tensor parallel)
+        should return (0, 1), so that every rank runs every input.
+        """
+        return self.get_dist_info()
+
+    @staticmethod
+    def shard_indices(num_inputs: int, rank: int = 0, world_size: int = 1) -> List[int]:
+        """
+        Split `num_inputs` into `world_size` contiguous, balanced chunks and return the indices of `rank`.
+        Contiguous chunks keep the outputs of all ranks in input order when they are concatenated.
+        """
+        per_rank, remainder = divmod(num_inputs, world_size)
+        start = rank * per_rank + min(rank, remainder)
+        end = start + per_rank + (1 if rank < remainder else 0)
+        return list(range(start, end))
+
+    @staticmethod
+    def get_prompt_seeds(seed: Optional[int], indices: List[int]) -> List[Optional[int]]:
+        """
+        Derive one seed per prompt from its global index, so that a prompt gets the same
+        result no matter how many ranks the inputs are sharded over.
+        A negative or None seed means random and is returned as is.
+        """
+        if seed is None or seed < 0:
+            return [seed for _ in indices]
+        return [seed + idx for idx in indices]
+
+    def gather_across_ranks(self, obj: Any) -> List[Any]:
+        """
+        Gather a picklable object from every data parallel rank, in rank order.
+        """
+        _, world_size = self.get_data_parallel_info()
+        if world_size == 1 or not (dist.is_available() and dist.is_initialized()):
+            return [obj]
+        gathered = [None for _ in range(world_size)]
+        dist.all_gather_object(gathered, obj)
+        return gathered
+
+    @staticmethod
+    def sync_savedir(config: DictConfig) -> None:
+        """
+        `process_savedir` appends the current time on every rank, use the directory of rank 0 on all ranks.
+        """
+        if not (dist.is_available() and dist.is_initialized()) or dist.get_world_size() == 1:
+            return
+        savedir = [config.savedir]
+        dist.broadcast_object_list(savedir, src=0)
+        if savedir[0] != config.savedir:
+            if os.path.isdir(config.savedir) and not os.listdir(config.savedir):
+                os.rmdir(config.savedir)
+            config.savedir = savedir[0]
+        os.makedirs(config.savedir, exist_ok=True)
 
     @staticmethod
     def load_prompts_from_txt(prompt_file: str) -> List[str]:
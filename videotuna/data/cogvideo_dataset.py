@@ -1,4 +1,5 @@
 import argparse
+import hashlib
 import logging
 import math
 import os
@@ -6,12 +7,24 @@ import shutil
 from pathlib import Path
 from typing import List, Optional, Tuple, Union
 
+import numpy as np
 import torch
 from torch.utils.data import DataLoader, Dataset
 from torchvision import transforms
 
+logger = logging.getLogger(__name__)
+
 
 class VideoDataset(Dataset):
+    """
+    Video-caption dataset for CogVideoX.
+
+    By default all clips are decoded in `__init__` and kept in memory as uint8.
+    With `lazy=True` a clip is decoded in `__getitem__` instead. With `frame_cache_dir`, the decoded
+    uint8 frames of each clip are written once to a `.npy` file and memory-mapped afterwards,
+    so that every rank and dataloader worker shares the page cache instead of its own copy.
+    """
+
     def __init__(
         self,
         instance_data_root: Optional[str] = None,
@@ -28,6 +41,8 @@ class VideoDataset(Dataset):
         cache_dir: Optional[str] = None,
         id_token: Optional[str] = None,
         image_to_video: bool = False,
+        lazy: bool = False,
+        frame_cache_dir: Optional[str] = None,
     ) -> None:
         super().__init__()
 
@@ -47,6 +62,10 @@ class VideoDataset(Dataset):
         self.cache_dir = cache_dir
         self.id_token = id_token or ""
         self.image_to_video = image_to_video
+        self.lazy = lazy or frame_cache_dir is not None
+        self.frame_cache_dir = frame_cache_dir
+        if frame_cache_dir is not None:
+            os.makedirs(frame_cache_dir, exist_ok=True)
 
         if dataset_name is not None:
             self.instance_prompts, self.instance_video_paths = (
@@ -63,23 +82,30 @@ class VideoDataset(Dataset):
                 f"Expected length of instance prompts and videos to be the same but found {len(self.instance_prompts)=} and {len(self.instance_video_paths)=}. Please ensure that the number of caption prompts and videos match in your dataset."
             )
 
-        self.instance_videos = self._preprocess_data()
+        self.instance_videos = None if self.lazy else self._preprocess_data()
 
     def __len__(self):
         return self.num_instance_videos
 
     def __getitem__(self, index):
+        if self.instance_videos is not None:
+            frames = self.instance_videos[index]
+        elif self.frame_cache_dir is not None:
+            frames = self._load_cached_frames(index)
+        else:
+            frames = self._load_frames(self.instance_video_paths[index])
+        video = self._normalize(frames)
         if self.image_to_video:
-            image = self.instance_videos[index][:1].clone()
+            image = video[:1].clone()
             return {
                 "prompt": self.id_token + self.instance_prompts[index],
-                "video": self.instance_videos[index],
+                "video": video,
                 "image": image,
             }
         else:
             return {
                 "prompt": self.id_token + self.instance_prompts[index],
-                "video": self.instance_videos[index],
+                "video": video,
             }
 
     def _load_dataset_from_hub(self):
@@ -164,6 +190,31 @@ class VideoDataset(Dataset):
         return instance_prompts, instance_videos
 
     def _preprocess_data(self):
+        return [self._load_frames(filename) for filename in self.instance_video_paths]
+
+    @staticmethod
+    def _normalize(frames):
+        """uint8 frames [F, H, W, C] to float32 [F, C, H, W] in [-1, 1]"""
+        return frames.permute(0, 3, 1, 2).float().div_(127.5).sub_(1.0).contiguous()
+
+    def _frame_cache_path(self, filename):
+        key = f"{Path(filename).resolve()}-{self.height}x{self.width}-{self.max_num_frames}-{self.skip_frames_start}-{self.skip_frames_end}"
+        return os.path.join(self.frame_cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".npy")
+
+    def _load_cached_frames(self, index):
+        filename = self.instance_video_paths[index]
+        cache_path = self._frame_cache_path(filename)
+        if not os.path.exists(cache_path):
+            frames = self._load_frames(filename)
+            # write to a temporary file first, so that concurrent readers never see a partial cache
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp.npy"
+            np.save(tmp_path, frames.numpy())
+            os.replace(tmp_path, cache_path)
+            return frames
+        return torch.from_numpy(np.array(np.load(cache_path, mmap_mode="r")))
+
+    def _load_frames(self, filename):
+        """decode the selected frames of one video as uint8 [F, H, W, C]"""
         try:
             import decord
         except ImportError:
@@ -173,51 +224,38 @@ class VideoDataset(Dataset):
 
         decord.bridge.set_bridge("torch")
 
-        videos = []
-        train_transforms = transforms.Compose(
-            [
-                transforms.Lambda(lambda x: x / 255.0 * 2.0 - 1.0),
-            ]
+        video_reader = decord.VideoReader(
+            uri=filename.as_posix(), width=self.width, height=self.height
         )
+        video_num_frames = len(video_reader)
 
-        for filename in self.instance_video_paths:
-            video_reader = decord.VideoReader(
-                uri=filename.as_posix(), width=self.width, height=self.height
-            )
-            video_num_frames = len(video_reader)
-
-            start_frame = min(self.skip_frames_start, video_num_frames)
-            end_frame = max(0, video_num_frames - self.skip_frames_end)
-            if end_frame <= start_frame:
-                frames = video_reader.get_batch([start_frame])
-            elif end_frame - start_frame <= self.max_num_frames:
-                frames = video_reader.get_batch(list(range(start_frame, end_frame)))
-            else:
-                indices = list(
-                    range(
-                        start_frame,
-                        end_frame,
-                        (end_frame - start_frame) // self.max_num_frames,
-                    )
+        start_frame = min(self.skip_frames_start, video_num_frames)
+        end_frame = max(0, video_num_frames - self.skip_frames_end)
+        if end_frame <= start_frame:
+            frames = video_reader.get_batch([start_frame])
+        elif end_frame - start_frame <= self.max_num_frames:
+            frames = video_reader.get_batch(list(range(start_frame, end_frame)))
+        else:
+            indices = list(
+                range(
+                    start_frame,
+                    end_frame,
+                    (end_frame - start_frame) // self.max_num_frames,
                 )
-                frames = video_reader.get_batch(indices)
-
-            # Ensure that we don't go over the limit
-            frames = frames[: self.max_num_frames]
-            selected_num_frames = frames.shape[0]
-
-            # TODO: check this 
-            # Choose first (4k + 1) frames as this is how many is required by the VAE
-            remainder = (3 + (selected_num_frames % 4)) % 4
-            if remainder != 0:
-                frames = frames[:-remainder]
-            selected_num_frames = frames.shape[0]
-
-            assert (selected_num_frames - 1) % 4 == 0
-
-            # Training transforms
-            frames = frames.float()
-            frames = torch.stack([train_transforms(frame) for frame in frames], dim=0)
-            videos.append(frames.permute(0, 3, 1, 2).contiguous())  # [F, C, H, W]
-            # print(f"video shape end: {frames.shape}")
-        return videos
+            )
+            frames = video_reader.get_batch(indices)
+
+        # Ensure that we don't go over the limit
+        frames = frames[: self.max_num_frames]
+        selected_num_frames = frames.shape[0]
+
+        # TODO: check this 
+        # Choose first (4k + 1) frames as this is how many is required by the VAE
+        remainder = (3 + (selected_num_frames % 4)) % 4
+        if remainder != 0:
+            frames = frames[:-remainder]
+        selected_num_frames = frames.shape[0]
+
+        assert (selected_num_frames - 1) % 4 == 0
+
+        return frames.contiguous()
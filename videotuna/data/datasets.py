@@ -12,14 +12,18 @@ from torchvision.datasets.folder import pil_loader
 from torchvision.transforms import Compose
 
 from videotuna.data.datasets_utils import (
+    get_decode_size,
     is_image,
     is_video,
+    open_video,
     read_image_meta,
     read_video,
+    read_video_frames,
     read_video_meta,
 )
 from videotuna.data.transforms import (
     CheckVideo,
+    TemporalRandomCrop,
     get_transforms_image,
     get_transforms_video,
 )
@@ -64,6 +68,15 @@ class DatasetFromCSV(torch.utils.data.Dataset):
         split_val : bool
             if True, split the dataset into training and validation dataset.
 
+        partial_decode : bool
+            if True and the video transform starts with `TemporalRandomCrop`, the frame
+            indices are sampled from the frame count in the video metadata and only
+            those frames are decoded, instead of decoding the whole video and cropping.
+
+        decode_downscale : bool
+            if True (and `partial_decode` is used), the decoder resizes the frames to the
+            smallest size that keeps the aspect ratio and still covers (height, width).
+
     """
 
     def __init__(
@@ -79,6 +92,8 @@ class DatasetFromCSV(torch.utils.data.Dataset):
         train: bool = True,
         split_val: bool = False,
         image_to_video: bool = False,
+        partial_decode: bool = True,
+        decode_downscale: bool = False,
         **kwargs,
     ):
         self.csv_path = csv_path
@@ -116,6 +131,8 @@ class DatasetFromCSV(torch.utils.data.Dataset):
         self.split_val = split_val
         self.safe_data_list = set()
         self.image_to_video = image_to_video
+        self.partial_decode = partial_decode
+        self.decode_downscale = decode_downscale
         self.check_video = CheckVideo(self.resolution, frame_interval, num_frames)
 
         self.load_annotations(csv_path, data_root)
@@ -164,11 +181,7 @@ class DatasetFromCSV(torch.utils.data.Dataset):
         data = copy.deepcopy(self.data_list[index])
         path = data.pop("path")
         if is_video(path):
-            video = read_video(path)
-            video = self.check_video(
-                video, index
-            )  # filter the video with unsatisfied resolution and frames
-            video = self.transform["video"](video)
+            video = self.load_video(path, data, index)
         elif is_image(path):
             video = pil_loader(path)
             video = self.transform["image"](video)
@@ -207,6 +220,36 @@ class DatasetFromCSV(torch.utils.data.Dataset):
             data["image"] = data["video"][:, :1, :, :].clone()  # CTHW (3，1，H, W)
         return data
 
+    def load_video(self, path, data, index):
+        transform = self.transform["video"]
+        transforms = getattr(transform, "transforms", None)
+        if not (
+            self.partial_decode
+            and transforms
+            and isinstance(transforms[0], TemporalRandomCrop)
+        ):
+            video = read_video(path)
+            video = self.check_video(
+                video, index
+            )  # filter the video with unsatisfied resolution and frames
+            return transform(video)
+
+        height, width = -1, -1
+        if self.decode_downscale:
+            if data.get("height", None) and data.get("width", None):
+                src_height, src_width = data["height"], data["width"]
+            else:
+                file_meta = read_video_meta(path)
+                src_height, src_width = file_meta["height"], file_meta["width"]
+            height, width = get_decode_size(src_height, src_width, self.resolution)
+
+        video = open_video(path, height, width)
+        # filter the video with unsatisfied frames before decoding anything
+        total_frames = self.check_video.check_length(len(video))
+        frame_indices = transforms[0].get_indices(total_frames)
+        video = read_video_frames(video, frame_indices)
+        return Compose(transforms[1:])(video)
+
     def __getitem__(self, index):
         cnt = 100
         while cnt > 0:  # randomly get a good data, till 100 times
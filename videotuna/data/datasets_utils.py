@@ -1,3 +1,5 @@
+import math
+
 import cv2
 import decord
 import numpy as np
@@ -80,6 +82,50 @@ def read_video(video_path, fps=False):
         return vframes
 
 
+def open_video(video_path, height=-1, width=-1):
+    """
+    Open a video without decoding any frame. `len()` of the returned reader is
+    read from the container index, so it can be used to plan which frames to decode.
+    If `height` and `width` are given, frames are resized by the decoder itself.
+    """
+    decord.bridge.set_bridge("torch")
+    return VideoReader(video_path, ctx=cpu(0), height=height, width=width)
+
+
+def read_video_frames(video, frame_indices):
+    """
+    Decode only the frames at `frame_indices`.
+
+    Args:
+        video (str or VideoReader): video path or a reader returned by `open_video`.
+        frame_indices (list or np.ndarray): indices of the frames to decode.
+    Returns:
+        vframes (Tensor): uint8 tensor of shape [T, C, H, W]
+    """
+    if isinstance(video, str):
+        video = open_video(video)
+    frame_indices = np.clip(np.asarray(frame_indices, dtype=int), 0, len(video) - 1)
+    vframes = video.get_batch(frame_indices.tolist())
+    vframes = rearrange(vframes, "t h w c -> t c h w")
+    return vframes
+
+
+def get_decode_size(height, width, target_size):
+    """
+    Compute the smallest (height, width) that keeps the aspect ratio of the source
+    and still covers `target_size`, i.e. what `ResizeCenterCropVideo` would resize to.
+    Returns (-1, -1) if the source is not larger than that, so the decoder keeps
+    the original resolution.
+    """
+    target_h, target_w = target_size
+    scale = max(target_h / height, target_w / width)
+    if scale >= 1:
+        return -1, -1
+    return max(math.ceil(height * scale), target_h), max(
+        math.ceil(width * scale), target_w
+    )
+
+
 def read_video_meta(video_path):
     # Video fps
     cap = cv2.VideoCapture(str(video_path))
@@ -0,0 +1,213 @@
+import glob
+import json
+import os
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+INDEX_NAME = "index-rank{rank:03d}.json"
+SHARD_NAME = "rank{rank:03d}-shard{shard:05d}.{kind}.npy"
+UNCOND_NAME = "uncond_emb.npy"
+
+
+class LatentShardWriter:
+    """write VAE latent moments and text embeddings into sharded `.npy` files.
+
+    Every shard holds `shard_size` samples stacked along the first axis, so a shard can
+    be opened with `np.load(..., mmap_mode="r")` and a sample is a zero-copy slice.
+    The per-rank index file maps every sample to (shard, offset) and keeps its caption/fps.
+
+    Args:
+        cache_dir: str
+            the directory to write the shards and the index files to.
+        shard_size: int
+            the number of samples per shard.
+        dtype: np.dtype
+            the storage dtype of latents and embeddings.
+        rank: int
+            the rank of the writer, so that several processes can write to one cache.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        shard_size: int = 1024,
+        dtype: np.dtype = np.float16,
+        rank: int = 0,
+    ):
+        self.cache_dir = cache_dir
+        self.shard_size = shard_size
+        self.dtype = dtype
+        self.rank = rank
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.samples = []
+        self.shards = []
+        self._moments = []
+        self._text_embs = []
+
+    def add(
+        self,
+        moments: torch.Tensor,
+        text_emb: torch.Tensor,
+        captions: List[str],
+        fps: Optional[List[float]] = None,
+    ):
+        """add a batch of samples, `moments` is [B, 2C, T, h, w] and `text_emb` is [B, L, D]."""
+        moments = moments.detach().float().cpu().numpy().astype(self.dtype)
+        text_emb = text_emb.detach().float().cpu().numpy().astype(self.dtype)
+        for i, caption in enumerate(captions):
+            self.samples.append(
+                {
+                    "shard": len(self.shards),
+                    "offset": len(self._moments),
+                    "caption": caption,
+                    "fps": None if fps is None else float(fps[i]),
+                }
+            )
+            self._moments.append(moments[i])
+            self._text_embs.append(text_emb[i])
+            if len(self._moments) == self.shard_size:
+                self._flush()
+
+    def set_uncond_emb(self, uncond_emb: torch.Tensor):
+        """store the embedding of the empty prompt, used for classifier-free guidance dropout."""
+        uncond_emb = uncond_emb.detach().float().cpu().numpy().astype(self.dtype)
+        np.save(
+            os.path.join(self.cache_dir, UNCOND_NAME),
+            uncond_emb.reshape(uncond_emb.shape[-2:]),
+        )
+
+    def _flush(self):
+        if len(self._moments) == 0:
+            return
+        shard = len(self.shards)
+        names = {}
+        for kind, arrays in [("moments", self._moments), ("text", self._text_embs)]:
+            names[kind] = SHARD_NAME.format(rank=self.rank, shard=shard, kind=kind)
+            np.save(os.path.join(self.cache_dir, names[kind]), np.stack(arrays))
+        self.shards.append({**names, "num_samples": len(self._moments)})
+        self._moments = []
+        self._text_embs = []
+
+    def close(self):
+        self._flush()
+        index = {"shards": self.shards, "samples": self.samples}
+        with open(
+            os.path.join(self.cache_dir, INDEX_NAME.format(rank=self.rank)), "w"
+        ) as f:
+            json.dump(index, f)
+
+
+class LatentCacheDataset(torch.utils.data.Dataset):
+    """load the precomputed VAE latent moments and text embeddings written by `LatentShardWriter`.
+
+    The returned item contains `latent_moments` and `caption_emb` instead of `video`, the
+    flow recognizes these keys and skips the first stage and cond stage encoders.
+
+    Args:
+        cache_dir: str or list
+            the directory (or directories) of the latent cache.
+    """
+
+    def __init__(self, cache_dir: Union[str, List[str]], **kwargs):
+        if isinstance(cache_dir, str):
+            cache_dir = [cache_dir]
+        self.cache_dir = cache_dir
+        self.data_list = []
+        self.shard_paths = []
+        self.uncond_paths = []
+        for root in cache_dir:
+            index_files = sorted(
+                glob.glob(os.path.join(root, INDEX_NAME.replace("{rank:03d}", "*")))
+            )
+            if len(index_files) == 0:
+                raise ValueError(f"No latent cache index found in {root}.")
+            uncond_path = os.path.join(root, UNCOND_NAME)
+            for index_file in index_files:
+                with open(index_file, "r") as f:
+                    index = json.load(f)
+                shard_base = len(self.shard_paths)
+                for shard in index["shards"]:
+                    self.shard_paths.append(
+                        (
+                            os.path.join(root, shard["moments"]),
+                            os.path.join(root, shard["text"]),
+                        )
+                    )
+                    self.uncond_paths.append(
+                        uncond_path if os.path.exists(uncond_path) else None
+                    )
+                for sample in index["samples"]:
+                    self.data_list.append(
+                        {**sample, "shard": shard_base + sample["shard"]}
+                    )
+        # memory maps are opened lazily, so that every dataloader worker owns its own handles
+        self._shards = {}
+        self._unconds = {}
+
+    def _get_shard(self, shard):
+        if shard not in self._shards:
+            moments_path, text_path = self.shard_paths[shard]
+            self._shards[shard] = (
+                np.load(moments_path, mmap_mode="r"),
+                np.load(text_path, mmap_mode="r"),
+            )
+        return self._shards[shard]
+
+    def _get_uncond(self, shard):
+        path = self.uncond_paths[shard]
+        if path is None:
+            return None
+        if path not in self._unconds:
+            self._unconds[path] = torch.from_numpy(np.load(path))
+        return self._unconds[path]
+
+    def __getitem__(self, index) -> Dict:
+        sample = self.data_list[index]
+        moments, text_emb = self._get_shard(sample["shard"])
+        data = {
+            "latent_moments": torch.from_numpy(np.array(moments[sample["offset"]])),
+            "caption_emb": torch.from_numpy(np.array(text_emb[sample["offset"]])),
+            "caption": sample["caption"],
+            "fps": sample["fps"] if sample["fps"] is not None else 0,
+        }
+        uncond_emb = self._get_uncond(sample["shard"])
+        if uncond_emb is not None:
+            data["uncond_emb"] = uncond_emb
+        return data
+
+    def __len__(self):
+        return len(self.data_list)
+
+
+@torch.no_grad()
+def precompute_latent_cache(
+    flow,
+    dataloader,
+    cache_dir: str,
+    shard_size: int = 1024,
+    rank: int = 0,
+):
+    """encode every batch of `dataloader` with the frozen first stage and cond stage of `flow`.
+
+    Note that the spatial/temporal augmentations of the dataset are baked into the cache,
+    so every epoch reading from it sees the same crop of each clip.
+    """
+    writer = LatentShardWriter(cache_dir, shard_size=shard_size, rank=rank)
+    device = next(flow.first_stage_model.parameters()).device
+    if rank == 0:
+        writer.set_uncond_emb(flow.get_learned_conditioning([""]))
+    for batch in tqdm(dataloader, desc="Precompute latents"):
+        x = flow.get_input(batch, flow.first_stage_key).to(device)
+        captions = list(batch[flow.cond_stage_key])
+        moments = flow.encode_first_stage_moments(x)
+        text_emb = flow.get_learned_conditioning(captions)
+        fps = batch.get("fps", None)
+        if torch.is_tensor(fps):
+            fps = fps.tolist()
+        writer.add(moments, text_emb, captions, fps)
+    writer.close()
+    return writer
@@ -600,18 +600,25 @@ class TemporalRandomCrop(object):
         self.sample_length = num_frames * frame_interval
 
     def __call__(self, frames):
-        total_frames = len(frames)
+        frame_indice = self.get_indices(len(frames))
+        sample_frames = frames[frame_indice]
+        return sample_frames
+
+    def get_indices(self, total_frames):
+        """
+        Sample the frame indices from the number of frames only, so that the caller
+        can decode just these frames instead of the whole video.
+        """
         rand_end = max(0, total_frames - self.sample_length - 1)
         begin_index = random.randint(0, rand_end)
         end_index = min(begin_index + self.sample_length, total_frames)
         assert (
             end_index - begin_index >= self.num_frames
-        ), f"The video has not enough frames. Current frames: {len(vframes)}"
+        ), f"The video has not enough frames. Current frames: {total_frames}"
         frame_indice = np.linspace(
             begin_index, end_index - 1, self.num_frames, dtype=int
         )
-        sample_frames = frames[frame_indice]
-        return sample_frames
+        return frame_indice
 
 
 class LoadDummyVideo:
@@ -638,13 +645,13 @@ class LoadVideo:
     def __init__(self):
         pass
 
-    def __call__(self, video_path):
+    def __call__(self, video_path, frame_indices=None):
         assert video_path.split(".")[-1] in VIDEO_EXTS
         decord.bridge.set_bridge("torch")
         video = VideoReader(video_path, ctx=cpu(0))
-        video_len = len(video)
-        indexes = range(0, video_len)
-        vframes = video.get_batch(indexes)
+        if frame_indices is None:
+            frame_indices = range(0, len(video))
+        vframes = video.get_batch(list(frame_indices))
         vframes = rearrange(vframes, "t h w c -> t c h w")
         return vframes
 
@@ -660,13 +667,16 @@ class CheckVideo:
 
     def __call__(self, vframes, index):
         length = vframes.shape[0]  # [F, C, H, W]
-        h = vframes.shape[2]
-        w = vframes.shape[3]
+        self.check_length(length)
+        return vframes
+
+    def check_length(self, length):
+        """Check the frame count from the video metadata, before any decoding."""
         if length < self.frame_limit:
             raise ValueError(
                 f"The video has not enough frames. Current frames: {length}"
             )
-        return vframes
+        return length
 
 
 class LoadDummyImage:
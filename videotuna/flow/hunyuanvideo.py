@@ -2,6 +2,7 @@ import os
 import time
 import random
 import functools
+from collections import OrderedDict
 from typing import List, Optional, Tuple, Union, Dict, Any
 from omegaconf import DictConfig
 
@@ -114,6 +115,7 @@ def get_1d_rotary_pos_embed_riflex(
 def parallelize_transformer(pipe):
     transformer = pipe.transformer
     original_forward = transformer.forward
+    rope_split = {}
 
     @functools.wraps(transformer.__class__.forward)
     def new_forward(
@@ -142,15 +144,21 @@ def parallelize_transformer(pipe):
 
         x = torch.chunk(x, get_sequence_parallel_world_size(),dim=split_dim)[get_sequence_parallel_rank()]
 
-        dim_thw = freqs_cos.shape[-1]
-        freqs_cos = freqs_cos.reshape(temporal_size, h, w, dim_thw)
-        freqs_cos = torch.chunk(freqs_cos, get_sequence_parallel_world_size(),dim=split_dim - 1)[get_sequence_parallel_rank()]
-        freqs_cos = freqs_cos.reshape(-1, dim_thw)
-        dim_thw = freqs_sin.shape[-1]
-        freqs_sin = freqs_sin.reshape(temporal_size, h, w, dim_thw)
-        freqs_sin = torch.chunk(freqs_sin, get_sequence_parallel_world_size(),dim=split_dim - 1)[get_sequence_parallel_rank()]
-        freqs_sin = freqs_sin.reshape(-1, dim_thw)
-        
+        # the per-rank slices only change with the tables, which the flow memoizes
+        layout = (split_dim, temporal_size, h, w)
+        cached = rope_split.get("entry")
+        if cached is None or cached[0] is not freqs_cos or cached[1] is not freqs_sin or cached[2] != layout:
+            local_cos, local_sin = [
+                torch.chunk(
+                    freqs.reshape(temporal_size, h, w, freqs.shape[-1]),
+                    get_sequence_parallel_world_size(),
+                    dim=split_dim - 1,
+                )[get_sequence_parallel_rank()].reshape(-1, freqs.shape[-1])
+                for freqs in (freqs_cos, freqs_sin)
+            ]
+            rope_split["entry"] = (freqs_cos, freqs_sin, layout, local_cos, local_sin)
+        freqs_cos, freqs_sin = rope_split["entry"][3:]
+
         from xfuser.core.long_ctx_attention import xFuserLongContextAttention
         
         for block in transformer.double_blocks + transformer.single_blocks:
@@ -246,6 +254,8 @@ class HunyuanVideoFlow(GenerationBase):
         self.dit_weight = dit_weight
         self.ckpt_path = ckpt_path
         self.rope_theta = rope_theta
+        # (frames, height, width, rope_theta, RIFLEx k) -> cos/sin tables on the device
+        self._rotary_pos_embed_cache = OrderedDict()
 
         #i2v setting
         self.i2v_mode = i2v_mode
@@ -306,7 +316,8 @@ class HunyuanVideoFlow(GenerationBase):
             local_rank = int(os.environ['LOCAL_RANK'])
             device = torch.device(f"cuda:{local_rank}")
             torch.cuda.set_device(local_rank)  # 20250316 pftq: Set CUDA device explicitly
-            dist.init_process_group("nccl")  # 20250316 pftq: Removed device_id, rely on set_device
+            if not dist.is_initialized():
+                dist.init_process_group("nccl")  # 20250316 pftq: Removed device_id, rely on set_device
             rank = dist.get_rank()
             world_size = dist.get_world_size()
             assert world_size == self.ring_degree * self.ulysses_degree, \
@@ -422,8 +433,38 @@ class HunyuanVideoFlow(GenerationBase):
             raise ValueError(f"Size must be an integer or (height, width), got {size}.")
         return size
 
-    # 20250317 pftq: Modified to use Riflex when >192 frames
+    # number of rotary tables kept on the device, a 720p 129-frame pair takes about 120MB
+    max_cached_rotary_pos_embeds = 4
+
+    @staticmethod
+    def get_riflex_k(video_length, L_train=25):
+        """The RoPE frequency index RIFLEx adjusts for `video_length` frames, None up to 192 frames."""
+        if video_length <= 192:
+            return None
+        k = 2+((video_length + 3) // (4 * L_train))
+        return max(4, min(8, k))
+
     def get_rotary_pos_embed(self, video_length, height, width):
+        """
+        The cos/sin RoPE tables of a `video_length` x `height` x `width` video, memoized on the device
+        in float32 (the dtype of the rotary math), so repeated generations at one size reuse them.
+        """
+        key = (video_length, height, width, self.rope_theta, self.get_riflex_k(video_length))
+        if key in self._rotary_pos_embed_cache:
+            self._rotary_pos_embed_cache.move_to_end(key)
+            return self._rotary_pos_embed_cache[key]
+        freqs_cos, freqs_sin = self.compute_rotary_pos_embed(video_length, height, width)
+        freqs = (
+            freqs_cos.to(self.device_type, torch.float32),
+            freqs_sin.to(self.device_type, torch.float32),
+        )
+        self._rotary_pos_embed_cache[key] = freqs
+        while len(self._rotary_pos_embed_cache) > self.max_cached_rotary_pos_embeds:
+            self._rotary_pos_embed_cache.popitem(last=False)
+        return freqs
+
+    # 20250317 pftq: Modified to use Riflex when >192 frames
+    def compute_rotary_pos_embed(self, video_length, height, width):
         target_ndim = 3
         ndim = 5 - 2  # B, C, F, H, W -> F, H, W
         model = self.pipeline.transformer
@@ -465,8 +506,7 @@ class HunyuanVideoFlow(GenerationBase):
         assert sum(rope_dim_list) == head_dim, "sum(rope_dim_list) must equal head_dim"
     
         if actual_num_frames > 192:
-            k = 2+((actual_num_frames + 3) // (4 * L_train))
-            k = max(4, min(8, k))
+            k = self.get_riflex_k(actual_num_frames, L_train)
             logger.debug(f"actual_num_frames = {actual_num_frames} > 192, RIFLEx applied with k = {k}")
     
             # Compute positional grids for RIFLEx
@@ -682,9 +722,11 @@ class HunyuanVideoFlow(GenerationBase):
         if len(prompt_list) > 1:
             logger.warning("HunyuanVideo currently does not support batch inference, we will sample at a time")
     
-        # seeds
-        seeds = self.set_seed(seed, batch_size, num_videos_per_prompt)
-        generator = [torch.Generator(self.device_type).manual_seed(seed) for seed in seeds]
+        # seeds, derived per prompt so that the results do not depend on how the prompts are sharded
+        dp_rank, dp_size = self.get_data_parallel_info()
+        indices = self.shard_indices(len(prompt_list), dp_rank, dp_size)
+        prompt_seeds = self.get_prompt_seeds(seed, indices)
+        seeds = [self.set_seed(s, batch_size, num_videos_per_prompt) for s in prompt_seeds]
         out_dict["seeds"] = seeds
 
         # video input
@@ -695,25 +737,46 @@ class HunyuanVideoFlow(GenerationBase):
         out_dict["size"] = (target_height, target_width, target_video_length)
         filenames = self.process_savename(prompt_list, config.n_samples_prompt)
 
+        # the sequence parallel ranks hold parts of every sample, their cache distances are summed
+        step_cache = self.setup_step_cache(
+            self.pipeline.transformer,
+            config.get("step_cache", None),
+            all_reduce=dist.all_reduce if self.ulysses_degree > 1 or self.ring_degree > 1 else None,
+        )
+
         samples = []
         gpu = []
         time = []
-        for i, (prompt, i2v_image_path) in enumerate(zip(prompt_list, image_path_list)):
+        step_cache_reports = []
+        for i, prompt_seeds in zip(indices, seeds):
+            prompt, i2v_image_path = prompt_list[i], image_path_list[i]
+            generator = [torch.Generator(self.device_type).manual_seed(s) for s in prompt_seeds]
+            if step_cache is not None:
+                step_cache.reset(config.num_inference_steps)
             result_with_metrics = self.single_inference(prompt, i2v_image_path, target_video_length, generator, config)
             sample = result_with_metrics['result']
             samples.append(sample)
             gpu.append(result_with_metrics.get('gpu', -1.0))
             time.append(result_with_metrics.get('time', -1.0))
+            if step_cache is not None:
+                step_cache_reports.append(step_cache.log_report())
 
             # Save samples
-            if 'LOCAL_RANK' not in os.environ or int(os.environ['LOCAL_RANK']) == 0:
+            if dp_size > 1 or 'LOCAL_RANK' not in os.environ or int(os.environ['LOCAL_RANK']) == 0:
                 save_videos_grid(sample, f"{config.savedir}/{filenames[i]}.mp4", fps=24)
         
-        self.save_metrics(gpu=gpu, time=time, config=config, savedir=config.savedir)
+        self.save_metrics(gpu=gpu, time=time, config=config, savedir=config.savedir,
+                          step_cache=step_cache_reports if step_cache is not None else None)
         out_dict['samples'] = samples
-        out_dict['prompts'] = prompt_list
+        out_dict['prompts'] = [prompt_list[i] for i in indices]
         return out_dict
 
+    def get_data_parallel_info(self):
+        # ulysses/ring attention splits every sample over all the ranks
+        if self.ulysses_degree > 1 or self.ring_degree > 1:
+            return 0, 1
+        return self.get_dist_info()
+
     def check_video_input(self, height, width, video_length):
         if width <= 0 or height <= 0 or video_length <= 0:
             raise ValueError(
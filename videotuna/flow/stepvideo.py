@@ -27,7 +27,7 @@ from diffusers.pipelines.pipeline_utils import DiffusionPipeline
 from diffusers.utils import BaseOutput
 
 from ..utils.common_utils import monitor_resources
-from videotuna.utils.inference_utils import enable_vram_management, AutoWrappedModule, AutoWrappedLinear
+from videotuna.utils.inference_utils import enable_vram_management, AutoWrappedModule, AutoWrappedLinear, get_persistent_param_budget
 from videotuna.models.stepvideo.stepvideo.modules.model import StepVideoModel
 from videotuna.models.stepvideo.stepvideo.diffusion.scheduler import FlowMatchDiscreteScheduler
 from videotuna.models.stepvideo.stepvideo.utils import VideoProcessor, with_empty_init
@@ -58,6 +58,7 @@ class StepVideoModelFlow(GenerationBase):
         tensor_parallel_degree: int = 1,
         scale_factor: float = 1.0,
         num_persistent_param_in_dit: int = None,
+        vram_budget_gb: float = None,
         torch_dtype: torch.dtype = torch.bfloat16,
         device: str = torch.cuda.current_device(),
         enable_model_cpu_offload: bool = True,
@@ -87,6 +88,7 @@ class StepVideoModelFlow(GenerationBase):
         self.vae_scale_factor_spatial = self.vae.spatial_compression_ratio if getattr(self, "vae", None) else 16
         self.scale_factor = scale_factor
         self.num_persistent_param_in_dit = num_persistent_param_in_dit
+        self.vram_budget_gb = vram_budget_gb
         self.enable_sequential_cpu_offload = enable_sequential_cpu_offload
         self.enable_model_cpu_offload = enable_model_cpu_offload
 
@@ -157,6 +159,12 @@ class StepVideoModelFlow(GenerationBase):
         )
         dtype = next(iter(self.denoiser.parameters())).dtype
         logger.info(f"denoiser param dtype: {dtype}")
+        # the first `max_num_param` parameters of the denoiser stay on the gpu, the rest are streamed from the cpu
+        max_num_param = self.num_persistent_param_in_dit
+        if self.enable_sequential_cpu_offload and max_num_param is None and self.vram_budget_gb is not None:
+            max_num_param = get_persistent_param_budget(dtype, self.device_type, vram_budget_gb=self.vram_budget_gb)
+            logger.info(f"num_persistent_param_in_dit from a vram budget of {self.vram_budget_gb} GB: {max_num_param}")
+        persistent_onload_device = self.device_type if max_num_param is not None else onload_device
         enable_vram_management(
             self.denoiser,
             module_map = {
@@ -169,11 +177,11 @@ class StepVideoModelFlow(GenerationBase):
                 offload_dtype=dtype,
                 offload_device="cpu",
                 onload_dtype=dtype,
-                onload_device=onload_device,
+                onload_device=persistent_onload_device,
                 computation_dtype=self.torch_dtype,
                 computation_device=self.device_type,
             ),
-            max_num_param=self.num_persistent_param_in_dit,
+            max_num_param=max_num_param,
             overflow_module_config = dict(
                 offload_dtype=dtype,
                 offload_device="cpu",
@@ -279,33 +287,54 @@ class StepVideoModelFlow(GenerationBase):
         prompt_list = self.load_inference_inputs(config.prompt_file, config.mode)
         if len(prompt_list) > 1:
             logger.warning("Stepvideo currently does not support batch inference, we will sample at a time")
-        
+        filename_list = self.process_savename(prompt_list, config.n_samples_prompt)
+        dp_rank, dp_size = self.get_data_parallel_info()
+        indices = self.shard_indices(len(prompt_list), dp_rank, dp_size)
+        seeds = self.get_prompt_seeds(config.seed, indices)
+
+        # every rank of a tensor parallel group sees the whole sequence, so they decide alike
+        step_cache = self.setup_step_cache(self.denoiser, config.get("step_cache", None))
+
         videos = []
         gpu = []
         time = []
-        for prompt in prompt_list:
-            if rank == 0:
-                result_with_metrics = self.single_inference(prompt, config)
+        step_cache_reports = []
+        for idx, seed in zip(indices, seeds):
+            if rank == 0 or dp_size > 1:
+                if step_cache is not None:
+                    step_cache.reset(config.num_inference_steps)
+                result_with_metrics = self.single_inference(prompt_list[idx], config, seed=seed)
                 video  = result_with_metrics['result']
                 videos.append(video)
                 gpu.append(result_with_metrics.get('gpu', -1.0))
                 time.append(result_with_metrics.get('time', -1.0))
-        
-        if rank == 0:
+                if step_cache is not None:
+                    step_cache_reports.append(step_cache.log_report())
+
+        if rank == 0 or dp_size > 1:
             logger.info("Saving videos")
-            filenames = self.process_savename(prompt_list, config.n_samples_prompt)
+            n = config.n_samples_prompt
+            filenames = [filename_list[i * n + j] for i in indices for j in range(n)]
             processor = VideoProcessor(config.savedir)
             for video, filename in zip(videos, filenames):
                 processor.postprocess_video(video, filename)
-            self.save_metrics(gpu=gpu, time=time, config=config, savedir=config.savedir)
+        self.save_metrics(gpu=gpu, time=time, config=config, savedir=config.savedir,
+                          step_cache=step_cache_reports if step_cache is not None else None)
+
+    def get_data_parallel_info(self):
+        # tensor/sequence parallel groups share every sample
+        if self.tensor_parallel_degree > 1 or self.ulysses_degree > 1 or self.ring_degree > 1:
+            return 0, 1
+        return self.get_dist_info()
         
     
     @monitor_resources(return_metrics=True)
-    def single_inference(self, prompt, config: DictConfig):
+    def single_inference(self, prompt, config: DictConfig, seed: int = None):
         rank = int(os.getenv("RANK", 0))
         world_size = int(os.getenv("WORLD_SIZE", 1))
         local_rank = int(os.getenv("LOCAL_RANK", 0))
         device = local_rank
+        seed = config.seed if seed is None else seed
 
         neg_magic = config.uncond_prompt
         pos_magic = config.pos_prompt
@@ -348,7 +377,7 @@ class StepVideoModelFlow(GenerationBase):
             config.frames,
             torch.bfloat16,
             device,
-            torch.Generator(device=device).manual_seed(config.seed)
+            torch.Generator(device=device).manual_seed(seed)
         ).to(device)
 
         # 7. Denoising loop
@@ -384,7 +413,7 @@ class StepVideoModelFlow(GenerationBase):
                 
                 progress_bar.update()
 
-        if not torch.distributed.is_initialized() or int(torch.distributed.get_rank())==0:
+        if self.get_data_parallel_info()[1] > 1 or not torch.distributed.is_initialized() or int(torch.distributed.get_rank())==0:
             self.load_models_to_device(['first_stage_model'])
             video = self.first_stage_model.decode(latents.to(denoiser_dtype).to(device) / self.scale_factor)
             return video
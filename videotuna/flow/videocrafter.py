@@ -1,6 +1,4 @@
 import logging
-import os
-import json
 import random
 import time
 import numpy as np
@@ -23,12 +21,13 @@ from videotuna.models.lvdm.ddpm3d import DiffusionWrapper
 from videotuna.utils.distributions import DiagonalGaussianDistribution
 from videotuna.schedulers.ddim import DDIMSampler
 from videotuna.base.generation_base import GenerationBase
-from videotuna.utils.common_utils import instantiate_from_config, print_green, print_yellow
+from videotuna.utils.common_utils import instantiate_from_config, precision_to_dtype, print_green, print_yellow
 from videotuna.models.lvdm.modules.utils import (
     default,
     disabled_train,
     exists,
     extract_into_tensor,
+    framewise_apply,
     noise_like,
 )
 
@@ -93,6 +92,10 @@ class VideocrafterFlow(GenerationBase):
         logdir: Optional[Union[str, Path]] = None,
         rand_cond_frame: bool = False,
         empty_params_only: bool = False,
+        use_latent_cache: bool = False,
+        vae_frames_per_batch: Optional[int] = None,
+        vae_channels_last: bool = False,
+        vae_dtype: Optional[str] = None,
         *args, **kwargs
     ):
         super().__init__(
@@ -179,6 +182,12 @@ class VideocrafterFlow(GenerationBase):
         self.cond_stage_forward = cond_stage_forward
         self.encoder_type = encoder_type
         assert(encoder_type in ["2d", "3d"])
+        # frame-wise 2D autoencoder: frames per micro-batch (None: sized from free memory), memory format and autocast dtype
+        self.vae_frames_per_batch = vae_frames_per_batch
+        self.vae_channels_last = vae_channels_last
+        self.vae_dtype = precision_to_dtype[vae_dtype] if vae_dtype is not None else None
+        if self.vae_channels_last:
+            self.first_stage_model.to(memory_format=torch.channels_last)
         self.uncond_prob = uncond_prob
         self.classifier_free_guidance = True if uncond_prob > 0 else False
         assert(uncond_type in ["zero_embed", "empty_seq"])
@@ -198,6 +207,8 @@ class VideocrafterFlow(GenerationBase):
         self.logdir = logdir
         self.rand_cond_frame = rand_cond_frame
         self.interp_mode = interp_mode
+        # train from latents/text embeddings precomputed by `videotuna.data.latent_cache`
+        self.use_latent_cache = use_latent_cache
     
     @contextmanager
     def ema_scope(self, context=None):
@@ -222,10 +233,14 @@ class VideocrafterFlow(GenerationBase):
             assert self.scale_factor == 1., 'rather not use custom rescaling and std-rescaling simultaneously'
             # set rescale weight to 1./std of encodings
             mainlogger.info("### USING STD-RESCALING ###")
-            x = self.get_input(batch, self.first_stage_key)
-            x = x.to(self.device)
-            encoder_posterior = self.encode_first_stage(x)
-            z = self.get_first_stage_encoding(encoder_posterior).detach()
+            if "latent_moments" in batch:
+                moments = batch["latent_moments"].to(self.device, dtype=torch.float32)
+                z = self.get_first_stage_encoding(DiagonalGaussianDistribution(moments)).detach()
+            else:
+                x = self.get_input(batch, self.first_stage_key)
+                x = x.to(self.device)
+                encoder_posterior = self.encode_first_stage(x)
+                z = self.get_first_stage_encoding(encoder_posterior).detach()
             del self.scale_factor
             self.register_buffer('scale_factor', 1. / z.flatten().std())
             mainlogger.info(f"setting self.scale_factor to {self.scale_factor}")
@@ -235,6 +250,16 @@ class VideocrafterFlow(GenerationBase):
     def on_train_batch_end(self, *args, **kwargs):
         if self.use_ema:
             self.model_ema(self.model)
+
+    def on_fit_start(self):
+        if self.use_latent_cache:
+            # latents and text embeddings come from the cache, so the frozen encoders
+            # are kept on cpu. The vae decoder stays on device for logging samples.
+            self.cond_stage_model.cpu()
+            if hasattr(self.first_stage_model, "encoder"):
+                self.first_stage_model.encoder.cpu()
+            torch.cuda.empty_cache()
+            mainlogger.info("use_latent_cache: offloaded cond stage and vae encoder to cpu")
     
     def get_learned_conditioning(self, c):
         if self.cond_stage_forward is None:
@@ -266,17 +291,37 @@ class VideocrafterFlow(GenerationBase):
         results = self.get_first_stage_encoding(encoder_posterior).detach()
         return results
     
+    @torch.no_grad()
+    def encode_first_stage_moments(self, x):
+        """return the unscaled posterior parameters (mean and logvar) of the first stage"""
+        if self.encoder_type == "2d" and x.dim() == 5:
+            return self._framewise(lambda frames: self.first_stage_model.encode(frames).parameters, x)
+        encoder_posterior = self.first_stage_model.encode(x)
+        if isinstance(encoder_posterior, DiagonalGaussianDistribution):
+            return encoder_posterior.parameters
+        raise NotImplementedError(f"encoder_posterior of type '{type(encoder_posterior)}' can not be cached")
+
+    def _framewise(self, fn, x, num_pixels=None):
+        return framewise_apply(
+            fn,
+            x,
+            num_pixels=num_pixels,
+            frames_per_batch=self.vae_frames_per_batch,
+            channels_last=self.vae_channels_last,
+            dtype=self.vae_dtype,
+        )
+
     def encode_first_stage_2DAE(self, x):
-        """encode frame by frame"""
-        b, _, t, _, _ = x.shape
-        results = torch.cat([self.get_first_stage_encoding(self.first_stage_model.encode(x[:,:,i])).detach().unsqueeze(2) for i in range(t)], dim=2)
-        return results
-    
+        """encode frame by frame, with the frames batched"""
+        return self._framewise(
+            lambda frames: self.get_first_stage_encoding(self.first_stage_model.encode(frames)).detach(), x
+        )
+
     def decode_first_stage_2DAE(self, z, **kwargs):
-        """decode frame by frame"""
-        _, _, t, _, _ = z.shape
-        results = torch.cat([self.first_stage_model.decode(z[:,:,i], **kwargs).unsqueeze(2) for i in range(t)], dim=2)
-        return results
+        """decode frame by frame, with the frames batched"""
+        # the decoder activations scale with the output resolution
+        num_pixels = z.shape[-2] * z.shape[-1] * 4**self.num_downs
+        return self._framewise(lambda frames: self.first_stage_model.decode(frames, **kwargs), z, num_pixels)
 
     def _decode_core(self, z, **kwargs):
         z = 1. / self.scale_factor * z
@@ -305,6 +350,8 @@ class VideocrafterFlow(GenerationBase):
         return x
     
     def get_batch_input(self, batch, random_uncond, return_first_stage_outputs=False, return_original_cond=False, is_imgbatch=False):
+        if "latent_moments" in batch:
+            return self.get_cached_batch_input(batch, random_uncond, return_first_stage_outputs, return_original_cond)
         ## image/video shape: b, c, t, h, w
         data_key = 'jpg' if is_imgbatch else self.first_stage_key
         x = self.get_input(batch, data_key)
@@ -343,6 +390,32 @@ class VideocrafterFlow(GenerationBase):
 
         return out
 
+    def get_cached_batch_input(self, batch, random_uncond, return_first_stage_outputs=False, return_original_cond=False):
+        """same as `get_batch_input`, but takes the vae moments and text embeddings
+        precomputed by `videotuna.data.latent_cache` instead of running the frozen encoders"""
+        moments = batch["latent_moments"].to(self.device, dtype=torch.float32)
+        z = self.get_first_stage_encoding(DiagonalGaussianDistribution(moments)).detach()
+
+        cond = batch[self.cond_stage_key]
+        cond_emb = batch["caption_emb"].to(self.device, dtype=torch.float32)
+        if random_uncond:
+            if self.uncond_type == "empty_seq":
+                assert "uncond_emb" in batch, "the latent cache has no embedding of the empty prompt"
+                uncond_emb = batch["uncond_emb"].to(cond_emb)
+            else:
+                uncond_emb = torch.zeros_like(cond_emb)
+            drop = torch.rand(cond_emb.shape[0], device=self.device) < self.uncond_prob
+            cond_emb = torch.where(drop[:, None, None], uncond_emb, cond_emb)
+
+        out = [z, cond_emb]
+        if return_first_stage_outputs:
+            xrec = self.decode_first_stage(z)
+            # the source video is not kept in the cache, use the reconstruction instead
+            out.extend([xrec, xrec])
+        if return_original_cond:
+            out.append(cond)
+        return out
+
     def forward(self, x, c, **kwargs):
         if 't' in kwargs:
             t = kwargs.pop('t')
@@ -546,7 +619,9 @@ class VideocrafterFlow(GenerationBase):
                 c_emb = c_emb.to(torch.bfloat16)
 
                 # get uc: unconditional condition for classifier-free guidance sampling
-                if self.uncond_type == "empty_seq":
+                if self.uncond_type == "empty_seq" and "uncond_emb" in batch:
+                    uc = batch["uncond_emb"].to(self.device)
+                elif self.uncond_type == "empty_seq":
                     prompts = N * [""]
                     uc = self.get_learned_conditioning(prompts)
                 elif self.uncond_type == "zero_embed":
@@ -672,6 +747,7 @@ class VideocrafterFlow(GenerationBase):
             cfg_scale: float = 1.0,
             temporal_cfg_scale: Optional[float] = None,
             uncond_prompt: str = "",
+            seeds: Optional[List[int]] = None,
             **kwargs,
         ) -> None:
         """
@@ -688,6 +764,7 @@ class VideocrafterFlow(GenerationBase):
         :param cfg_scale: The scale for classifier-free guidance. Default is 1.0.
         :param temporal_cfg_scale: The scale for temporal classifier-free guidance. Default is None.
         :param uncond_prompt: The unconditional prompt for classifier-free guidance. Default is an empty string.
+        :param seeds: One seed per prompt for the initial noise. Default is None, using the global random state.
         :param kwargs: Additional keyword arguments.
         """
         # ----------------------------------------------------------------------------------
@@ -707,8 +784,21 @@ class VideocrafterFlow(GenerationBase):
 
         # ----------------------------------------------------------------------------------
         # sampling
+        noises = None
+        if seeds is not None and all(s is not None and s >= 0 for s in seeds):
+            # [n_samples_prompt, B, C, T, H, W], the noise of a prompt only depends on its own seed
+            noises = torch.stack([
+                torch.randn(
+                    (n_samples_prompt, *noise_shape[1:]),
+                    generator=torch.Generator(self.device).manual_seed(seed),
+                    device=self.device,
+                )
+                for seed in seeds
+            ], dim=1)
         batch_samples = []
-        for _ in range(n_samples_prompt):  # iter over batch of prompts
+        for n in range(n_samples_prompt):  # iter over batch of prompts
+            if noises is not None:
+                kwargs["x_T"] = noises[n]
             samples, _ = self.ddim_sampler.sample(
                 S=ddim_steps,
                 conditioning=cond,
@@ -730,11 +820,20 @@ class VideocrafterFlow(GenerationBase):
     @torch.no_grad()
     def inference(self, args, **kwargs):
         # create inference sampler
-        self.ddim_sampler = DDIMSampler(self)
+        self.ddim_sampler = DDIMSampler(
+            self,
+            guidance_memory_budget_gb=args.get("guidance_memory_budget_gb", None),
+            compile_step=args.get("compile_ddim_step", False),
+        )
         # load prompt list
         prompt_list = self.load_inference_inputs(args.prompt_file, mode=args.mode)
 
-        # TODO: inference on multiple gpus
+        # shard the prompts over the data parallel ranks, filenames are computed on the full list
+        # so that they do not depend on the sharding
+        filename_list = self.process_savename(prompt_list, args.n_samples_prompt)
+        dp_rank, dp_size = self.get_data_parallel_info()
+        indices = self.shard_indices(len(prompt_list), dp_rank, dp_size)
+        seed_list = self.get_prompt_seeds(args.seed, indices)
 
         # noise shape
         args.frames = self.temporal_length if args.frames is None else args.frames
@@ -749,13 +848,19 @@ class VideocrafterFlow(GenerationBase):
         # inference
         format_file = {}
         start = time.time()
-        n_iters = len(prompt_list) // args.bs + (
-            1 if len(prompt_list) % args.bs else 0
+        n_iters = len(indices) // args.bs + (
+            1 if len(indices) % args.bs else 0
         )
         with torch.no_grad():
             for idx in trange(0, n_iters, desc="Sample Iters"):
-                prompts = prompt_list[idx * args.bs : (idx + 1) * args.bs]
-                filenames = self.process_savename(prompts, args.n_samples_prompt)
+                batch_indices = indices[idx * args.bs : (idx + 1) * args.bs]
+                prompts = [prompt_list[i] for i in batch_indices]
+                seeds = seed_list[idx * args.bs : (idx + 1) * args.bs]
+                filenames = [
+                    filename_list[i * args.n_samples_prompt + n]
+                    for i in batch_indices
+                    for n in range(args.n_samples_prompt)
+                ]
                 ## inference
                 bs = args.bs if args.bs == len(prompts) else len(prompts)
                 noise_shape = [bs, channels, frames, h, w]
@@ -770,6 +875,8 @@ class VideocrafterFlow(GenerationBase):
                         args.unconditional_guidance_scale,
                         args.unconditional_guidance_scale_temporal,
                         args.uncond_prompt,
+                        seeds=seeds,
+                        cache_context_kv=args.get("cache_context_kv", False),
                     )
 
                 if args.standard_vbench:
@@ -779,8 +886,8 @@ class VideocrafterFlow(GenerationBase):
                 else:
                     self.save_videos(batch_samples, args.savedir, filenames, fps=args.savefps)
 
+        self.flush_videos()
         if args.standard_vbench:
-            with open(os.path.join(args.savedir, "info.json"), "w") as f:
-                json.dump(format_file, f)
+            self.save_vbench_info(format_file, args.savedir)
 
         print_green(f"Saved in {args.savedir}. Time used: {(time.time() - start):.2f} seconds")
\ No newline at end of file
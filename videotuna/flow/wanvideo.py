@@ -89,6 +89,9 @@ class WanVideoModelFlow(GenerationBase):
         self.offload_model = offload_model
         self.ulysses_size = ulysses_size
         self.ring_size = ring_size
+        self.t5_fsdp = t5_fsdp
+        self.dit_fsdp = dit_fsdp
+        self.step_cache = None
 
         rank = int(os.getenv("RANK", 0))
         world_size = int(os.getenv("WORLD_SIZE", 1))
@@ -100,13 +103,14 @@ class WanVideoModelFlow(GenerationBase):
             logger.info(
                 f"offload_model is not specified, set to {offload_model}.")
         if world_size > 1:
-            torch.cuda.set_device(local_rank)
-            dist.init_process_group(
-                backend="nccl",
-                init_method="env://",
-                rank=rank,
-                world_size=world_size)
-            logger.info("WanVideo flow: Init Process Group")
+            if not dist.is_initialized():
+                torch.cuda.set_device(local_rank)
+                dist.init_process_group(
+                    backend="nccl",
+                    init_method="env://",
+                    rank=rank,
+                    world_size=world_size)
+                logger.info("WanVideo flow: Init Process Group")
         else:
             assert not (
                 t5_fsdp or dit_fsdp
@@ -212,17 +216,19 @@ class WanVideoModelFlow(GenerationBase):
 
         # load input
         prompt_list = self.load_inference_inputs(args.prompt_file, args.mode)
-        if len(prompt_list) > 1:
-            logger.warning("WanVideo currently does not support batch inference, we will run sample at a time")
-        
-        videos = []
-        gpu = []
-        time = []
-        for prompt in prompt_list:
+        filename_list = self.process_savename(prompt_list, args.n_samples_prompt)
+        dp_rank, dp_size = self.get_data_parallel_info()
+        indices = self.shard_indices(len(prompt_list), dp_rank, dp_size)
+        seeds = self.get_prompt_seeds(self.seed, indices)
+        batch_size = max(int(args.get("bs", 1) or 1), 1)
+
+        input_prompts = []
+        for idx in indices:
+            prompt = prompt_list[idx]
             logger.info(f"Input prompt: {prompt}")
             if self.use_prompt_extend:
                 logger.info("Extending prompt ...")
-                if rank == 0:
+                if rank == 0 or dp_size > 1:
                     prompt_output = self.prompt_expander(
                         prompt,
                         tar_lang=self.prompt_extend_target_lang,
@@ -237,34 +243,48 @@ class WanVideoModelFlow(GenerationBase):
                     input_prompt = [input_prompt]
                 else:
                     input_prompt = [None]
-                if dist.is_initialized():
+                if dist.is_initialized() and dp_size == 1:
                     dist.broadcast_object_list(input_prompt, src=0)
                 prompt = input_prompt[0]
                 logger.info(f"Extended prompt: {prompt}")
+            input_prompts.append(prompt)
 
+        videos = []
+        gpu = []
+        time = []
+        step_cache_reports = []
+        for start in range(0, len(input_prompts), batch_size):
             logger.info(
                 f"Generating {'image' if 't2i' in self.task else 'video'} ...")
+            if self.step_cache is not None:
+                self.step_cache.reset(sampling_steps)
             result_with_metrics = self.wan_t2v.generate(
-                prompt,
+                input_prompts[start:start + batch_size],
                 size=SIZE_CONFIGS[size],
                 frame_num=frames,
                 shift=sample_shift,
                 sample_solver=sample_solver,
                 sampling_steps=sampling_steps,
                 guide_scale=guide_scale,
-                seed=self.seed,
+                seed=seeds[start:start + batch_size],
                 offload_model=self.offload_model)
-            video = result_with_metrics['result']
-            videos.append(video)
+            if result_with_metrics['result'] is not None:
+                videos.extend(result_with_metrics['result'])
 
             gpu.append(result_with_metrics.get('gpu', -1.0))
             time.append(result_with_metrics.get('time', -1.0))
+            if self.step_cache is not None:
+                step_cache_reports.append(self.step_cache.log_report())
 
-        if rank == 0:
+        # with data parallel every rank saves its own prompts
+        if (rank == 0 or dp_size > 1) and len(videos) > 0:
             logger.info("Saving videos")
-            filenames = self.process_savename(prompt_list, args.n_samples_prompt)
+            n = args.n_samples_prompt
+            filenames = [filename_list[i * n + j] for i in indices for j in range(n)]
             self.save_videos(torch.stack(videos).unsqueeze(dim=1), args.savedir, filenames, fps=args.savefps)
-            self.save_metrics(gpu=gpu, time=time, config=args, savedir=args.savedir)
+            self.flush_videos()
+        self.save_metrics(gpu=gpu, time=time, config=args, savedir=args.savedir,
+                          step_cache=step_cache_reports if self.step_cache is not None else None)
 
     def inference_i2v(self, args: DictConfig):
         # init vars
@@ -285,18 +305,24 @@ class WanVideoModelFlow(GenerationBase):
         
         if len(prompt_list) > 0:
             logger.warning("WanVideo currently does not support batch inference, we will run sample at a time")
-            
+        filename_list = self.process_savename(prompt_list, args.n_samples_prompt)
+        dp_rank, dp_size = self.get_data_parallel_info()
+        indices = self.shard_indices(len(prompt_list), dp_rank, dp_size)
+        seeds = self.get_prompt_seeds(self.seed, indices)
+
         videos = []
         gpu = []
         time = []
-        for prompt, image_path in zip(prompt_list, image_list):
+        step_cache_reports = []
+        for idx, seed in zip(indices, seeds):
+            prompt, image_path = prompt_list[idx], image_list[idx]
             logger.info(f"Input prompt: {prompt}")
             logger.info(f"Input image: {image_path}")
 
             img = Image.open(image_path).convert("RGB")
             if self.use_prompt_extend:
                 logger.info("Extending prompt ...")
-                if rank == 0:
+                if rank == 0 or dp_size > 1:
                     prompt_output = self.prompt_expander(
                         prompt,
                         tar_lang=self.prompt_extend_target_lang,
@@ -312,13 +338,15 @@ class WanVideoModelFlow(GenerationBase):
                     input_prompt = [input_prompt]
                 else:
                     input_prompt = [None]
-                if dist.is_initialized():
+                if dist.is_initialized() and dp_size == 1:
                     dist.broadcast_object_list(input_prompt, src=0)
                 prompt = input_prompt[0]
                 logger.info(f"Extended prompt: {prompt}")
 
 
             logger.info("Generating video ...")
+            if self.step_cache is not None:
+                self.step_cache.reset(sampling_steps)
             result_with_metrics = self.wan_i2v.generate(
                 prompt,
                 img,
@@ -328,7 +356,7 @@ class WanVideoModelFlow(GenerationBase):
                 sample_solver=sample_solver,
                 sampling_steps=sampling_steps,
                 guide_scale=guide_scale,
-                seed=self.seed,
+                seed=seed,
                 offload_model=self.offload_model)
             
             video = result_with_metrics['result']
@@ -336,19 +364,38 @@ class WanVideoModelFlow(GenerationBase):
             videos.append(video)
             gpu.append(result_with_metrics.get('gpu', -1.0))
             time.append(result_with_metrics.get('time', -1.0))
+            if self.step_cache is not None:
+                step_cache_reports.append(self.step_cache.log_report())
             del result_with_metrics
             
-        if rank == 0:
+        # with data parallel every rank saves its own prompts
+        if (rank == 0 or dp_size > 1) and len(videos) > 0:
             logger.info("Saving videos")
-            filenames = self.process_savename(prompt_list, args.n_samples_prompt)
+            n = args.n_samples_prompt
+            filenames = [filename_list[i * n + j] for i in indices for j in range(n)]
             self.save_videos(torch.stack(videos).unsqueeze(dim=1), args.savedir, filenames, fps=args.savefps)
-            self.save_metrics(gpu=gpu, time=time, config=args, savedir=args.savedir)
+            self.flush_videos()
+        self.save_metrics(gpu=gpu, time=time, config=args, savedir=args.savedir,
+                          step_cache=step_cache_reports if self.step_cache is not None else None)
+
+    def get_data_parallel_info(self):
+        # fsdp and ring/ulysses attention split every sample over all the ranks
+        if self.ulysses_size > 1 or self.ring_size > 1 or self.t5_fsdp or self.dit_fsdp:
+            return 0, 1
+        return self.get_dist_info()
 
     @torch.no_grad()
     def inference(self, args: DictConfig): 
         # check input  
         self._validate_args(args) 
 
+        # the sequence parallel ranks hold parts of every sample, their cache distances are summed
+        self.step_cache = self.setup_step_cache(
+            self.denoiser,
+            args.get("step_cache", None),
+            all_reduce=dist.all_reduce if self.ulysses_size > 1 or self.ring_size > 1 else None,
+        )
+
         # t2v mode
         if args.mode == VideoMode.T2V.value:  
             self.inference_t2v(args)
@@ -1,5 +1,6 @@
 import inspect
 import math
+from collections import OrderedDict
 from tqdm import tqdm
 from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
@@ -97,10 +98,19 @@ class CogVideoXWorkFlow(pl.LightningModule):
         learning_rate: float = 6e-6,
         adapter_config=None,
         logdir=None,  # notice: this is not configured in config.yaml but configured in train.py
+        vae_encode_batch_size: int = 4,
+        prompt_cache_size: int = 512,
     ):
         super().__init__()
         self.logdir = logdir
         self.learning_rate = learning_rate
+        # videos per VAE encode call in training
+        self.vae_encode_batch_size = vae_encode_batch_size
+        # LRU cache of the T5 embeddings of training captions, kept on cpu, used if the text encoder is frozen
+        self.prompt_cache_size = prompt_cache_size
+        self.prompt_embeds_cache = OrderedDict()
+        # rotary embeddings per (height, width, num_frames, patch_size, attention_head_dim, device)
+        self.rotary_emb_cache = {}
         
         self.instantiate_first_stage(first_stage_config)
         self.instantiate_cond_stage(cond_stage_config)
@@ -451,6 +461,9 @@ class CogVideoXWorkFlow(pl.LightningModule):
         base_height: int = 480,
         base_width: int = 720,
     ) -> Tuple[torch.Tensor, torch.Tensor]:
+        key = (height, width, num_frames, vae_scale_factor_spatial, patch_size, attention_head_dim, str(device), base_height, base_width)
+        if key in self.rotary_emb_cache:
+            return self.rotary_emb_cache[key]
 
         grid_height = height // (vae_scale_factor_spatial * patch_size)
         grid_width = width // (vae_scale_factor_spatial * patch_size)
@@ -470,6 +483,7 @@ class CogVideoXWorkFlow(pl.LightningModule):
 
         freqs_cos = freqs_cos.to(device=device)
         freqs_sin = freqs_sin.to(device=device)
+        self.rotary_emb_cache[key] = (freqs_cos, freqs_sin)
         return freqs_cos, freqs_sin
 
     @torch.no_grad()
@@ -794,6 +808,14 @@ class CogVideoXWorkFlow(pl.LightningModule):
         latent_dist = self.vae.encode(video).latent_dist
         return latent_dist
 
+    def encode_videos(self, videos):
+        """encode a batch of videos in chunks of `vae_encode_batch_size` and return the scaled latent samples"""
+        latents = []
+        for chunk in torch.split(videos, self.vae_encode_batch_size):
+            latent_dist = self.vae.encode(chunk.to(self.device, dtype=self.dtype)).latent_dist
+            latents.append(latent_dist.sample() * self.vae.config.scaling_factor)
+        return torch.cat(latents, dim=0)
+
     def get_batch_input(self, batch):
         """
         Prepare model batch inputs
@@ -801,9 +823,10 @@ class CogVideoXWorkFlow(pl.LightningModule):
         # equal to collate_fn
         # the resonable video latents range is [-5,5], approximately.
         # videos
-        videos = [self.encode_video(video) for video in batch["video"]]
-        videos = [video.sample() * self.vae.config.scaling_factor for video in videos]
-        videos = torch.cat(videos, dim=0)
+        videos = batch["video"]
+        if not torch.is_tensor(videos):
+            videos = torch.stack(list(videos))
+        videos = self.encode_videos(videos)
         videos = videos.to(memory_format=torch.contiguous_format)
         # prompt
         prompts = [item for item in batch["caption"]]
@@ -812,6 +835,37 @@ class CogVideoXWorkFlow(pl.LightningModule):
             "prompts": prompts,
         }
 
+    @torch.no_grad()
+    def get_cached_prompt_embeds(self, prompts: List[str], max_sequence_length: int = 226):
+        """
+        T5 embeddings of `prompts`, the prompts missing from the LRU cache are encoded in one call.
+        """
+        if self.prompt_cache_size <= 0 or any(p.requires_grad for p in self.cond_stage_model.parameters()):
+            return self.encode_prompt(
+                prompts,
+                do_classifier_free_guidance=False,
+                num_videos_per_prompt=1,
+                max_sequence_length=max_sequence_length,
+                device=self.device,
+            )
+        missing = list(dict.fromkeys(p for p in prompts if p not in self.prompt_embeds_cache))
+        if len(missing) > 0:
+            embeds = self.encode_prompt(
+                missing,
+                do_classifier_free_guidance=False,
+                num_videos_per_prompt=1,
+                max_sequence_length=max_sequence_length,
+                device=self.device,
+            )
+            for prompt, embed in zip(missing, embeds.cpu()):
+                self.prompt_embeds_cache[prompt] = embed
+        for prompt in prompts:
+            self.prompt_embeds_cache.move_to_end(prompt)
+        prompt_embeds = torch.stack([self.prompt_embeds_cache[p] for p in prompts]).to(self.device, non_blocking=True)
+        while len(self.prompt_embeds_cache) > self.prompt_cache_size:
+            self.prompt_embeds_cache.popitem(last=False)
+        return prompt_embeds
+
     def training_step(self, batch, batch_idx):
         batch = self.get_batch_input(batch)
         model_input = (
@@ -820,14 +874,7 @@ class CogVideoXWorkFlow(pl.LightningModule):
         prompts = batch["prompts"]
 
         max_sequence_length = 226
-        with torch.no_grad():
-            prompt_embeds = self.encode_prompt(
-                prompts,
-                do_classifier_free_guidance=False,  # set to false for train
-                num_videos_per_prompt=1,
-                max_sequence_length=max_sequence_length,
-                device=self.device,
-            )
+        prompt_embeds = self.get_cached_prompt_embeds(prompts, max_sequence_length)
 
         batch_size, num_frames, num_channels, height, width = model_input.shape
 
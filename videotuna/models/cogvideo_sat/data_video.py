@@ -3,6 +3,8 @@ import math
 import os
 import random
 import sys
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from fractions import Fraction
 from functools import partial
 from typing import Any, Dict, Optional, Tuple, Union
@@ -167,6 +169,32 @@ def pad_last_frame(tensor, num_frames):
         return tensor[:num_frames]
 
 
+def get_decode_size(video_data, image_size):
+    """
+    The smallest (height, width) with the aspect ratio of the source that still covers `image_size`,
+    so that the decoder downscales the frames and `resize_for_rectangle_crop` only has to crop.
+    Returns (-1, -1), i.e. the source resolution, if the source is not larger than `image_size`.
+    """
+    if isinstance(av, ImportError):
+        vr = VideoReader(uri=video_data, height=-1, width=-1)
+        h, w = vr[0].shape[:2]
+        del vr
+    else:
+        with av.open(video_data, metadata_errors="ignore") as container:
+            stream = container.streams.video[0]
+            h, w = stream.codec_context.height, stream.codec_context.width
+    if isinstance(video_data, io.IOBase):
+        video_data.seek(0)
+
+    if w / h > image_size[1] / image_size[0]:
+        height, width = image_size[0], int(w * image_size[0] / h)
+    else:
+        height, width = int(h * image_size[1] / w), image_size[1]
+    if height >= h or width >= w:
+        return -1, -1
+    return height, width
+
+
 def load_video(
     video_data,
     sampling="uniform",
@@ -176,9 +204,11 @@ def load_video(
     actual_fps=None,
     skip_frms_num=0.0,
     nb_read_frames=None,
+    decode_size=None,
 ):
     decord.bridge.set_bridge("torch")
-    vr = VideoReader(uri=video_data, height=-1, width=-1)
+    height, width = decode_size if decode_size is not None else (-1, -1)
+    vr = VideoReader(uri=video_data, height=height, width=width)
     if nb_read_frames is not None:
         ori_vlen = nb_read_frames
     else:
@@ -194,38 +224,49 @@ def load_video(
     else:
         raise NotImplementedError
 
-    # get_batch -> T, H, W, C
-    temp_frms = vr.get_batch(np.arange(start, end))
+    # only decode the sampled frames, get_batch -> T, H, W, C
+    temp_frms = vr.get_batch(indices)
     assert temp_frms is not None
     tensor_frms = (
         torch.from_numpy(temp_frms)
         if type(temp_frms) is not torch.Tensor
         else temp_frms
     )
-    tensor_frms = tensor_frms[torch.tensor((indices - start).tolist())]
 
     return pad_last_frame(tensor_frms, num_frames)
 
 
-import threading
+# the loads run in a pool that is reused across samples, instead of one new thread per sample
+LOAD_VIDEO_TIMEOUT = 20
+LOAD_VIDEO_WORKERS = 4
+_load_video_pool = None
+_load_video_pool_pid = None
 
 
-def load_video_with_timeout(*args, **kwargs):
-    video_container = {}
-
-    def target_function():
-        video = load_video(*args, **kwargs)
-        video_container["video"] = video
+def get_load_video_pool():
+    global _load_video_pool, _load_video_pool_pid
+    # dataloader workers are forked, every process needs its own pool
+    if _load_video_pool is None or _load_video_pool_pid != os.getpid():
+        _load_video_pool = ThreadPoolExecutor(max_workers=LOAD_VIDEO_WORKERS)
+        _load_video_pool_pid = os.getpid()
+    return _load_video_pool
 
-    thread = threading.Thread(target=target_function)
-    thread.start()
-    timeout = 20
-    thread.join(timeout)
 
-    if thread.is_alive():
+def load_video_with_timeout(*args, **kwargs):
+    global _load_video_pool
+    pool = get_load_video_pool()
+    future = pool.submit(load_video, *args, **kwargs)
+    try:
+        video = future.result(timeout=LOAD_VIDEO_TIMEOUT)
+    except FutureTimeoutError:
         print("Loading video timed out")
+        # the hung decode keeps its worker, so the pool is abandoned to it and the
+        # next load starts a fresh one instead of queueing behind it
+        pool.shutdown(wait=False, cancel_futures=True)
+        if _load_video_pool is pool:
+            _load_video_pool = None
         raise TimeoutError
-    return video_container.get("video", None).contiguous()
+    return video.contiguous()
 
 
 def process_video(
@@ -237,6 +278,7 @@ def process_video(
     actual_fps=None,
     skip_frms_num=0.0,
     nb_read_frames=None,
+    decode_resize=False,
 ):
     """
     video_path: str or io.BytesIO
@@ -245,7 +287,11 @@ def process_video(
     num_frames: wanted num_frames.
     wanted_fps: .
     skip_frms_num: ignore the first and the last xx frames, avoiding transitions.
+    decode_resize: let the decoder downscale the frames close to image_size.
     """
+    decode_size = None
+    if decode_resize and image_size is not None:
+        decode_size = get_decode_size(video_path, image_size)
 
     video = load_video_with_timeout(
         video_path,
@@ -255,6 +301,7 @@ def process_video(
         actual_fps=actual_fps,
         skip_frms_num=skip_frms_num,
         nb_read_frames=nb_read_frames,
+        decode_size=decode_size,
     )
 
     # --- copy and modify the image process ---
@@ -268,7 +315,13 @@ def process_video(
 
 
 def process_fn_video(
-    src, image_size, fps, num_frames, skip_frms_num=0.0, txt_key="caption"
+    src,
+    image_size,
+    fps,
+    num_frames,
+    skip_frms_num=0.0,
+    txt_key="caption",
+    decode_resize=False,
 ):
     while True:
         r = next(src)
@@ -317,6 +370,7 @@ def process_fn_video(
                 duration=duration,
                 actual_fps=actual_fps,
                 skip_frms_num=skip_frms_num,
+                decode_resize=decode_resize,
             )
             frames = (frames - 127.5) / 127.5
         except Exception as e:
@@ -347,6 +401,7 @@ class VideoDataset(MetaDistributedWebDataset):
         shuffle_buffer=1000,
         include_dirs=None,
         txt_key="caption",
+        decode_resize=False,
         **kwargs,
     ):
         if seed == -1:
@@ -364,6 +419,7 @@ class VideoDataset(MetaDistributedWebDataset):
                 image_size=image_size,
                 fps=fps,
                 skip_frms_num=skip_frms_num,
+                decode_resize=decode_resize,
             ),
             seed,
             meta_names=meta_names,
@@ -378,13 +434,23 @@ class VideoDataset(MetaDistributedWebDataset):
 
 
 class SFTDataset(Dataset):
-    def __init__(self, data_dir, video_size, fps, max_num_frames, skip_frms_num=3):
+    def __init__(
+        self,
+        data_dir,
+        video_size,
+        fps,
+        max_num_frames,
+        skip_frms_num=3,
+        decode_resize=False,
+    ):
         """
         skip_frms_num: ignore the first and the last xx frames, avoiding transitions.
+        decode_resize: let the decoder downscale the frames close to video_size.
         """
         super(SFTDataset, self).__init__()
 
         self.video_size = video_size
+        self.decode_resize = decode_resize
         self.fps = fps
         self.max_num_frames = max_num_frames
         self.skip_frms_num = skip_frms_num
@@ -411,7 +477,10 @@ class SFTDataset(Dataset):
         decord.bridge.set_bridge("torch")
 
         video_path = self.video_paths[index]
-        vr = VideoReader(uri=video_path, height=-1, width=-1)
+        height, width = -1, -1
+        if self.decode_resize:
+            height, width = get_decode_size(video_path, self.video_size)
+        vr = VideoReader(uri=video_path, height=height, width=width)
         actual_fps = vr.get_avg_fps()
         ori_vlen = len(vr)
 
@@ -423,14 +492,14 @@ class SFTDataset(Dataset):
                 int(start + num_frames / self.fps * actual_fps), int(ori_vlen)
             )
             indices = np.arange(start, end, (end - start) // num_frames).astype(int)
-            temp_frms = vr.get_batch(np.arange(start, end_safty))
+            indices = indices[indices < end_safty]
+            temp_frms = vr.get_batch(indices)
             assert temp_frms is not None
             tensor_frms = (
                 torch.from_numpy(temp_frms)
                 if type(temp_frms) is not torch.Tensor
                 else temp_frms
             )
-            tensor_frms = tensor_frms[torch.tensor((indices - start).tolist())]
         else:
             if ori_vlen > self.max_num_frames:
                 num_frames = self.max_num_frames
@@ -439,14 +508,13 @@ class SFTDataset(Dataset):
                 indices = np.arange(
                     start, end, max((end - start) // num_frames, 1)
                 ).astype(int)
-                temp_frms = vr.get_batch(np.arange(start, end))
+                temp_frms = vr.get_batch(indices)
                 assert temp_frms is not None
                 tensor_frms = (
                     torch.from_numpy(temp_frms)
                     if type(temp_frms) is not torch.Tensor
                     else temp_frms
                 )
-                tensor_frms = tensor_frms[torch.tensor((indices - start).tolist())]
             else:
 
                 def nearest_smaller_4k_plus_1(n):
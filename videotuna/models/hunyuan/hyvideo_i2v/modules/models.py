@@ -133,6 +133,28 @@ class MMDoubleStreamBlock(nn.Module):
     def disable_deterministic(self):
         self.deterministic = False
 
+    def modulated_input(
+        self,
+        img: torch.Tensor,
+        vec: torch.Tensor,
+        condition_type: str = None,
+        token_replace_vec: torch.Tensor = None,
+        frist_frame_token_num: int = None,
+    ) -> torch.Tensor:
+        """The image input of the attention, normalized and modulated by `vec`."""
+        if condition_type == "token_replace":
+            img_mod1, token_replace_img_mod1 = self.img_mod(vec, condition_type=condition_type, \
+                                                            token_replace_vec=token_replace_vec)
+            img_mod1_shift, img_mod1_scale = img_mod1.chunk(6, dim=-1)[:2]
+            tr_img_mod1_shift, tr_img_mod1_scale = token_replace_img_mod1.chunk(6, dim=-1)[:2]
+            return modulate(
+                self.img_norm1(img), shift=img_mod1_shift, scale=img_mod1_scale, condition_type=condition_type,
+                tr_shift=tr_img_mod1_shift, tr_scale=tr_img_mod1_scale,
+                frist_frame_token_num=frist_frame_token_num
+            )
+        img_mod1_shift, img_mod1_scale = self.img_mod(vec).chunk(6, dim=-1)[:2]
+        return modulate(self.img_norm1(img), shift=img_mod1_shift, scale=img_mod1_scale)
+
     def forward(
         self,
         img: torch.Tensor,
@@ -663,6 +685,9 @@ class HYVideoDiffusionTransformer(ModelMixin, ConfigMixin):
             **factory_kwargs,
         )
 
+        # optional `videotuna.utils.step_cache.StepCache` of the double and single blocks
+        self.step_cache = None
+
     def enable_deterministic(self):
         for block in self.double_blocks:
             block.enable_deterministic()
@@ -737,63 +762,80 @@ class HYVideoDiffusionTransformer(ModelMixin, ConfigMixin):
 
         txt_seq_len = txt.shape[1]
         img_seq_len = img.shape[1]
-
-        # Compute cu_squlens and max_seqlen for flash attention
-        cu_seqlens_q = get_cu_seqlens(text_mask, img_seq_len)
-        cu_seqlens_kv = cu_seqlens_q
         max_seqlen_q = img_seq_len + txt_seq_len
         max_seqlen_kv = max_seqlen_q
 
         freqs_cis = (freqs_cos, freqs_sin) if freqs_cos is not None else None
-        # --------------------- Pass through DiT blocks ------------------------
-        for layer_num, block in enumerate(self.double_blocks):
-            double_block_args = [
-                img,
-                txt,
-                vec,
-                cu_seqlens_q,
-                cu_seqlens_kv,
-                max_seqlen_q,
-                max_seqlen_kv,
-                freqs_cis,
-                self.i2v_condition_type,
-                token_replace_vec,
-                frist_frame_token_num,
-            ]
 
-            if self.training and self.gradient_checkpoint and \
-                    (self.gradient_checkpoint_layers == -1 or layer_num < self.gradient_checkpoint_layers):
-                # print(f'gradient checkpointing...')
-                img, txt = torch.utils.checkpoint.checkpoint(ckpt_wrapper(block), *double_block_args, use_reentrant=False)
-            else:
-                img, txt = block(*double_block_args)
-
-        # Merge txt and img to pass through single stream blocks.
-        x = torch.cat((img, txt), 1)
-
-        if len(self.single_blocks) > 0:
-            for _, block in enumerate(self.single_blocks):
-                single_block_args = [
-                    x,
-                    vec,
-                    txt_seq_len,
+        def run_blocks(img, index):
+            # the batched inputs of the samples `index`, all of them if None
+            txt_, vec_, text_mask_, token_replace_vec_ = txt, vec, text_mask, token_replace_vec
+            if index is not None:
+                txt_, vec_, text_mask_ = txt[index], vec[index], text_mask[index]
+                if token_replace_vec is not None:
+                    token_replace_vec_ = token_replace_vec[index]
+
+            # Compute cu_squlens and max_seqlen for flash attention
+            cu_seqlens_q = get_cu_seqlens(text_mask_, img_seq_len)
+            cu_seqlens_kv = cu_seqlens_q
+
+            # --------------------- Pass through DiT blocks ------------------------
+            for layer_num, block in enumerate(self.double_blocks):
+                double_block_args = [
+                    img,
+                    txt_,
+                    vec_,
                     cu_seqlens_q,
                     cu_seqlens_kv,
                     max_seqlen_q,
                     max_seqlen_kv,
-                    (freqs_cos, freqs_sin),
+                    freqs_cis,
                     self.i2v_condition_type,
-                    token_replace_vec,
+                    token_replace_vec_,
                     frist_frame_token_num,
                 ]
 
                 if self.training and self.gradient_checkpoint and \
-                        (self.gradient_checkpoint_layers == -1 or layer_num + len(self.double_blocks) < self.gradient_checkpoint_layers):
-                    x = torch.utils.checkpoint.checkpoint(ckpt_wrapper(block), *single_block_args, use_reentrant=False)
+                        (self.gradient_checkpoint_layers == -1 or layer_num < self.gradient_checkpoint_layers):
+                    # print(f'gradient checkpointing...')
+                    img, txt_ = torch.utils.checkpoint.checkpoint(ckpt_wrapper(block), *double_block_args, use_reentrant=False)
                 else:
-                    x = block(*single_block_args)
-
-        img = x[:, :img_seq_len, ...]
+                    img, txt_ = block(*double_block_args)
+
+            # Merge txt and img to pass through single stream blocks.
+            x = torch.cat((img, txt_), 1)
+
+            if len(self.single_blocks) > 0:
+                for _, block in enumerate(self.single_blocks):
+                    single_block_args = [
+                        x,
+                        vec_,
+                        txt_seq_len,
+                        cu_seqlens_q,
+                        cu_seqlens_kv,
+                        max_seqlen_q,
+                        max_seqlen_kv,
+                        (freqs_cos, freqs_sin),
+                        self.i2v_condition_type,
+                        token_replace_vec_,
+                        frist_frame_token_num,
+                    ]
+
+                    if self.training and self.gradient_checkpoint and \
+                            (self.gradient_checkpoint_layers == -1 or layer_num + len(self.double_blocks) < self.gradient_checkpoint_layers):
+                        x = torch.utils.checkpoint.checkpoint(ckpt_wrapper(block), *single_block_args, use_reentrant=False)
+                    else:
+                        x = block(*single_block_args)
+
+            return x[:, :img_seq_len, ...]
+
+        if self.step_cache is None or self.training:
+            img = run_blocks(img, None)
+        else:
+            modulated = self.double_blocks[0].modulated_input(
+                img, vec, self.i2v_condition_type, token_replace_vec, frist_frame_token_num
+            )
+            img = self.step_cache(img, modulated, run_blocks)
 
         # ---------------------------- Final layer ------------------------------
         img = self.final_layer(img, vec)  # (N, T, patch_size ** 2 * out_channels)
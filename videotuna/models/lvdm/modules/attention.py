@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 from functools import partial
 
 import torch
@@ -13,6 +14,9 @@ try:
 except:
     XFORMERS_IS_AVAILBLE = False
 
+SDPA_IS_AVAILABLE = hasattr(F, "scaled_dot_product_attention")
+ATTENTION_BACKENDS = ("auto", "xformers", "sdpa", "einsum")
+
 from videotuna.models.lvdm.modules.utils import checkpoint, default, exists, zero_module
 
 
@@ -42,6 +46,100 @@ class RelativePosition(nn.Module):
         return embeddings
 
 
+class ContextKVCache:
+    """
+    Inference cache of the cross-attention K/V projected from a context (text and image tokens).
+
+    The context is constant over a sampling run, but the UNet re-creates the context tensor on every
+    step, so a new tensor is matched against the stored ones by value once, and then by identity in
+    all the following layers of the same forward. K/V are stored per layer and context, already
+    reshaped to `(b h) n d`.
+
+    Args:
+        max_contexts: int
+            the number of distinct contexts kept, e.g. cond and uncond. The cache is reset when it is full.
+    """
+
+    def __init__(self, max_contexts=8):
+        self.max_contexts = max_contexts
+        self.contexts = []
+        self.kv = {}
+
+    def _slot(self, context):
+        for i, c in enumerate(self.contexts):
+            if c is context:
+                return i
+        for i, c in enumerate(self.contexts):
+            if (
+                c.shape == context.shape
+                and c.dtype == context.dtype
+                and c.device == context.device
+                and torch.equal(c, context)
+            ):
+                # keep the latest tensor, so that the other layers of this forward hit by identity
+                self.contexts[i] = context
+                return i
+        if len(self.contexts) >= self.max_contexts:
+            self.clear()
+        self.contexts.append(context)
+        return len(self.contexts) - 1
+
+    def get(self, layer, context):
+        return self.kv.get((id(layer), self._slot(context)), None)
+
+    def put(self, layer, context, kv):
+        self.kv[(id(layer), self._slot(context))] = kv
+
+    def clear(self):
+        self.contexts = []
+        self.kv = {}
+
+
+def get_attention_backend(backend=None, temporal=False):
+    """
+    Resolve the attention backend of a `CrossAttention` at build time.
+
+    `auto` keeps xformers for spatial attention when it is installed, and otherwise uses
+    `torch.nn.functional.scaled_dot_product_attention`, falling back to einsum on old torch versions.
+    xformers is never used for temporal attention, since it has no relative-position or mask support here.
+    """
+    backend = "auto" if backend is None else backend
+    if backend not in ATTENTION_BACKENDS:
+        raise ValueError(
+            f"Unknown attention backend {backend}, choose from {ATTENTION_BACKENDS}."
+        )
+    if backend == "auto":
+        if XFORMERS_IS_AVAILBLE and not temporal:
+            return "xformers"
+        return "sdpa" if SDPA_IS_AVAILABLE else "einsum"
+    if backend == "xformers" and (not XFORMERS_IS_AVAILBLE or temporal):
+        return "sdpa" if SDPA_IS_AVAILABLE else "einsum"
+    if backend == "sdpa" and not SDPA_IS_AVAILABLE:
+        return "einsum"
+    return backend
+
+
+@contextmanager
+def context_kv_cache(model, enabled=True):
+    """
+    Cache the cross-attention K/V of every `CrossAttention` in `model` within the scope,
+    the cache is dropped on exit so that it never outlives one sampling run.
+    """
+    if not enabled:
+        yield None
+        return
+    cache = ContextKVCache()
+    modules = [m for m in model.modules() if isinstance(m, CrossAttention)]
+    for m in modules:
+        m.kv_cache = cache
+    try:
+        yield cache
+    finally:
+        for m in modules:
+            m.kv_cache = None
+        cache.clear()
+
+
 class CrossAttention(nn.Module):
 
     def __init__(
@@ -58,6 +156,7 @@ class CrossAttention(nn.Module):
         img_cross_attention_scale=1.0,
         img_cross_attention_scale_learnable=False,
         text_context_len=77,
+        attention_backend=None,
     ):
         super().__init__()
         inner_dim = dim_head * heads
@@ -93,37 +192,65 @@ class CrossAttention(nn.Module):
             self.relative_position_v = RelativePosition(
                 num_units=dim_head, max_relative_position=temporal_length
             )
-        else:
-            ## only used for spatial attention, while NOT for temporal attention
-            if XFORMERS_IS_AVAILBLE and temporal_length is None:
-                self.forward = self.efficient_forward
-
-    def forward(self, x, context=None, mask=None):
+        ## xformers is only used for spatial attention, while NOT for temporal attention
+        self.attention_backend = get_attention_backend(
+            attention_backend,
+            temporal=self.relative_position or temporal_length is not None,
+        )
+        if self.attention_backend == "xformers":
+            self.forward = self.efficient_forward
+        elif self.attention_backend == "sdpa":
+            self.forward = self.sdpa_forward
+        # set by `context_kv_cache` during sampling
+        self.kv_cache = None
+
+    def to_heads(self, t):
+        return rearrange(t, "b n (h d) -> (b h) n d", h=self.heads).contiguous()
+
+    def project_kv(self, x, context=None):
+        """
+        Project K/V (and the image K/V) from `context`, or from `x` for self-attention,
+        and reshape them to `(b h) n d`. Cross-attention K/V are taken from `kv_cache` if it is set.
+        """
         is_self_attn = context is None
-        k_ip, v_ip, out_ip = None, None, None
-
-        h = self.heads
+        cache = self.kv_cache
+        if cache is not None and not is_self_attn and not torch.is_grad_enabled():
+            kv = cache.get(self, context)
+            if kv is not None:
+                return kv
+        else:
+            cache = None
 
-        q = self.to_q(x)
+        k_ip, v_ip = None, None
         context = default(context, x)
-
         if self.img_cross_attention and not is_self_attn:
-            context, context_img = (
+            context_txt, context_img = (
                 context[:, : self.text_context_len, :],
                 context[:, self.text_context_len :, :],
             )
-            k = self.to_k(context)
-            v = self.to_v(context)
-            k_ip = self.to_k_ip(context_img)
-            v_ip = self.to_v_ip(context_img)
+            k = self.to_k(context_txt)
+            v = self.to_v(context_txt)
+            k_ip = self.to_heads(self.to_k_ip(context_img))
+            v_ip = self.to_heads(self.to_v_ip(context_img))
         else:
-            if not is_self_attn:
-                context = context[:, : self.text_context_len, :]
+            context_txt = (
+                context if is_self_attn else context[:, : self.text_context_len, :]
+            )
+            k = self.to_k(context_txt)
+            v = self.to_v(context_txt)
+        kv = (self.to_heads(k), self.to_heads(v), k_ip, v_ip)
 
-            k = self.to_k(context)
-            v = self.to_v(context)
+        if cache is not None:
+            cache.put(self, context, kv)
+        return kv
+
+    def forward(self, x, context=None, mask=None):
+        out_ip = None
+
+        h = self.heads
 
-        q, k, v = map(lambda t: rearrange(t, "b n (h d) -> (b h) n d", h=h), (q, k, v))
+        q = self.to_heads(self.to_q(x))
+        k, v, k_ip, v_ip = self.project_kv(x, context)
 
         sim = torch.einsum("b i d, b j d -> b i j", q, k) * self.scale
         if self.relative_position:
@@ -150,9 +277,6 @@ class CrossAttention(nn.Module):
 
         ## for image cross-attention
         if k_ip is not None:
-            k_ip, v_ip = map(
-                lambda t: rearrange(t, "b n (h d) -> (b h) n d", h=h), (k_ip, v_ip)
-            )
             sim_ip = torch.einsum("b i d, b j d -> b i j", q, k_ip) * self.scale
             del k_ip
             sim_ip = sim_ip.softmax(dim=-1)
@@ -170,50 +294,16 @@ class CrossAttention(nn.Module):
         return self.to_out(out)
 
     def efficient_forward(self, x, context=None, mask=None):
-        is_self_attn = context is None
-        k_ip, v_ip, out_ip = None, None, None
+        out_ip = None
 
-        q = self.to_q(x)
-        context = default(context, x)
-
-        ## considering image token additionally
-        if self.img_cross_attention and not is_self_attn:
-            context, context_img = (
-                context[:, : self.text_context_len, :],
-                context[:, self.text_context_len :, :],
-            )
-            k = self.to_k(context)
-            v = self.to_v(context)
-            k_ip = self.to_k_ip(context_img)
-            v_ip = self.to_v_ip(context_img)
-        else:
-            if not is_self_attn:
-                context = context[:, : self.text_context_len, :]
-            k = self.to_k(context)
-            v = self.to_v(context)
-
-        b, _, _ = q.shape
-        q, k, v = map(
-            lambda t: t.unsqueeze(3)
-            .reshape(b, t.shape[1], self.heads, self.dim_head)
-            .permute(0, 2, 1, 3)
-            .reshape(b * self.heads, t.shape[1], self.dim_head)
-            .contiguous(),
-            (q, k, v),
-        )
+        b, _, _ = x.shape
+        q = self.to_heads(self.to_q(x))
+        k, v, k_ip, v_ip = self.project_kv(x, context)
         # actually compute the attention, what we cannot get enough of
         out = xformers.ops.memory_efficient_attention(q, k, v, attn_bias=None, op=None)
 
         # for image cross-attention
         if k_ip is not None:
-            k_ip, v_ip = map(
-                lambda t: t.unsqueeze(3)
-                .reshape(b, t.shape[1], self.heads, self.dim_head)
-                .permute(0, 2, 1, 3)
-                .reshape(b * self.heads, t.shape[1], self.dim_head)
-                .contiguous(),
-                (k_ip, v_ip),
-            )
             out_ip = xformers.ops.memory_efficient_attention(
                 q, k_ip, v_ip, attn_bias=None, op=None
             )
@@ -241,6 +331,65 @@ class CrossAttention(nn.Module):
                 out = out + self.img_cross_attention_scale * out_ip
         return self.to_out(out)
 
+    def sdpa_forward(self, x, context=None, mask=None):
+        out_ip = None
+
+        b = x.shape[0]
+        h, d = self.heads, self.dim_head
+        q = rearrange(self.to_q(x), "b n (h d) -> b h n d", h=h)
+        k, v, k_ip, v_ip = self.project_kv(x, context)
+        k, v = k.view(b, h, -1, d), v.view(b, h, -1, d)
+
+        # relative positions and the causal mask are folded into an additive bias
+        attn_bias = None
+        if self.relative_position:
+            len_q, len_k, len_v = q.shape[2], k.shape[2], v.shape[2]
+            k2 = self.relative_position_k(len_q, len_k)
+            attn_bias = einsum("b h t d, t s d -> b h t s", q, k2) * self.scale
+        if exists(mask):
+            ## feasible for causal attention mask only
+            mask = (mask > 0.5).unsqueeze(1)
+            if attn_bias is None:
+                attn_bias = mask
+            else:
+                attn_bias = attn_bias.masked_fill(
+                    ~mask, -torch.finfo(attn_bias.dtype).max
+                )
+
+        if self.relative_position:
+            # the relative value term needs the attention probabilities, append an identity to v
+            # so that the same kernel returns them next to the output (the temporal length is short)
+            eye = torch.eye(len_v, dtype=v.dtype, device=v.device).expand(
+                b, h, len_v, len_v
+            )
+            out = F.scaled_dot_product_attention(
+                q, k, torch.cat([v, eye], dim=-1), attn_mask=attn_bias, scale=self.scale
+            )
+            out, attn = out[..., :d], out[..., d:]
+            v2 = self.relative_position_v(len_q, len_v)
+            out = out + einsum("b h t s, t s d -> b h t d", attn, v2)
+        else:
+            out = F.scaled_dot_product_attention(
+                q, k, v, attn_mask=attn_bias, scale=self.scale
+            )
+        out = rearrange(out, "b h n d -> b n (h d)")
+
+        ## for image cross-attention
+        if k_ip is not None:
+            k_ip, v_ip = k_ip.view(b, h, -1, d), v_ip.view(b, h, -1, d)
+            out_ip = F.scaled_dot_product_attention(q, k_ip, v_ip, scale=self.scale)
+            out_ip = rearrange(out_ip, "b h n d -> b n (h d)")
+
+        if out_ip is not None:
+            if self.img_cross_attention_scale_learnable:
+                out = out + self.img_cross_attention_scale * out_ip * (
+                    torch.tanh(self.alpha) + 1
+                )
+            else:
+                out = out + self.img_cross_attention_scale * out_ip
+
+        return self.to_out(out)
+
 
 class BasicTransformerBlock(nn.Module):
     def __init__(
@@ -333,6 +482,7 @@ class SpatialTransformer(nn.Module):
         use_linear=False,
         img_cross_attention=False,
         img_cross_attention_scale_learnable=False,
+        attention_backend=None,
     ):
         super().__init__()
         self.in_channels = in_channels
@@ -347,7 +497,7 @@ class SpatialTransformer(nn.Module):
         else:
             self.proj_in = nn.Linear(in_channels, inner_dim)
 
-        attention_cls = None
+        attention_cls = partial(CrossAttention, attention_backend=attention_backend)
         self.transformer_blocks = nn.ModuleList(
             [
                 BasicTransformerBlock(
@@ -415,6 +565,7 @@ class TemporalTransformer(nn.Module):
         causal_block_size=1,
         relative_position=False,
         temporal_length=None,
+        attention_backend=None,
     ):
         super().__init__()
         self.only_self_att = only_self_att
@@ -439,10 +590,17 @@ class TemporalTransformer(nn.Module):
         if relative_position:
             assert temporal_length is not None
             attention_cls = partial(
-                CrossAttention, relative_position=True, temporal_length=temporal_length
+                CrossAttention,
+                relative_position=True,
+                temporal_length=temporal_length,
+                attention_backend=attention_backend,
             )
         else:
-            attention_cls = partial(CrossAttention, temporal_length=temporal_length)
+            attention_cls = partial(
+                CrossAttention,
+                temporal_length=temporal_length,
+                attention_backend=attention_backend,
+            )
 
         if self.causal_attention:
             assert temporal_length is not None
@@ -369,6 +369,7 @@ class UNetModel(nn.Module):
         use_image_attention=False,
         temporal_transformer_depth=1,
         fps_cond=False,
+        attention_backend=None,
     ):
         super(UNetModel, self).__init__()
         if num_heads == -1:
@@ -428,6 +429,7 @@ class UNetModel(nn.Module):
                     causal_attention=use_causal_attention,
                     relative_position=use_relative_position,
                     temporal_length=temporal_length,
+                    attention_backend=attention_backend,
                 )
             )
 
@@ -467,6 +469,7 @@ class UNetModel(nn.Module):
                             use_checkpoint=use_checkpoint,
                             disable_self_attn=False,
                             img_cross_attention=self.use_image_attention,
+                            attention_backend=attention_backend,
                         )
                     )
                     if self.temporal_attention:
@@ -483,6 +486,7 @@ class UNetModel(nn.Module):
                                 causal_attention=use_causal_attention,
                                 relative_position=use_relative_position,
                                 temporal_length=temporal_length,
+                                attention_backend=attention_backend,
                             )
                         )
                 self.input_blocks.append(TimestepEmbedSequential(*layers))
@@ -537,6 +541,7 @@ class UNetModel(nn.Module):
                 use_checkpoint=use_checkpoint,
                 disable_self_attn=False,
                 img_cross_attention=self.use_image_attention,
+                attention_backend=attention_backend,
             ),
         ]
         if self.temporal_attention:
@@ -553,6 +558,7 @@ class UNetModel(nn.Module):
                     causal_attention=use_causal_attention,
                     relative_position=use_relative_position,
                     temporal_length=temporal_length,
+                    attention_backend=attention_backend,
                 )
             )
         layers.append(
@@ -604,6 +610,7 @@ class UNetModel(nn.Module):
                             use_checkpoint=use_checkpoint,
                             disable_self_attn=False,
                             img_cross_attention=self.use_image_attention,
+                            attention_backend=attention_backend,
                         )
                     )
                     if self.temporal_attention:
@@ -620,6 +627,7 @@ class UNetModel(nn.Module):
                                 causal_attention=use_causal_attention,
                                 relative_position=use_relative_position,
                                 temporal_length=temporal_length,
+                                attention_backend=attention_backend,
                             )
                         )
                 if level and i == num_res_blocks:
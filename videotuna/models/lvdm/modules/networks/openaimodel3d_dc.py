@@ -381,6 +381,7 @@ class UNetModel(nn.Module):
         img_cross_attention_scale_learnable=False,
         default_fs=4,
         fs_condition=False,
+        attention_backend=None,
     ):
         super(UNetModel, self).__init__()
         if num_heads == -1:
@@ -447,6 +448,7 @@ class UNetModel(nn.Module):
                     causal_attention=False,
                     relative_position=use_relative_position,
                     temporal_length=temporal_length,
+                    attention_backend=attention_backend,
                 )
             )
 
@@ -487,6 +489,7 @@ class UNetModel(nn.Module):
                             disable_self_attn=False,
                             img_cross_attention=self.img_cross_attention,
                             img_cross_attention_scale_learnable=self.img_cross_attention_scale_learnable,
+                            attention_backend=attention_backend,
                         )
                     )
                     if self.temporal_attention:
@@ -503,6 +506,7 @@ class UNetModel(nn.Module):
                                 causal_attention=use_causal_attention,
                                 relative_position=use_relative_position,
                                 temporal_length=temporal_length,
+                                attention_backend=attention_backend,
                             )
                         )
                 self.input_blocks.append(TimestepEmbedSequential(*layers))
@@ -558,6 +562,7 @@ class UNetModel(nn.Module):
                 disable_self_attn=False,
                 img_cross_attention=self.img_cross_attention,
                 img_cross_attention_scale_learnable=self.img_cross_attention_scale_learnable,
+                attention_backend=attention_backend,
             ),
         ]
         if self.temporal_attention:
@@ -574,6 +579,7 @@ class UNetModel(nn.Module):
                     causal_attention=use_causal_attention,
                     relative_position=use_relative_position,
                     temporal_length=temporal_length,
+                    attention_backend=attention_backend,
                 )
             )
         layers.append(
@@ -629,6 +635,7 @@ class UNetModel(nn.Module):
                             disable_self_attn=False,
                             img_cross_attention=self.img_cross_attention,
                             img_cross_attention_scale_learnable=self.img_cross_attention_scale_learnable,
+                            attention_backend=attention_backend,
                         )
                     )
                     if self.temporal_attention:
@@ -645,6 +652,7 @@ class UNetModel(nn.Module):
                                 causal_attention=use_causal_attention,
                                 relative_position=use_relative_position,
                                 temporal_length=temporal_length,
+                                attention_backend=attention_backend,
                             )
                         )
                 if level and i == num_res_blocks:
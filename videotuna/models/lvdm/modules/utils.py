@@ -13,6 +13,7 @@ from inspect import isfunction
 import torch
 import torch.distributed as dist
 import torch.nn as nn
+from einops import rearrange
 from torch import nn
 
 from videotuna.utils.common_utils import instantiate_from_config
@@ -39,6 +40,58 @@ def autocast(f):
     return do_autocast
 
 
+def auto_frames_per_batch(
+    num_frames,
+    num_pixels,
+    device,
+    dtype=torch.float32,
+    bytes_per_pixel=1024,
+    reserve=0.2,
+):
+    """
+    Number of frames of `num_pixels` (the larger of input and output resolution) that a 2D autoencoder can process at once.
+    `bytes_per_pixel` is the activation memory per pixel and per element byte, it is estimated from the 128-channel
+    full resolution blocks of the LVDM autoencoder.
+    """
+    device = torch.device(device)
+    if device.type != "cuda":
+        return num_frames
+    free_memory, _ = torch.cuda.mem_get_info(device)
+    frame_bytes = (
+        num_pixels * bytes_per_pixel * torch.empty((), dtype=dtype).element_size()
+    )
+    return max(1, min(num_frames, int(free_memory * (1 - reserve) // frame_bytes)))
+
+
+def framewise_apply(
+    fn, x, num_pixels=None, frames_per_batch=None, channels_last=False, dtype=None
+):
+    """
+    Apply a 2D `fn` to all frames of a video `x` [b, c, t, h, w], with the time axis folded into the batch.
+    The frames are processed in micro-batches of `frames_per_batch`, which is sized from the free memory if None.
+    If `dtype` is given, `fn` runs under autocast and the result is cast back to the dtype of `x`.
+    """
+    b = x.shape[0]
+    frames = rearrange(x, "b c t h w -> (b t) c h w")
+    if frames_per_batch is None:
+        num_pixels = default(num_pixels, frames.shape[-2] * frames.shape[-1])
+        frames_per_batch = auto_frames_per_batch(
+            frames.shape[0], num_pixels, x.device, default(dtype, x.dtype)
+        )
+    results = []
+    for chunk in frames.split(frames_per_batch):
+        if channels_last:
+            chunk = chunk.contiguous(memory_format=torch.channels_last)
+        if dtype is not None:
+            with torch.autocast(device_type=x.device.type, dtype=dtype):
+                result = fn(chunk)
+            result = result.to(x.dtype)
+        else:
+            result = fn(chunk)
+        results.append(result)
+    return rearrange(torch.cat(results), "(b t) c h w -> b c t h w", b=b).contiguous()
+
+
 def extract_into_tensor(a, t, x_shape):
     b, *_ = t.shape
     out = a.gather(-1, t)
@@ -31,9 +31,10 @@ from videotuna.models.lvdm.modules.utils import (
     disabled_train,
     exists,
     extract_into_tensor,
+    framewise_apply,
     noise_like,
 )
-from videotuna.utils.common_utils import instantiate_from_config
+from videotuna.utils.common_utils import instantiate_from_config, precision_to_dtype
 
 
 def mean_flat(tensor: torch.Tensor, mask=None) -> torch.Tensor:
@@ -976,6 +977,9 @@ class LatentDiffusion(SpacedDiffusion):
         empty_params_only=False,
         num_sampling_steps=None,  # Added for SpacedDiffusion
         timestep_respacing=None,  # Added for SpacedDiffusion
+        vae_frames_per_batch=None,
+        vae_channels_last=False,
+        vae_dtype=None,
         *args,
         **kwargs,
     ):
@@ -1052,6 +1056,12 @@ class LatentDiffusion(SpacedDiffusion):
         self.cond_stage_forward = cond_stage_forward
         self.encoder_type = encoder_type
         assert encoder_type in ["2d", "3d"]
+        # frame-wise 2D autoencoder: frames per micro-batch (None: sized from free memory), memory format and autocast dtype
+        self.vae_frames_per_batch = vae_frames_per_batch
+        self.vae_channels_last = vae_channels_last
+        self.vae_dtype = precision_to_dtype[vae_dtype] if vae_dtype is not None else None
+        if self.vae_channels_last:
+            self.first_stage_model.to(memory_format=torch.channels_last)
         self.uncond_prob = uncond_prob
         self.classifier_free_guidance = True if uncond_prob > 0 else False
         assert uncond_type in ["zero_embed", "empty_seq"]
@@ -1176,31 +1186,34 @@ class LatentDiffusion(SpacedDiffusion):
         results = self.get_first_stage_encoding(encoder_posterior).detach()
         return results
 
+    def _framewise(self, fn, x, num_pixels=None):
+        return framewise_apply(
+            fn,
+            x,
+            num_pixels=num_pixels,
+            frames_per_batch=self.vae_frames_per_batch,
+            channels_last=self.vae_channels_last,
+            dtype=self.vae_dtype,
+        )
+
     def encode_first_stage_2DAE(self, x):
-        """encode frame by frame"""
-        b, _, t, _, _ = x.shape
-        results = torch.cat(
-            [
-                self.get_first_stage_encoding(self.first_stage_model.encode(x[:, :, i]))
-                .detach()
-                .unsqueeze(2)
-                for i in range(t)
-            ],
-            dim=2,
+        """encode frame by frame, with the frames batched"""
+        return self._framewise(
+            lambda frames: self.get_first_stage_encoding(
+                self.first_stage_model.encode(frames)
+            ).detach(),
+            x,
         )
-        return results
 
     def decode_first_stage_2DAE(self, z, **kwargs):
-        """decode frame by frame"""
-        _, _, t, _, _ = z.shape
-        results = torch.cat(
-            [
-                self.first_stage_model.decode(z[:, :, i], **kwargs).unsqueeze(2)
-                for i in range(t)
-            ],
-            dim=2,
+        """decode frame by frame, with the frames batched"""
+        # the decoder activations scale with the output resolution
+        num_pixels = z.shape[-2] * z.shape[-1] * 4**self.num_downs
+        return self._framewise(
+            lambda frames: self.first_stage_model.decode(frames, **kwargs),
+            z,
+            num_pixels,
         )
-        return results
 
     def _decode_core(self, z, **kwargs):
         z = 1.0 / self.scale_factor * z
@@ -698,6 +698,14 @@ class StepVideoTransformerBlock(nn.Module):
 
         self.scale_shift_table = nn.Parameter(torch.randn(6, dim) /dim**0.5)
 
+    @torch.no_grad()
+    def modulated_input(self, q: torch.Tensor, timestep: torch.Tensor) -> torch.Tensor:
+        """The input of the self-attention, normalized and modulated by the timestep embedding."""
+        shift_msa, scale_msa = (
+            self.scale_shift_table[None].to(dtype=q.dtype, device=q.device) + timestep.reshape(-1, 6, self.dim)
+        ).chunk(6, dim=1)[:2]
+        return modulate(self.norm1(q), scale_msa, shift_msa)
+
     @torch.no_grad()
     def forward(
         self,
@@ -806,6 +814,9 @@ class StepVideoModel(ModelMixin, ConfigMixin):
         
         self.parallel = attention_type=='parallel'
 
+        # optional `videotuna.utils.step_cache.StepCache` of the transformer blocks
+        self.step_cache = None
+
     def patchfy(self, hidden_states):
         hidden_states = rearrange(hidden_states, 'b f c h w -> (b f) c h w')
         hidden_states = self.pos_embed(hidden_states)
@@ -829,16 +840,25 @@ class StepVideoModel(ModelMixin, ConfigMixin):
         parallel=True
     ):
 
-        for block in tqdm(self.transformer_blocks, desc="Transformer Block"):
-            hidden_states = block(
-                hidden_states,
-                encoder_hidden_states,
-                timestep=timestep,
-                attn_mask=attn_mask,
-                rope_positions=rope_positions
-            )
+        def run_blocks(hidden_states, index):
+            # the batched inputs of the samples `index`, all of them if None
+            encoder_hidden_states_, timestep_, attn_mask_ = encoder_hidden_states, timestep, attn_mask
+            if index is not None:
+                encoder_hidden_states_, timestep_, attn_mask_ = encoder_hidden_states[index], timestep[index], attn_mask[index]
+            for block in tqdm(self.transformer_blocks, desc="Transformer Block"):
+                hidden_states = block(
+                    hidden_states,
+                    encoder_hidden_states_,
+                    timestep=timestep_,
+                    attn_mask=attn_mask_,
+                    rope_positions=rope_positions
+                )
+            return hidden_states
 
-        return hidden_states
+        if self.step_cache is None:
+            return run_blocks(hidden_states, None)
+        modulated = self.transformer_blocks[0].modulated_input(hidden_states, timestep)
+        return self.step_cache(hidden_states, modulated, run_blocks)
         
 
     @torch.inference_mode()
@@ -4,7 +4,8 @@ import torch
 
 
 def initialize_parall_group(ring_degree, ulysses_degree, tensor_parallel_degree):
-    dist.init_process_group("nccl")
+    if not dist.is_initialized():
+        dist.init_process_group("nccl")
     xfuser.core.distributed.init_distributed_environment(
         rank=dist.get_rank(), 
         world_size=dist.get_world_size()
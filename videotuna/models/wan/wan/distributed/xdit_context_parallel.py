@@ -6,7 +6,7 @@ from xfuser.core.distributed import (get_sequence_parallel_rank,
                                      get_sp_group)
 from xfuser.core.long_ctx_attention import xFuserLongContextAttention
 
-from ..modules.model import sinusoidal_embedding_1d
+from ..modules.model import rope_freqs_table, sinusoidal_embedding_1d
 
 
 def pad_freqs(original_tensor, target_len):
@@ -30,23 +30,14 @@ def rope_apply(x, grid_sizes, freqs):
     freqs:      [M, C // 2].
     """
     s, n, c = x.size(1), x.size(2), x.size(3) // 2
-    # split freqs
-    freqs = freqs.split([c - 2 * (c // 3), c // 3, c // 3], dim=1)
 
     # loop over samples
     output = []
     for i, (f, h, w) in enumerate(grid_sizes.tolist()):
-        seq_len = f * h * w
-
         # precompute multipliers
-        x_i = torch.view_as_complex(x[i, :s].to(torch.float64).reshape(
+        x_i = torch.view_as_complex(x[i, :s].to(torch.float32).reshape(
             s, n, -1, 2))
-        freqs_i = torch.cat([
-            freqs[0][:f].view(f, 1, 1, -1).expand(f, h, w, -1),
-            freqs[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
-            freqs[2][:w].view(1, 1, w, -1).expand(f, h, w, -1)
-        ],
-                            dim=-1).reshape(seq_len, 1, -1)
+        freqs_i = rope_freqs_table(freqs, f, h, w, c)
 
         # apply rotary embedding
         sp_size = get_sequence_parallel_world_size()
@@ -132,8 +123,7 @@ def usp_dit_forward(
         x, get_sequence_parallel_world_size(),
         dim=1)[get_sequence_parallel_rank()]
 
-    for block in self.blocks:
-        x = block(x, **kwargs)
+    x = self.run_blocks(x, kwargs)
 
     # head
     x = self.head(x, e)
@@ -75,6 +75,9 @@ class WanI2V:
         self.t5_cpu = t5_cpu
         self.t5_fsdp = t5_fsdp
         self.dit_fsdp = dit_fsdp
+        # ranks of a sequence parallel or fsdp group generate the same sample together,
+        # otherwise every rank generates its own samples
+        self.sample_parallel = use_usp or t5_fsdp or dit_fsdp
         self.num_train_timesteps = config.num_train_timesteps
         self.param_dtype = config.param_dtype
         
@@ -272,18 +275,15 @@ class WanI2V:
             # sample videos
             latent = noise
 
+            # cond and uncond branches share one batched forward,
+            # guide_scale == 1 reduces to the cond branch only
+            do_cfg = guide_scale != 1.0
+            num_branches = 2 if do_cfg else 1
             arg_c = {
-                'context': [context[0]],
-                'clip_fea': clip_context,
+                'context': [context[0]] + (context_null if do_cfg else []),
+                'clip_fea': clip_context.expand(num_branches, -1, -1),
                 'seq_len': max_seq_len,
-                'y': [y],
-            }
-
-            arg_null = {
-                'context': context_null,
-                'clip_fea': clip_context,
-                'seq_len': max_seq_len,
-                'y': [y],
+                'y': [y] * num_branches,
             }
 
             if offload_model:
@@ -291,23 +291,23 @@ class WanI2V:
 
             self.model.to(self.device)
             for _, t in enumerate(tqdm(timesteps)):
-                latent_model_input = [latent.to(self.device)]
-                timestep = [t]
-
-                timestep = torch.stack(timestep).to(self.device)
-
-                noise_pred_cond = self.model(
-                    latent_model_input, t=timestep, **arg_c)[0].to(
-                        torch.device('cpu') if offload_model else self.device)
-                if offload_model:
-                    torch.cuda.empty_cache()
-                noise_pred_uncond = self.model(
-                    latent_model_input, t=timestep, **arg_null)[0].to(
-                        torch.device('cpu') if offload_model else self.device)
+                latent_model_input = [latent.to(self.device)] * num_branches
+                timestep = t.expand(num_branches).to(self.device)
+
+                noise_preds = self.model(
+                    latent_model_input, t=timestep, **arg_c)
+                noise_preds = [
+                    u.to(torch.device('cpu') if offload_model else self.device)
+                    for u in noise_preds
+                ]
                 if offload_model:
                     torch.cuda.empty_cache()
-                noise_pred = noise_pred_uncond + guide_scale * (
-                    noise_pred_cond - noise_pred_uncond)
+                if do_cfg:
+                    noise_pred_cond, noise_pred_uncond = noise_preds
+                    noise_pred = noise_pred_uncond + guide_scale * (
+                        noise_pred_cond - noise_pred_uncond)
+                else:
+                    noise_pred = noise_preds[0]
 
                 latent = latent.to(
                     torch.device('cpu') if offload_model else self.device)
@@ -327,7 +327,7 @@ class WanI2V:
                 self.model.cpu()
                 torch.cuda.empty_cache()
 
-            if self.rank == 0:
+            if self.rank == 0 or not self.sample_parallel:
                 self.vae.model.to(self.device)
                 videos = self.vae.decode(x0)
                 if offload_model:
@@ -338,10 +338,10 @@ class WanI2V:
         if offload_model:
             gc.collect()
             torch.cuda.synchronize()
-        if dist.is_initialized():
+        if dist.is_initialized() and self.sample_parallel:
             dist.barrier()
 
-        return videos[0] if self.rank == 0 else None
+        return videos[0] if self.rank == 0 or not self.sample_parallel else None
     
     def load_weight(self):
         self.text_encoder.load_weight()
@@ -36,35 +36,57 @@ def rope_params(max_seq_len, dim, theta=10000):
     return freqs
 
 
-@amp.autocast(enabled=False)
-def rope_apply(x, grid_sizes, freqs):
-    n, c = x.size(2), x.size(3) // 2
+# (freqs shape, dtype, device, c, f, h, w) -> complex64 table of shape [f * h * w, 1, c]
+_ROPE_FREQS_CACHE = {}
+_ROPE_FREQS_CACHE_SIZE = 32
 
-    # split freqs
-    freqs = freqs.split([c - 2 * (c // 3), c // 3, c // 3], dim=1)
 
-    # loop over samples
-    output = []
-    for i, (f, h, w) in enumerate(grid_sizes.tolist()):
-        seq_len = f * h * w
+@amp.autocast(enabled=False)
+def rope_freqs_table(freqs, f, h, w, c):
+    """
+    The 3D rope multipliers of a (f, h, w) grid, memoized across blocks and steps.
 
-        # precompute multipliers
-        x_i = torch.view_as_complex(x[i, :seq_len].to(torch.float64).reshape(
-            seq_len, n, -1, 2))
-        freqs_i = torch.cat([
+    The key describes the contents of `freqs` rather than its address, which a reloaded model
+    can reuse: the tables of `rope_params` only depend on their shape, as WanModel uses the
+    default theta.
+    """
+    key = (tuple(freqs.shape), freqs.dtype, freqs.device, c, f, h, w)
+    table = _ROPE_FREQS_CACHE.get(key)
+    if table is None:
+        freqs = freqs.split([c - 2 * (c // 3), c // 3, c // 3], dim=1)
+        table = torch.cat([
             freqs[0][:f].view(f, 1, 1, -1).expand(f, h, w, -1),
             freqs[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
             freqs[2][:w].view(1, 1, w, -1).expand(f, h, w, -1)
         ],
-                            dim=-1).reshape(seq_len, 1, -1)
+                          dim=-1).reshape(f * h * w, 1, -1).to(torch.complex64)
+        if len(_ROPE_FREQS_CACHE) >= _ROPE_FREQS_CACHE_SIZE:
+            _ROPE_FREQS_CACHE.clear()
+        _ROPE_FREQS_CACHE[key] = table
+    return table
 
-        # apply rotary embedding
-        x_i = torch.view_as_real(x_i * freqs_i).flatten(2)
-        x_i = torch.cat([x_i, x[i, seq_len:]])
 
-        # append to collection
-        output.append(x_i)
-    return torch.stack(output).float()
+@amp.autocast(enabled=False)
+def rope_apply(x, grid_sizes, freqs):
+    b, n, c = x.size(0), x.size(2), x.size(3) // 2
+
+    # group samples by grid size, samples of the same grid are rotated together
+    groups = {}
+    for i, grid_size in enumerate(grid_sizes.tolist()):
+        groups.setdefault(tuple(grid_size), []).append(i)
+
+    # the padded tail is kept as is
+    output = x.to(torch.float32, copy=True)
+    for (f, h, w), index in groups.items():
+        seq_len = f * h * w
+        freqs_i = rope_freqs_table(freqs, f, h, w, c)
+
+        # apply rotary embedding
+        index = slice(None) if len(index) == b else index
+        x_i = output[index, :seq_len]
+        x_i = torch.view_as_complex(x_i.reshape(*x_i.shape[:2], n, -1, 2))
+        output[index, :seq_len] = torch.view_as_real(x_i * freqs_i).flatten(3)
+    return output
 
 
 class WanRMSNorm(nn.Module):
@@ -271,6 +293,18 @@ class WanAttentionBlock(nn.Module):
         # modulation
         self.modulation = nn.Parameter(torch.randn(1, 6, dim) / dim**0.5)
 
+    def modulated_input(self, x, e):
+        r"""
+        The input of the self-attention, normalized and modulated by the time embedding.
+
+        Args:
+            x(Tensor): Shape [B, L, C]
+            e(Tensor): Shape [B, 6, C]
+        """
+        with amp.autocast(dtype=torch.float32):
+            e = (self.modulation + e).chunk(6, dim=1)
+        return self.norm1(x).float() * (1 + e[1]) + e[0]
+
     def forward(
         self,
         x,
@@ -476,6 +510,9 @@ class WanModel(ModelMixin, ConfigMixin):
         if model_type == 'i2v':
             self.img_emb = MLPProj(1280, dim)
 
+        # optional `videotuna.utils.step_cache.StepCache` of the block stack
+        self.step_cache = None
+
         # initialize weights
         self.init_weights()
 
@@ -560,8 +597,7 @@ class WanModel(ModelMixin, ConfigMixin):
             context=context,
             context_lens=context_lens)
 
-        for block in self.blocks:
-            x = block(x, **kwargs)
+        x = self.run_blocks(x, kwargs)
 
         # head
         x = self.head(x, e)
@@ -570,6 +606,32 @@ class WanModel(ModelMixin, ConfigMixin):
         x = self.unpatchify(x, grid_sizes)
         return [u.float() for u in x]
 
+    def run_blocks(self, x, kwargs):
+        r"""
+        Run the transformer blocks, through the step cache if one is set.
+
+        Args:
+            x (Tensor):
+                Shape [B, L, C]
+            kwargs (dict):
+                Block arguments, the batched ones are sliced for a partial cache hit
+        """
+        def run(x, index):
+            if index is not None:
+                kwargs_ = dict(kwargs)
+                for k in ('e', 'seq_lens', 'grid_sizes', 'context'):
+                    kwargs_[k] = kwargs[k][index]
+            else:
+                kwargs_ = kwargs
+            for block in self.blocks:
+                x = block(x, **kwargs_)
+            return x
+
+        if self.step_cache is None:
+            return run(x, None)
+        return self.step_cache(
+            x, self.blocks[0].modulated_input(x, kwargs['e']), run)
+
     def unpatchify(self, x, grid_sizes):
         r"""
         Reconstruct video tensors from patch embeddings.
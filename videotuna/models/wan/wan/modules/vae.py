@@ -624,7 +624,14 @@ class WanVAE:
             ]
 
     def decode(self, zs):
+        """
+        zs: A list of latents each with shape [C, T, H, W], latents of the same shape are decoded as one batch.
+        """
         with amp.autocast(dtype=self.dtype):
+            if len(zs) > 1 and all(u.shape == zs[0].shape for u in zs):
+                return list(
+                    self.model.decode(torch.stack(zs),
+                                      self.scale).float().clamp_(-1, 1).unbind(0))
             return [
                 self.model.decode(u.unsqueeze(0),
                                   self.scale).float().clamp_(-1, 1).squeeze(0)
@@ -68,6 +68,9 @@ class WanT2V:
         self.t5_fsdp = t5_fsdp
         self.dit_fsdp = dit_fsdp
         self.use_usp = use_usp
+        # ranks of a sequence parallel or fsdp group generate the same sample together,
+        # otherwise every rank generates its own samples
+        self.sample_parallel = use_usp or t5_fsdp or dit_fsdp
         self.num_train_timesteps = config.num_train_timesteps
         self.param_dtype = config.param_dtype
 
@@ -93,6 +96,8 @@ class WanT2V:
         self.model: WanModel = denoiser
         self.shard_fn = shard_fn
         self.sample_neg_prompt = config.sample_neg_prompt
+        # negative prompt -> T5 context, the negative prompt rarely changes between calls
+        self.context_null_cache = {}
 
     @monitor_resources(return_metrics=True)
     def generate(self,
@@ -110,8 +115,8 @@ class WanT2V:
         Generates video frames from text prompt using diffusion process.
 
         Args:
-            input_prompt (`str`):
-                Text prompt for content generation
+            input_prompt (`str` or `List[str]`):
+                Text prompt for content generation. A list of prompts is denoised as one batch
             size (tupele[`int`], *optional*, defaults to (1280,720)):
                 Controls video resolution, (width,height).
             frame_num (`int`, *optional*, defaults to 81):
@@ -126,14 +131,14 @@ class WanT2V:
                 Classifier-free guidance scale. Controls prompt adherence vs. creativity
             n_prompt (`str`, *optional*, defaults to ""):
                 Negative prompt for content exclusion. If not given, use `config.sample_neg_prompt`
-            seed (`int`, *optional*, defaults to -1):
-                Random seed for noise generation. If -1, use random seed.
+            seed (`int` or `List[int]`, *optional*, defaults to -1):
+                Random seed for noise generation. If -1, use random seed. A list gives one seed per prompt
             offload_model (`bool`, *optional*, defaults to True):
                 If True, offloads models to CPU during generation to save VRAM
 
         Returns:
-            torch.Tensor:
-                Generated video frames tensor. Dimensions: (C, N H, W) where:
+            torch.Tensor or List[torch.Tensor]:
+                Generated video frames tensor, a list of them if `input_prompt` is a list. Dimensions: (C, N H, W) where:
                 - C: Color channels (3 for RGB)
                 - N: Number of frames (81)
                 - H: Frame height (from size)
@@ -151,19 +156,27 @@ class WanT2V:
 
         if n_prompt == "":
             n_prompt = self.sample_neg_prompt
-        seed = seed if seed >= 0 else random.randint(0, sys.maxsize)
-        seed_g = torch.Generator(device=self.device)
-        seed_g.manual_seed(seed)
+        is_batch = not isinstance(input_prompt, str)
+        input_prompts = list(input_prompt) if is_batch else [input_prompt]
+        seeds = seed if isinstance(seed, (list, tuple)) else [seed] * len(input_prompts)
+        assert len(seeds) == len(input_prompts), \
+            f"got {len(seeds)} seeds for {len(input_prompts)} prompts"
+        # one generator per sample, so a prompt gets the same noise no matter how it is batched
+        seed_gs = []
+        for s in seeds:
+            s = s if s is not None and s >= 0 else random.randint(0, sys.maxsize)
+            seed_gs.append(torch.Generator(device=self.device).manual_seed(s))
+        seed_g = seed_gs[0]
 
         if not self.t5_cpu:
             self.text_encoder.model.to(self.device)
-            context = self.text_encoder([input_prompt], self.device)
-            context_null = self.text_encoder([n_prompt], self.device)
+            context = self.text_encoder(input_prompts, self.device)
+            context_null = self.encode_neg_prompt(n_prompt, self.device)
             if offload_model:
                 self.text_encoder.model.cpu()
         else:
-            context = self.text_encoder([input_prompt], torch.device('cpu'))
-            context_null = self.text_encoder([n_prompt], torch.device('cpu'))
+            context = self.text_encoder(input_prompts, torch.device('cpu'))
+            context_null = self.encode_neg_prompt(n_prompt, torch.device('cpu'))
             context = [t.to(self.device) for t in context]
             context_null = [t.to(self.device) for t in context_null]
 
@@ -175,7 +188,7 @@ class WanT2V:
                 target_shape[3],
                 dtype=torch.float32,
                 device=self.device,
-                generator=seed_g)
+                generator=g) for g in seed_gs
         ]
 
         @contextmanager
@@ -211,37 +224,43 @@ class WanT2V:
             # sample videos
             latents = noise
 
-            arg_c = {'context': context, 'seq_len': seq_len}
-            arg_null = {'context': context_null, 'seq_len': seq_len}
+            # cond and uncond branches share one batched forward,
+            # guide_scale == 1 reduces to the cond branch only
+            do_cfg = guide_scale != 1.0
+            if do_cfg:
+                arg_c = {'context': context + context_null * len(context), 'seq_len': seq_len}
+            else:
+                arg_c = {'context': context, 'seq_len': seq_len}
 
+            self.model.to(self.device)
             for _, t in enumerate(tqdm(timesteps)):
-                latent_model_input = latents
-                timestep = [t]
-
-                timestep = torch.stack(timestep)
+                latent_model_input = latents * 2 if do_cfg else latents
+                timestep = t.expand(len(latent_model_input))
 
-                self.model.to(self.device)
-                noise_pred_cond = self.model(
-                    latent_model_input, t=timestep, **arg_c)[0]
-                noise_pred_uncond = self.model(
-                    latent_model_input, t=timestep, **arg_null)[0]
+                noise_preds = self.model(
+                    latent_model_input, t=timestep, **arg_c)
 
-                noise_pred = noise_pred_uncond + guide_scale * (
-                    noise_pred_cond - noise_pred_uncond)
+                noise_preds = torch.stack(noise_preds)
+                if do_cfg:
+                    noise_pred_cond, noise_pred_uncond = noise_preds.chunk(2)
+                    noise_pred = noise_pred_uncond + guide_scale * (
+                        noise_pred_cond - noise_pred_uncond)
+                else:
+                    noise_pred = noise_preds
 
                 temp_x0 = sample_scheduler.step(
-                    noise_pred.unsqueeze(0),
+                    noise_pred,
                     t,
-                    latents[0].unsqueeze(0),
+                    torch.stack(latents),
                     return_dict=False,
                     generator=seed_g)[0]
-                latents = [temp_x0.squeeze(0)]
+                latents = list(temp_x0.unbind(0))
 
             x0 = latents
             if offload_model:
                 self.model.cpu()
                 torch.cuda.empty_cache()
-            if self.rank == 0:
+            if self.rank == 0 or not self.sample_parallel:
                 videos = self.vae.decode(x0)
 
         del noise, latents
@@ -249,10 +268,21 @@ class WanT2V:
         if offload_model:
             gc.collect()
             torch.cuda.synchronize()
-        if dist.is_initialized():
+        if dist.is_initialized() and self.sample_parallel:
             dist.barrier()
 
-        return videos[0] if self.rank == 0 else None
+        if self.rank != 0 and self.sample_parallel:
+            return None
+        return videos if is_batch else videos[0]
+
+    def encode_neg_prompt(self, n_prompt, device):
+        """
+        Encode the negative prompt with T5, the result is cached per prompt and device.
+        """
+        key = (n_prompt, str(device))
+        if key not in self.context_null_cache:
+            self.context_null_cache[key] = self.text_encoder([n_prompt], device)
+        return self.context_null_cache[key]
 
     def load_weight(self):
         self.text_encoder.load_weight()
@@ -7,16 +7,201 @@ from videotuna.utils.diffusion_utils import (
     make_ddim_timesteps,
     rescale_noise_cfg,
 )
+from videotuna.models.lvdm.modules.attention import context_kv_cache
 from videotuna.models.lvdm.modules.utils import noise_like
 
 
+def _has_tensor(item):
+    if isinstance(item, torch.Tensor):
+        return True
+    if isinstance(item, (list, tuple)):
+        return any(_has_tensor(i) for i in item)
+    if isinstance(item, dict):
+        return any(_has_tensor(i) for i in item.values())
+    return False
+
+
+def _is_batched(item, b):
+    """Whether every tensor in `item` (a tensor, or lists / dicts of them) has batch size `b`."""
+    if isinstance(item, torch.Tensor):
+        return item.dim() > 0 and item.shape[0] == b
+    if isinstance(item, (list, tuple)):
+        return all(_is_batched(i, b) for i in item)
+    if isinstance(item, dict):
+        return all(_is_batched(i, b) for i in item.values())
+    return True
+
+
+def _cat_batch(items):
+    """Concatenate structurally identical conditionings along the batch dim."""
+    first = items[0]
+    if isinstance(first, torch.Tensor):
+        return torch.cat(items)
+    if isinstance(first, (list, tuple)):
+        if any(len(i) != len(first) for i in items):
+            raise ValueError("conditionings differ in structure")
+        return type(first)(_cat_batch(list(z)) for z in zip(*items))
+    if isinstance(first, dict):
+        if any(i.keys() != first.keys() for i in items):
+            raise ValueError("conditionings differ in structure")
+        return {k: _cat_batch([i[k] for i in items]) for k in first}
+    return first
+
+
+def _slice_batch(item, start, end):
+    if isinstance(item, torch.Tensor):
+        return item[start:end]
+    if isinstance(item, (list, tuple)):
+        return type(item)(_slice_batch(i, start, end) for i in item)
+    if isinstance(item, dict):
+        return {k: _slice_batch(v, start, end) for k, v in item.items()}
+    return item
+
+
+class GuidanceBatcher:
+    """
+    Evaluate the model for several conditionings of the same latent (e.g. cond and uncond for
+    classifier-free guidance) in one forward, with the branches stacked along the batch dim.
+
+    The activation memory of a sample is measured on the first forward of a run. If the stacked
+    batch does not fit into `memory_budget_gb` (the free device memory minus `reserve` if None),
+    it is evaluated in chunks, which also happens after an out of memory error. Conditionings
+    that cannot be stacked (different structure or sequence length) run one after the other.
+    """
+
+    def __init__(self, memory_budget_gb=None, reserve=0.1):
+        self.memory_budget_gb = memory_budget_gb
+        self.reserve = reserve
+        self.reset()
+
+    def reset(self):
+        # samples per forward, None until it is measured
+        self.chunk_size = None
+
+    def _budget(self, device):
+        if self.memory_budget_gb is not None:
+            return self.memory_budget_gb * 1024**3
+        free_memory, _ = torch.cuda.mem_get_info(device)
+        return free_memory * (1 - self.reserve)
+
+    def _forward(self, model, x, t, c, kwargs, start, end):
+        return model.apply_model(
+            x[start:end],
+            t[start:end],
+            _slice_batch(c, start, end),
+            **_slice_batch(kwargs, start, end),
+        )
+
+    def _measure(self, model, x, t, c, kwargs, b):
+        """Run the first `b` samples alone and size the chunks from their peak memory."""
+        device = x.device
+        torch.cuda.synchronize(device)
+        allocated = torch.cuda.memory_allocated(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        out = self._forward(model, x, t, c, kwargs, 0, b)
+        sample_bytes = max(torch.cuda.max_memory_allocated(device) - allocated, 1) / b
+        self.chunk_size = max(b, int(self._budget(device) // sample_bytes))
+        return out
+
+    def __call__(self, model, x, t, conds, **kwargs):
+        """
+        Return the model outputs of `x` at `t` for every conditioning in `conds`, in order.
+        Tensors in `kwargs` with batch size `x.shape[0]` are repeated for every branch.
+        """
+        n, b = len(conds), x.shape[0]
+        batch_kwargs = {
+            k: v
+            for k, v in kwargs.items()
+            if isinstance(v, torch.Tensor) and _is_batched(v, b)
+        }
+        shared_kwargs = {k: v for k, v in kwargs.items() if k not in batch_kwargs}
+        if (
+            n == 1
+            or any(_has_tensor(v) for v in shared_kwargs.values())
+            or not all(_is_batched(c, b) for c in conds)
+        ):
+            return [model.apply_model(x, t, c, **kwargs) for c in conds]
+        try:
+            c = _cat_batch(conds)
+        except (ValueError, RuntimeError):
+            return [model.apply_model(x, t, c, **kwargs) for c in conds]
+        x = torch.cat([x] * n)
+        t = torch.cat([t] * n)
+        batch_kwargs = {k: torch.cat([v] * n) for k, v in batch_kwargs.items()}
+
+        def forward(start, end):
+            return self._forward(
+                model, x, t, c, dict(shared_kwargs, **batch_kwargs), start, end
+            )
+
+        outs = []
+        start = 0
+        if x.is_cuda and self.chunk_size is None:
+            outs.append(
+                self._measure(model, x, t, c, dict(shared_kwargs, **batch_kwargs), b)
+            )
+            start = b
+        chunk_size = self.chunk_size or n * b
+        while start < n * b:
+            try:
+                outs.append(forward(start, min(start + chunk_size, n * b)))
+            except torch.cuda.OutOfMemoryError:
+                if chunk_size == 1:
+                    raise
+                chunk_size = max(1, chunk_size // 2)
+                self.chunk_size = chunk_size
+                torch.cuda.empty_cache()
+                continue
+            start += chunk_size
+        return list(torch.cat(outs).split(b))
+
+
+def ddim_step(
+    x,
+    e_t,
+    noise,
+    coefs,
+    pred_x0=None,
+):
+    """
+    One DDIM update from the noise prediction `e_t`, with the 0-dim step coefficients `coefs` of
+    `DDIMSampler.step_coefficients`. `pred_x0` is predicted from `e_t` if None. Only tensor ops,
+    it can be compiled or captured into a CUDA graph.
+    """
+    if pred_x0 is None:
+        pred_x0 = (x - coefs["sqrt_one_minus_at"] * e_t) / coefs["sqrt_a_t"]
+    if "scale_t" in coefs:
+        pred_x0 = pred_x0 / coefs["scale_t"]
+        x_prev = coefs["sqrt_a_prev"] * coefs["scale_t_prev"] * pred_x0
+    else:
+        x_prev = coefs["sqrt_a_prev"] * pred_x0
+    # direction pointing to x_t
+    x_prev = x_prev + coefs["dir_xt"] * e_t + coefs["sigma_t"] * noise
+    return x_prev, pred_x0
+
+
 class DDIMSampler(object):
-    def __init__(self, model, schedule="linear", **kwargs):
+    """
+    DDIM sampler of the LVDM models. The coefficients of every step are precomputed as device
+    tensors in `make_schedule`, so that the sampling loop does not synchronize with the host.
+    With `compile_step=True` the DDIM update is compiled with `torch.compile`.
+    """
+
+    def __init__(
+        self,
+        model,
+        schedule="linear",
+        guidance_memory_budget_gb=None,
+        compile_step=False,
+        **kwargs,
+    ):
         super().__init__()
         self.model = model
         self.ddpm_num_timesteps = model.num_timesteps
         self.schedule = schedule
         self.counter = 0
+        self.guidance_batcher = GuidanceBatcher(guidance_memory_budget_gb)
+        self.ddim_step = torch.compile(ddim_step) if compile_step else ddim_step
 
     def register_buffer(self, name, attr):
         if type(attr) == torch.Tensor:
@@ -33,6 +218,7 @@ class DDIMSampler(object):
             num_ddpm_timesteps=self.ddpm_num_timesteps,
             verbose=verbose,
         )
+        self.guidance_batcher.reset()
         alphas_cumprod = self.model.diffusion_scheduler.alphas_cumprod
         assert (
             alphas_cumprod.shape[0] == self.ddpm_num_timesteps
@@ -48,15 +234,20 @@ class DDIMSampler(object):
         self.use_scale = self.model.use_scale
         # print('DDIM scale', self.use_scale)
 
+        # per-step tables, float32 on the device like the coefficients built at every step before
+        to_device = lambda x: torch.as_tensor(np.asarray(x), dtype=torch.float32).to(
+            self.model.device
+        )
+
         if self.use_scale:
             self.register_buffer("scale_arr", to_torch(self.model.scale_arr))
             ddim_scale_arr = self.scale_arr.cpu()[self.ddim_timesteps]
-            self.register_buffer("ddim_scale_arr", ddim_scale_arr)
+            self.register_buffer("ddim_scale_arr", to_device(ddim_scale_arr))
             ddim_scale_arr = np.asarray(
                 [self.scale_arr.cpu()[0]]
                 + self.scale_arr.cpu()[self.ddim_timesteps[:-1]].tolist()
             )
-            self.register_buffer("ddim_scale_arr_prev", ddim_scale_arr)
+            self.register_buffer("ddim_scale_arr_prev", to_device(ddim_scale_arr))
 
         # calculations for diffusion q(x_t | x_{t-1}) and others
         self.register_buffer(
@@ -84,10 +275,25 @@ class DDIMSampler(object):
             eta=ddim_eta,
             verbose=verbose,
         )
-        self.register_buffer("ddim_sigmas", ddim_sigmas)
-        self.register_buffer("ddim_alphas", ddim_alphas)
-        self.register_buffer("ddim_alphas_prev", ddim_alphas_prev)
-        self.register_buffer("ddim_sqrt_one_minus_alphas", np.sqrt(1.0 - ddim_alphas))
+        ddim_sigmas = np.asarray(ddim_sigmas, dtype=np.float64)
+        ddim_alphas = np.asarray(ddim_alphas, dtype=np.float64)
+        ddim_alphas_prev = np.asarray(ddim_alphas_prev, dtype=np.float64)
+        self.register_buffer("ddim_sigmas", to_device(ddim_sigmas))
+        self.register_buffer("ddim_alphas", to_device(ddim_alphas))
+        self.register_buffer("ddim_alphas_prev", to_device(ddim_alphas_prev))
+        self.register_buffer(
+            "ddim_sqrt_one_minus_alphas", to_device(np.sqrt(1.0 - ddim_alphas))
+        )
+        self.register_buffer("ddim_sqrt_alphas", to_device(np.sqrt(ddim_alphas)))
+        self.register_buffer(
+            "ddim_sqrt_alphas_prev", to_device(np.sqrt(ddim_alphas_prev))
+        )
+        self.register_buffer(
+            "ddim_dir_xt",
+            to_device(
+                np.sqrt(np.clip(1.0 - ddim_alphas_prev - ddim_sigmas**2, 0.0, None))
+            ),
+        )
         sigmas_for_original_sampling_steps = ddim_eta * torch.sqrt(
             (1 - self.alphas_cumprod_prev)
             / (1 - self.alphas_cumprod)
@@ -216,6 +422,7 @@ class DDIMSampler(object):
         precision=None,
         fs=None,
         guidance_rescale=0.0,
+        cache_context_kv=False,
         **kwargs,
     ):
         device = self.model.device
@@ -250,93 +457,100 @@ class DDIMSampler(object):
             )
             timesteps = self.ddim_timesteps[:subset_end]
 
+        # TODO fix dtype, the denoiser runs in float32 whatever the precision
+        img = img.to(torch.float32)
+
         intermediates = {"x_inter": [img], "pred_x0": [img]}
         time_range = (
-            reversed(range(0, timesteps))
+            np.arange(timesteps)[::-1]
             if ddim_use_original_steps
             else np.flip(timesteps)
         )
         total_steps = timesteps if ddim_use_original_steps else timesteps.shape[0]
+        # the timestep batches of all steps, indexed in the loop without a host to device copy
+        step_ts = (
+            torch.from_numpy(np.ascontiguousarray(time_range))
+            .to(device=device, dtype=torch.long)[:, None]
+            .expand(-1, b)
+        )
         if verbose:
             iterator = tqdm(time_range, desc="DDIM Sampler", total=total_steps)
         else:
             iterator = time_range
 
-        init_x0 = False
-        for i, step in enumerate(iterator):
-            index = total_steps - i - 1
-            ts = torch.full((b,), step, device=device, dtype=torch.long)
-            if start_timesteps is not None:
-                assert x0 is not None
-                if step > start_timesteps * time_range[0]:
-                    continue
-                elif not init_x0:
-                    img = self.model.diffusion_scheduler.q_sample(x0, ts)
-                    init_x0 = True
-
-            # use mask to blend noised original latent img_orig (xt_known)
-            # & new sampled latent img (xt_unknown)
-            if mask is not None:
-                assert x0 is not None
-                clean_cond = kwargs.pop("clean_cond", False)
-                if clean_cond:  # blend using x0_known, rather than xt_known
-                    img_orig = x0
-                else:
-                    img_orig = self.model.diffusion_scheduler.q_sample(
-                        x0, ts
-                    )  # TODO: deterministic forward pass? <ddim inversion>
-                img = (
-                    img_orig * mask + (1.0 - mask) * img
-                )  # keep original & modify use img
-
-            index_clip = int((1 - cond_tau) * total_steps)
-            if index <= index_clip and target_size is not None:
-                target_size_ = [
-                    target_size[0],
-                    target_size[1] // 8,
-                    target_size[2] // 8,
-                ]
-                img = torch.nn.functional.interpolate(
+        # the text/image context is constant over the run, cross-attention K/V can be reused
+        with context_kv_cache(self.model, enabled=cache_context_kv):
+            init_x0 = False
+            for i, step in enumerate(iterator):
+                index = total_steps - i - 1
+                ts = step_ts[i]
+                if start_timesteps is not None:
+                    assert x0 is not None
+                    if step > start_timesteps * time_range[0]:
+                        continue
+                    elif not init_x0:
+                        img = self.model.diffusion_scheduler.q_sample(x0, ts).to(
+                            torch.float32
+                        )
+                        init_x0 = True
+
+                # use mask to blend noised original latent img_orig (xt_known)
+                # & new sampled latent img (xt_unknown)
+                if mask is not None:
+                    assert x0 is not None
+                    clean_cond = kwargs.pop("clean_cond", False)
+                    if clean_cond:  # blend using x0_known, rather than xt_known
+                        img_orig = x0
+                    else:
+                        img_orig = self.model.diffusion_scheduler.q_sample(
+                            x0, ts
+                        )  # TODO: deterministic forward pass? <ddim inversion>
+                    img = (
+                        img_orig * mask + (1.0 - mask) * img
+                    )  # keep original & modify use img
+
+                index_clip = int((1 - cond_tau) * total_steps)
+                if index <= index_clip and target_size is not None:
+                    target_size_ = [
+                        target_size[0],
+                        target_size[1] // 8,
+                        target_size[2] // 8,
+                    ]
+                    img = torch.nn.functional.interpolate(
+                        img,
+                        size=target_size_,
+                        mode="nearest",
+                    )
+
+                outs = self.p_sample_ddim(
                     img,
-                    size=target_size_,
-                    mode="nearest",
+                    cond,
+                    ts,
+                    index=index,
+                    use_original_steps=ddim_use_original_steps,
+                    quantize_denoised=quantize_denoised,
+                    temperature=temperature,
+                    noise_dropout=noise_dropout,
+                    score_corrector=score_corrector,
+                    corrector_kwargs=corrector_kwargs,
+                    unconditional_guidance_scale=unconditional_guidance_scale,
+                    unconditional_conditioning=unconditional_conditioning,
+                    mask=mask,
+                    x0=x0,
+                    fs=fs,
+                    guidance_rescale=guidance_rescale,
+                    **kwargs,
                 )
-            # if precision is not None and precision == 'bf16':
-            # img = img.to(torch.bfloat16)
-
-            # TODO fix dtype here
-            # img = img.to(torch.bfloat16)
-            img = img.to(torch.float32)
 
-            outs = self.p_sample_ddim(
-                img,
-                cond,
-                ts,
-                index=index,
-                use_original_steps=ddim_use_original_steps,
-                quantize_denoised=quantize_denoised,
-                temperature=temperature,
-                noise_dropout=noise_dropout,
-                score_corrector=score_corrector,
-                corrector_kwargs=corrector_kwargs,
-                unconditional_guidance_scale=unconditional_guidance_scale,
-                unconditional_conditioning=unconditional_conditioning,
-                mask=mask,
-                x0=x0,
-                fs=fs,
-                guidance_rescale=guidance_rescale,
-                **kwargs,
-            )
+                img, pred_x0 = outs
+                if callback:
+                    callback(i)
+                if img_callback:
+                    img_callback(pred_x0, i)
 
-            img, pred_x0 = outs
-            if callback:
-                callback(i)
-            if img_callback:
-                img_callback(pred_x0, i)
-
-            if index % log_every_t == 0 or index == total_steps - 1:
-                intermediates["x_inter"].append(img)
-                intermediates["pred_x0"].append(pred_x0)
+                if index % log_every_t == 0 or index == total_steps - 1:
+                    intermediates["x_inter"].append(img)
+                    intermediates["pred_x0"].append(pred_x0)
 
         return img, intermediates
 
@@ -363,46 +577,39 @@ class DDIMSampler(object):
         guidance_rescale=0.0,
         **kwargs,
     ):
-        b, *_, device = *x.shape, x.device
-        if x.dim() == 5:
-            is_video = True
-        else:
-            is_video = False
+        device = x.device
         if unconditional_conditioning is None or unconditional_guidance_scale == 1.0:
             e_t = self.model.apply_model(x, t, c, **kwargs)  # unet denoiser
+            model_output = e_t
         else:
-            # with unconditional condition
-            if isinstance(c, torch.Tensor):
-                e_t = self.model.apply_model(x, t, c, **kwargs)
-                e_t_uncond = self.model.apply_model(
-                    x, t, unconditional_conditioning, **kwargs
-                )
-            elif isinstance(c, dict):
-                e_t = self.model.apply_model(x, t, c, **kwargs)
-                e_t_uncond = self.model.apply_model(
-                    x, t, unconditional_conditioning, **kwargs
-                )
-            else:
+            # with unconditional condition, both branches run in one forward
+            if not isinstance(c, (torch.Tensor, dict)):
                 raise NotImplementedError
+            e_t_cond, e_t_uncond = self.guidance_batcher(
+                self.model, x, t, [c, unconditional_conditioning], **kwargs
+            )
             # text cfg
             if uc_type is None:
-                e_t = e_t_uncond + unconditional_guidance_scale * (e_t - e_t_uncond)
+                e_t = e_t_uncond + unconditional_guidance_scale * (
+                    e_t_cond - e_t_uncond
+                )
             else:
                 if uc_type == "cfg_original":
-                    e_t = e_t + unconditional_guidance_scale * (e_t - e_t_uncond)
+                    e_t = e_t_cond + unconditional_guidance_scale * (
+                        e_t_cond - e_t_uncond
+                    )
                 elif uc_type == "cfg_ours":
-                    e_t = e_t + unconditional_guidance_scale * (e_t_uncond - e_t)
+                    e_t = e_t_cond + unconditional_guidance_scale * (
+                        e_t_uncond - e_t_cond
+                    )
                 else:
                     raise NotImplementedError
-            # temporal guidance
+            # temporal guidance, the temporal branch is the conditional output from above
             if conditional_guidance_scale_temporal is not None:
-                e_t_temporal = self.model.apply_model(x, t, c, **kwargs)
                 e_t_image = self.model.apply_model(
                     x, t, c, no_temporal_attn=True, **kwargs
                 )
-                e_t = e_t + conditional_guidance_scale_temporal * (
-                    e_t_temporal - e_t_image
-                )
+                e_t = e_t + conditional_guidance_scale_temporal * (e_t_cond - e_t_image)
 
             if guidance_rescale > 0.0:
                 e_t = rescale_noise_cfg(
@@ -419,81 +626,65 @@ class DDIMSampler(object):
                 self.model, e_t, x, t, c, **corrector_kwargs
             )
 
-        alphas = (
-            self.model.diffusion_scheduler.alphas_cumprod
-            if use_original_steps
-            else self.ddim_alphas
-        )
-        alphas_prev = (
-            self.model.diffusion_scheduler.alphas_cumprod_prev
-            if use_original_steps
-            else self.ddim_alphas_prev
-        )
-        sqrt_one_minus_alphas = (
-            self.model.diffusion_scheduler.sqrt_one_minus_alphas_cumprod
-            if use_original_steps
-            else self.ddim_sqrt_one_minus_alphas
-        )
-        sigmas = (
-            self.model.ddim_sigmas_for_original_num_steps
-            if use_original_steps
-            else self.ddim_sigmas
-        )
         # select parameters corresponding to the currently considered timestep
-
-        if is_video:
-            size = (b, 1, 1, 1, 1)
-        else:
-            size = (b, 1, 1, 1)
-        a_t = torch.full(size, alphas[index], device=device)
-        a_prev = torch.full(size, alphas_prev[index], device=device)
-        sigma_t = torch.full(size, sigmas[index], device=device)
-        sqrt_one_minus_at = torch.full(
-            size, sqrt_one_minus_alphas[index], device=device
-        )
+        coefs = self.step_coefficients(index, use_original_steps)
 
         if e_t.shape[1] != 4:  # channel dim
             e_t = e_t[:, :4]
 
-        # current prediction for x_0
-        if self.model.parameterization != "v":
-            pred_x0 = (x - sqrt_one_minus_at * e_t) / a_t.sqrt()
-        else:
+        # current prediction for x_0, predicted from e_t in the step otherwise
+        pred_x0 = None
+        if self.model.parameterization == "v":
             pred_x0 = self.model.diffusion_scheduler.predict_start_from_z_and_v(
                 x, t, model_output
             )
-
         if quantize_denoised:
+            if pred_x0 is None:
+                pred_x0 = (x - coefs["sqrt_one_minus_at"] * e_t) / coefs["sqrt_a_t"]
             pred_x0, _, *_ = self.model.first_stage_model.quantize(pred_x0)
-        # direction pointing to x_t
-        dir_xt = (1.0 - a_prev - sigma_t**2).clamp(min=0.0).sqrt() * e_t
 
-        noise = sigma_t * noise_like(x.shape, device, repeat_noise) * temperature
+        noise = noise_like(x.shape, device, repeat_noise)
+        if temperature != 1.0:
+            noise = noise * temperature
         if noise_dropout > 0.0:
             noise = torch.nn.functional.dropout(noise, p=noise_dropout)
 
-        alphas = (
-            self.model.diffusion_scheduler.alphas_cumprod
-            if use_original_steps
-            else self.ddim_alphas
-        )
+        return self.ddim_step(x, e_t, noise, coefs, pred_x0=pred_x0)
+
+    def step_coefficients(self, index, use_original_steps=False):
+        """
+        The DDIM coefficients of step `index` as 0-dim device tensors, views into the tables of
+        `make_schedule`, so that selecting them does not allocate or synchronize.
+        """
+        if not use_original_steps:
+            coefs = {
+                "sqrt_a_t": self.ddim_sqrt_alphas[index],
+                "sqrt_a_prev": self.ddim_sqrt_alphas_prev[index],
+                "sqrt_one_minus_at": self.ddim_sqrt_one_minus_alphas[index],
+                "sigma_t": self.ddim_sigmas[index],
+                "dir_xt": self.ddim_dir_xt[index],
+            }
+            if self.use_scale:
+                coefs["scale_t"] = self.ddim_scale_arr[index]
+                coefs["scale_t_prev"] = self.ddim_scale_arr_prev[index]
+            return coefs
+
+        a_t = self.alphas_cumprod[index]
+        a_prev = self.alphas_cumprod_prev[index]
+        sigma_t = self.ddim_sigmas_for_original_num_steps[index]
+        coefs = {
+            "sqrt_a_t": a_t.sqrt(),
+            "sqrt_a_prev": a_prev.sqrt(),
+            "sqrt_one_minus_at": self.sqrt_one_minus_alphas_cumprod[index],
+            "sigma_t": sigma_t,
+            "dir_xt": (1.0 - a_prev - sigma_t**2).clamp(min=0.0).sqrt(),
+        }
         if self.use_scale:
-            scale_arr = (
-                self.model.scale_arr if use_original_steps else self.ddim_scale_arr
+            coefs["scale_t"] = self.scale_arr[index]
+            coefs["scale_t_prev"] = torch.as_tensor(
+                self.model.scale_arr_prev[index], device=a_t.device
             )
-            scale_t = torch.full(size, scale_arr[index], device=device)
-            scale_arr_prev = (
-                self.model.scale_arr_prev
-                if use_original_steps
-                else self.ddim_scale_arr_prev
-            )
-            scale_t_prev = torch.full(size, scale_arr_prev[index], device=device)
-            pred_x0 /= scale_t
-            x_prev = a_prev.sqrt() * scale_t_prev * pred_x0 + dir_xt + noise
-        else:
-            x_prev = a_prev.sqrt() * pred_x0 + dir_xt + noise
-
-        return x_prev, pred_x0
+        return coefs
 
     @torch.no_grad()
     def stochastic_encode(self, x0, t, use_original_steps=False, noise=None):
@@ -503,7 +694,7 @@ class DDIMSampler(object):
             sqrt_alphas_cumprod = self.sqrt_alphas_cumprod
             sqrt_one_minus_alphas_cumprod = self.sqrt_one_minus_alphas_cumprod
         else:
-            sqrt_alphas_cumprod = torch.sqrt(self.ddim_alphas)
+            sqrt_alphas_cumprod = self.ddim_sqrt_alphas
             sqrt_one_minus_alphas_cumprod = self.ddim_sqrt_one_minus_alphas
 
         if noise is None:
@@ -541,13 +732,17 @@ class DDIMSampler(object):
         total_steps = timesteps.shape[0]
         print(f"Running DDIM Sampling with {total_steps} timesteps")
 
+        step_ts = (
+            torch.from_numpy(np.ascontiguousarray(time_range))
+            .to(device=x_latent.device, dtype=torch.long)[:, None]
+            .expand(-1, x_latent.shape[0])
+        )
+
         iterator = tqdm(time_range, desc="Decoding image", total=total_steps)
         x_dec = x_latent
         for i, step in enumerate(iterator):
             index = total_steps - i - 1
-            ts = torch.full(
-                (x_latent.shape[0],), step, device=x_latent.device, dtype=torch.long
-            )
+            ts = step_ts[i]
             x_dec, _ = self.p_sample_ddim(
                 x_dec,
                 cond,
@@ -10,15 +10,19 @@ from videotuna.utils.diffusion_utils import (
     rescale_noise_cfg,
 )
 from videotuna.models.lvdm.modules.utils import extract_into_tensor, noise_like
+from videotuna.schedulers.ddim import GuidanceBatcher
 
 
 class DDIMSampler(object):
-    def __init__(self, model, schedule="linear", **kwargs):
+    def __init__(
+        self, model, schedule="linear", guidance_memory_budget_gb=None, **kwargs
+    ):
         super().__init__()
         self.model = model
         self.ddpm_num_timesteps = model.num_timesteps
         self.schedule = schedule
         self.counter = 0
+        self.guidance_batcher = GuidanceBatcher(guidance_memory_budget_gb)
 
     def register_buffer(self, name, attr):
         if type(attr) == torch.Tensor:
@@ -35,6 +39,7 @@ class DDIMSampler(object):
             num_ddpm_timesteps=self.ddpm_num_timesteps,
             verbose=verbose,
         )
+        self.guidance_batcher.reset()
         alphas_cumprod = self.model.alphas_cumprod
         assert (
             alphas_cumprod.shape[0] == self.ddpm_num_timesteps
@@ -331,21 +336,23 @@ class DDIMSampler(object):
         if cfg_img is None:
             cfg_img = unconditional_guidance_scale
 
-        unconditional_conditioning_img_nonetext = kwargs[
-            "unconditional_conditioning_img_nonetext"
-        ]
+        # a sampler argument, not one of the model
+        unconditional_conditioning_img_nonetext = kwargs.pop(
+            "unconditional_conditioning_img_nonetext", None
+        )
 
         if unconditional_conditioning is None or unconditional_guidance_scale == 1.0:
             model_output = self.model.apply_model(x, t, c, **kwargs)  # unet denoiser
         else:
-            ### with unconditional condition
-            e_t_cond = self.model.apply_model(x, t, c, **kwargs)
-            e_t_uncond = self.model.apply_model(
-                x, t, unconditional_conditioning, **kwargs
-            )
-            e_t_uncond_img = self.model.apply_model(
-                x, t, unconditional_conditioning_img_nonetext, **kwargs
+            ### with unconditional condition, all branches run in one forward
+            conds = [c, unconditional_conditioning]
+            if unconditional_conditioning_img_nonetext is not None:
+                conds.append(unconditional_conditioning_img_nonetext)
+            e_t_cond, e_t_uncond, *e_t_uncond_img = self.guidance_batcher(
+                self.model, x, t, conds, **kwargs
             )
+            # without the image-only branch this is plain text cfg
+            e_t_uncond_img = e_t_uncond_img[0] if e_t_uncond_img else e_t_uncond
             # text cfg
             model_output = (
                 e_t_uncond
@@ -12,6 +12,7 @@ import torch
 from tqdm import tqdm
 
 from videotuna.third_party.flux.data_backend.base import BaseDataBackend
+from videotuna.third_party.flux.data_backend.packed import PackedDataBackend
 from videotuna.third_party.flux.prompts import PromptHandler
 from videotuna.third_party.flux.training.multi_process import _get_rank as get_rank
 from videotuna.third_party.flux.training.multi_process import rank_info, should_log
@@ -119,6 +120,8 @@ class TextEmbeddingCache(WebhookMixin):
         process_queue_size: int = 16,
         text_encoder_batch_size: int = 4,
         max_workers: int = 32,
+        cache_format: str = "files",
+        shard_size_mb: int = 1024,
     ):
         self.id = id
         if data_backend.id != id:
@@ -156,6 +159,16 @@ class TextEmbeddingCache(WebhookMixin):
         if self.data_backend.type == "local":
             self.cache_dir = os.path.abspath(self.cache_dir)
         self.data_backend.create_directory(self.cache_dir)
+        if cache_format == "packed":
+            self.data_backend = PackedDataBackend(
+                self.data_backend,
+                self.cache_dir,
+                prefix="text",
+                rank=get_rank(),
+                shard_size_mb=shard_size_mb,
+            )
+        elif cache_format != "files":
+            raise ValueError(f"Unknown cache format: {cache_format}")
         self.write_queue = Queue()
         self.process_write_batches = True
         self.batch_write_thread = Thread(
@@ -267,6 +280,12 @@ class TextEmbeddingCache(WebhookMixin):
         """Write a batch of embeddings to the cache."""
         logger.debug(f"Writing {len(batch)} items to disk")
         logger.debug(f"Batch: {batch}")
+        if isinstance(self.data_backend, PackedDataBackend):
+            # a single append to the current shard
+            embeddings, filenames = zip(*batch)
+            self.data_backend.write_batch(list(filenames), list(embeddings))
+            logger.debug(f"Completed write batch of {len(batch)} items")
+            return
         with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
             futures = [
                 executor.submit(self.data_backend.torch_save, *args) for args in batch
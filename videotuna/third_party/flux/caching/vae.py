@@ -13,6 +13,7 @@ from PIL import Image
 from tqdm import tqdm
 
 from videotuna.third_party.flux.data_backend.base import BaseDataBackend
+from videotuna.third_party.flux.data_backend.packed import PackedDataBackend
 from videotuna.third_party.flux.image_manipulation.training_sample import (
     PreparedSample,
     TrainingSample,
@@ -79,6 +80,8 @@ class VAECache(WebhookMixin):
         max_workers: int = 32,
         vae_cache_ondemand: bool = False,
         hash_filenames: bool = False,
+        cache_format: str = "files",
+        shard_size_mb: int = 1024,
     ):
         self.id = id
         if image_data_backend and image_data_backend.id != id:
@@ -99,6 +102,16 @@ class VAECache(WebhookMixin):
         if self.cache_data_backend and self.cache_data_backend.type == "local":
             self.cache_dir = os.path.abspath(self.cache_dir)
             self.cache_data_backend.create_directory(self.cache_dir)
+        if cache_format == "packed":
+            self.cache_data_backend = PackedDataBackend(
+                self.cache_data_backend,
+                self.cache_dir,
+                prefix="vae",
+                rank=get_rank(),
+                shard_size_mb=shard_size_mb,
+            )
+        elif cache_format != "files":
+            raise ValueError(f"Unknown cache format: {cache_format}")
         self.resolution = resolution
         self.resolution_type = resolution_type
         self.minimum_image_size = minimum_image_size
@@ -320,6 +333,11 @@ class VAECache(WebhookMixin):
 
         We want to thread this, using the data_backend.delete function as the worker function.
         """
+        if isinstance(self.cache_data_backend, PackedDataBackend):
+            # the entries live in a few shards, drop them all at once
+            self.cache_data_backend.clear()
+            StateTracker.set_vae_cache_files([], data_backend_id=self.id)
+            return
         futures = []
         all_cache_files = StateTracker.get_vae_cache_files(data_backend_id=self.id)
         with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
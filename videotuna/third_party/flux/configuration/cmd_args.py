@@ -612,6 +612,27 @@ def get_argument_parser():
             "If set, will gzip-compress the disk cache for Pytorch files. This will save substantial disk space, but may slow down the training process."
         ),
     )
+    parser.add_argument(
+        "--cache_format",
+        choices=["files", "packed"],
+        default="files",
+        help=(
+            "How the VAE and text embed caches are stored. 'files' writes one .pt file per sample."
+            " 'packed' appends the samples to large shard files with an offset index, which avoids listing and"
+            " checking millions of small files. Packed shards are not compressed, --compress_disk_cache is ignored."
+            " An existing cache can be converted with videotuna/third_party/flux/convert_cache_to_packed.py."
+            " Each backend can override this with 'cache_format'. Default: files."
+        ),
+    )
+    parser.add_argument(
+        "--cache_shard_size_mb",
+        type=int,
+        default=1024,
+        help=(
+            "With --cache_format=packed, a new local shard is started once the current one exceeds this size."
+            " On S3 every write batch is a shard object of its own. Default: 1024."
+        ),
+    )
     parser.add_argument(
         "--aspect_bucket_disable_rebuild",
         action="store_true",
@@ -814,6 +835,15 @@ def get_argument_parser():
         default=10,
         help=("Set the number of prefetched batches."),
     )
+    parser.add_argument(
+        "--dataloader_prefetch_workers",
+        type=int,
+        default=1,
+        help=(
+            "The number of threads retrieving batches when --dataloader_prefetch is enabled."
+            " Several threads help when the batches come from more than one data backend. Default: 1."
+        ),
+    )
     parser.add_argument(
         "--aspect_bucket_worker_count",
         type=int,
@@ -0,0 +1,102 @@
+"""
+Convert a VAE or text embed cache from one `.pt` file per sample to the packed shard format
+used with `--cache_format=packed`.
+
+    python videotuna/third_party/flux/convert_cache_to_packed.py --cache_dir cache/vae/flux --kind vae
+    python videotuna/third_party/flux/convert_cache_to_packed.py --cache_dir cache/text/flux --kind text \
+        --aws_bucket_name my-bucket --aws_region_name us-east-1
+
+The entries keep their cache paths as keys, so the trainer finds them without re-encoding.
+"""
+
+import argparse
+import os
+import sys
+
+from tqdm import tqdm
+
+sys.path.insert(0, os.getcwd())
+from videotuna.third_party.flux.data_backend.aws import S3DataBackend
+from videotuna.third_party.flux.data_backend.local import LocalDataBackend
+from videotuna.third_party.flux.data_backend.packed import PackedDataBackend
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--cache_dir", type=str, required=True, help="cache directory or S3 prefix"
+    )
+    parser.add_argument("--kind", type=str, required=True, choices=["vae", "text"])
+    parser.add_argument("--shard_size_mb", type=int, default=1024)
+    parser.add_argument(
+        "--batch_size", type=int, default=256, help="entries per append"
+    )
+    parser.add_argument(
+        "--compressed",
+        action="store_true",
+        help="the .pt files were written with --compress_disk_cache",
+    )
+    parser.add_argument(
+        "--delete_source",
+        action="store_true",
+        help="delete every .pt file once it is packed",
+    )
+    parser.add_argument("--aws_bucket_name", type=str, default=None)
+    parser.add_argument("--aws_region_name", type=str, default="us-east-1")
+    parser.add_argument("--aws_endpoint_url", type=str, default=None)
+    parser.add_argument("--aws_access_key_id", type=str, default=None)
+    parser.add_argument("--aws_secret_access_key", type=str, default=None)
+    return parser
+
+
+def get_backend(args):
+    if args.aws_bucket_name is None:
+        return LocalDataBackend(
+            accelerator=None, id=args.kind, compress_cache=args.compressed
+        )
+    return S3DataBackend(
+        id=args.kind,
+        bucket_name=args.aws_bucket_name,
+        accelerator=None,
+        region_name=args.aws_region_name,
+        endpoint_url=args.aws_endpoint_url,
+        aws_access_key_id=args.aws_access_key_id,
+        aws_secret_access_key=args.aws_secret_access_key,
+        compress_cache=args.compressed,
+    )
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+    backend = get_backend(args)
+    cache_dir = (
+        os.path.abspath(args.cache_dir) if backend.type == "local" else args.cache_dir
+    )
+    packed = PackedDataBackend(
+        backend, cache_dir, prefix=args.kind, shard_size_mb=args.shard_size_mb
+    )
+    files = [
+        path
+        for _, _, paths in backend.list_files(
+            file_extensions=["pt"], instance_data_dir=cache_dir
+        )
+        for path in paths
+    ]
+    packed_files = {path for _, _, paths in packed.list_files() for path in paths}
+    # the S3 listing covers the whole bucket
+    files = [
+        path
+        for path in files
+        if path.startswith(cache_dir.rstrip("/") + "/") and path not in packed_files
+    ]
+    print(
+        f"Packing {len(files)} cache files from {cache_dir}, {len(packed.index)} entries are packed already."
+    )
+
+    for start in tqdm(range(0, len(files), args.batch_size), desc="Packing"):
+        batch = files[start : start + args.batch_size]
+        packed.write_batch(batch, [backend.torch_load(path) for path in batch])
+        if args.delete_source:
+            for path in batch:
+                backend.delete(path)
+    print(f"Done, the packed cache holds {len(packed.index)} entries.")
@@ -151,6 +151,25 @@ class S3DataBackend(BaseDataBackend):
                     # Sleep for a bit before retrying.
                     time.sleep(self.read_retry_interval)
 
+    def read_range(self, s3_key, offset: int, length: int) -> bytes:
+        """Retrieve `length` bytes of the object, starting at `offset`, with a ranged GET."""
+        for i in range(self.read_retry_limit):
+            try:
+                response = self.client.get_object(
+                    Bucket=self.bucket_name,
+                    Key=str(s3_key),
+                    Range=f"bytes={offset}-{offset + length - 1}",
+                )
+                return response["Body"].read()
+            except (NoCredentialsError, PartialCredentialsError) as e:
+                raise e
+            except Exception as e:
+                logger.error(f'Error reading S3 bucket key "{s3_key}": {e}')
+                if i == self.read_retry_limit - 1:
+                    raise e
+                else:
+                    time.sleep(self.read_retry_interval)
+
     def open_file(self, s3_key, mode):
         """Open the file in the specified mode."""
         return self.read(s3_key)
@@ -197,7 +216,8 @@ class S3DataBackend(BaseDataBackend):
 
     def list_by_prefix(self, prefix=""):
         """List all files under a specific path (prefix) in the S3 bucket."""
-        response = self.client.list_objects_v2(Bucket=self.bucket_name, Prefix=prefix)
+        # list_objects_v2 returns at most 1000 keys per request
+        paginator = self.client.get_paginator("list_objects_v2")
         bucket_prefix = f"{self.bucket_name}/"
 
         return [
@@ -206,7 +226,8 @@ class S3DataBackend(BaseDataBackend):
                 if item["Key"].startswith(bucket_prefix)
                 else item["Key"]
             )
-            for item in response.get("Contents", [])
+            for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix)
+            for item in page.get("Contents", [])
         ]
 
     def list_files(self, file_extensions: list, instance_data_dir: str = None):
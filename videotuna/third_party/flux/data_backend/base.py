@@ -90,6 +90,13 @@ class BaseDataBackend(ABC):
         """
         pass
 
+    def read_range(self, identifier, offset: int, length: int) -> bytes:
+        """
+        Read `length` bytes of the identifier, starting at `offset`.
+        Backends that can seek or issue ranged requests should override this.
+        """
+        return self.read(identifier)[offset : offset + length]
+
     def _decompress_torch(self, gzip_data):
         """
         We've read the gzip from disk. Just decompress it.
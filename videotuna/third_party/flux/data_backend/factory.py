@@ -1,3 +1,4 @@
+import contextlib
 import io
 import json
 import logging
@@ -16,6 +17,7 @@ from videotuna.third_party.flux.data_backend.aws import S3DataBackend
 from videotuna.third_party.flux.data_backend.base import BaseDataBackend
 from videotuna.third_party.flux.data_backend.csv_url_list import CSVDataBackend
 from videotuna.third_party.flux.data_backend.local import LocalDataBackend
+from videotuna.third_party.flux.data_backend.packed import PackedDataBackend
 from videotuna.third_party.flux.multiaspect.dataset import MultiAspectDataset
 from videotuna.third_party.flux.multiaspect.sampler import MultiAspectSampler
 from videotuna.third_party.flux.prompts import PromptHandler
@@ -435,6 +437,8 @@ def configure_multi_databackend(args: dict, accelerator, text_encoders, tokenize
             cache_dir=init_backend.get("cache_dir", args.cache_dir_text),
             model_type=StateTracker.get_model_family(),
             write_batch_size=backend.get("write_batch_size", args.write_batch_size),
+            cache_format=backend.get("cache_format", args.cache_format),
+            shard_size_mb=backend.get("cache_shard_size_mb", args.cache_shard_size_mb),
         )
         init_backend["text_embed_cache"].set_webhook_handler(
             StateTracker.get_webhook_handler()
@@ -1037,6 +1041,10 @@ def configure_multi_databackend(args: dict, accelerator, text_encoders, tokenize
                 ),
                 vae_cache_ondemand=args.vae_cache_ondemand,
                 hash_filenames=hash_filenames,
+                cache_format=backend.get("cache_format", args.cache_format),
+                shard_size_mb=backend.get(
+                    "cache_shard_size_mb", args.cache_shard_size_mb
+                ),
             )
             init_backend["vaecache"].set_webhook_handler(
                 StateTracker.get_webhook_handler()
@@ -1093,6 +1101,11 @@ def configure_multi_databackend(args: dict, accelerator, text_encoders, tokenize
                 init_backend["vaecache"].process_buckets()
             logger.debug(f"Encoding images during training: {args.vae_cache_ondemand}")
             accelerator.wait_for_everyone()
+            if isinstance(
+                init_backend["vaecache"].cache_data_backend, PackedDataBackend
+            ):
+                # pick up the shards written by the other ranks
+                init_backend["vaecache"].cache_data_backend.refresh(force=True)
 
         info_log(f"Configured backend: {init_backend}")
 
@@ -1298,7 +1311,13 @@ def get_backend_weight(backend_id, backend, step):
         )
 
 
-def random_dataloader_iterator(step, backends: dict):
+def random_dataloader_iterator(step, backends: dict, locks: dict = None):
+    """
+    Return the next batch of a randomly chosen backend, or False once every backend is exhausted.
+
+    When several prefetch threads share `backends`, `locks` maps every backend id to a lock
+    that serialises access to its (stateful) sampler, while the other backends keep loading.
+    """
     prefetch_log_debug("Random dataloader iterator launched.")
     gradient_accumulation_steps = StateTracker.get_args().gradient_accumulation_steps
     logger.debug(f"Backends to select from {backends}")
@@ -1313,81 +1332,204 @@ def random_dataloader_iterator(step, backends: dict):
         epoch_step = int(step / gradient_accumulation_steps)
         StateTracker.set_epoch_step(epoch_step)
 
-        chosen_backend_id = select_dataloader_index(step, backends)
+        # select on a snapshot, another prefetch thread may remove an exhausted backend meanwhile
+        chosen_backend_id = select_dataloader_index(step, dict(backends))
         if chosen_backend_id is None:
             logger.debug("No dataloader iterators were available.")
             break
+        chosen_backend = backends.get(chosen_backend_id, None)
+        if chosen_backend is None:
+            continue
 
-        chosen_iter = iter(backends[chosen_backend_id])
-
-        try:
-            return next(chosen_iter)
-        except MultiDatasetExhausted:
-            # We may want to repeat the same dataset multiple times in a single epoch.
-            # If so, we can just reset the iterator and keep going.
-            repeats = StateTracker.get_data_backend_config(chosen_backend_id).get(
-                "repeats", False
-            )
-            if (
-                repeats
-                and repeats > 0
-                and StateTracker.get_repeats(chosen_backend_id) < repeats
-            ):
-                StateTracker.increment_repeats(chosen_backend_id)
-                logger.debug(
-                    f"Dataset (name={chosen_backend_id}) is now sampling its {StateTracker.get_repeats(chosen_backend_id)} repeat out of {repeats} total allowed."
-                )
+        # the exhaustion is handled under the lock too: the sampler has already reset itself for the
+        # next epoch, another thread must not draw from it before the backend is removed
+        lock = (
+            locks[chosen_backend_id] if locks is not None else contextlib.nullcontext()
+        )
+        with lock:
+            if chosen_backend_id not in backends:
                 continue
-            logger.debug(
-                f"Dataset (name={chosen_backend_id}) is now exhausted after {StateTracker.get_repeats(chosen_backend_id)} repeat(s). Removing from list."
-            )
-            del backends[chosen_backend_id]
-            StateTracker.backend_exhausted(chosen_backend_id)
-            StateTracker.set_repeats(data_backend_id=chosen_backend_id, repeats=0)
-        finally:
-            if not backends:
+            try:
+                return next(iter(chosen_backend))
+            except MultiDatasetExhausted:
+                # We may want to repeat the same dataset multiple times in a single epoch.
+                # If so, we can just reset the iterator and keep going.
+                repeats = StateTracker.get_data_backend_config(chosen_backend_id).get(
+                    "repeats", False
+                )
+                if (
+                    repeats
+                    and repeats > 0
+                    and StateTracker.get_repeats(chosen_backend_id) < repeats
+                ):
+                    StateTracker.increment_repeats(chosen_backend_id)
+                    logger.debug(
+                        f"Dataset (name={chosen_backend_id}) is now sampling its {StateTracker.get_repeats(chosen_backend_id)} repeat out of {repeats} total allowed."
+                    )
+                    continue
                 logger.debug(
-                    "All dataloaders exhausted. Moving to next epoch in main training loop."
+                    f"Dataset (name={chosen_backend_id}) is now exhausted after {StateTracker.get_repeats(chosen_backend_id)} repeat(s). Removing from list."
                 )
-                StateTracker.clear_exhausted_buckets()
-                return False
+                backends.pop(chosen_backend_id, None)
+                StateTracker.backend_exhausted(chosen_backend_id)
+                StateTracker.set_repeats(data_backend_id=chosen_backend_id, repeats=0)
+            finally:
+                if not backends:
+                    logger.debug(
+                        "All dataloaders exhausted. Moving to next epoch in main training loop."
+                    )
+                    StateTracker.clear_exhausted_buckets()
+                    return False
 
 
 class BatchFetcher:
-    def __init__(self, step, max_size=10, datasets={}):
+    """
+    Prefetch batches from `random_dataloader_iterator` in `num_workers` background threads.
+
+    The queue holds at most `max_size` batches. Producers block while it is full and
+    `next_response` blocks until a batch is ready, neither of them polls. Queue depth,
+    consumer wait time and producer latency are accumulated and returned by `get_metrics`,
+    a high wait time with an empty queue means the training is input-bound.
+
+    Threads are used rather than processes, the samplers and the `StateTracker` they update
+    live in the training process.
+    """
+
+    def __init__(self, step, max_size=10, datasets={}, num_workers=1):
         self.queue = queue.Queue(max_size)
         self.datasets = datasets
-        self.keep_running = True
         self.step = step
+        self.num_workers = max(1, num_workers)
+        self.locks = {backend_id: threading.Lock() for backend_id in datasets}
+        self.threads = []
+        self._stop_event = threading.Event()
+        # the end of epoch marker is queued once, after every in-flight batch
+        self._inflight = 0
+        self._exhausted = False
+        self._state = threading.Condition()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "batches": 0,
+            "produced": 0,
+            "wait_time": 0.0,
+            "max_wait_time": 0.0,
+            "producer_time": 0.0,
+            "queue_depth": 0,
+        }
+
+    @property
+    def keep_running(self):
+        return not self._stop_event.is_set()
 
     def start_fetching(self):
-        thread = threading.Thread(target=self.fetch_responses)
-        thread.start()
-        return thread
+        self.threads = [
+            threading.Thread(target=self.fetch_responses, daemon=True)
+            for _ in range(self.num_workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+        # returned as the handle the training loop joins on
+        return self
+
+    def join(self, timeout=None):
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def _put(self, item):
+        # wake up regularly, so that a producer blocked on a full queue notices `stop_fetching`
+        while self.keep_running:
+            try:
+                self.queue.put(item, timeout=1.0)
+                return True
+            except queue.Full:
+                continue
+        return False
 
     def fetch_responses(self):
         prefetch_log_debug("Launching retrieval thread.")
         while self.keep_running:
-            if self.queue.qsize() < self.queue.maxsize:
-                prefetch_log_debug(
-                    f"Queue size: {self.queue.qsize()}. Fetching more data."
+            with self._state:
+                if self._exhausted:
+                    break
+                self._inflight += 1
+            start = time.perf_counter()
+            try:
+                response = random_dataloader_iterator(
+                    self.step, self.datasets, locks=self.locks
                 )
-                self.queue.put(random_dataloader_iterator(self.step, self.datasets))
-                if self.queue.qsize() >= self.queue.maxsize:
-                    prefetch_log_debug("Completed fetching data. Queue is full.")
-                    continue
-            else:
-                time.sleep(0.5)
+            except Exception:
+                with self._state:
+                    self._inflight -= 1
+                    self._state.notify_all()
+                raise
+            producer_time = time.perf_counter() - start
+            if response is False:
+                with self._state:
+                    self._inflight -= 1
+                    first = not self._exhausted
+                    self._exhausted = True
+                    # the other threads may still be loading the last batches of the epoch
+                    self._state.wait_for(
+                        lambda: self._inflight == 0 or not self.keep_running
+                    )
+                    self._state.notify_all()
+                if first:
+                    prefetch_log_debug("All backends exhausted. Queueing end of epoch.")
+                    self._put(False)
+                break
+            with self._metrics_lock:
+                self._metrics["producer_time"] += producer_time
+                self._metrics["produced"] += 1
+            self._put(response)
+            with self._state:
+                self._inflight -= 1
+                self._state.notify_all()
+            prefetch_log_debug(
+                f"Queue size: {self.queue.qsize()}. Batch loaded in {producer_time:.3f}s."
+            )
         prefetch_log_debug("Exiting retrieval thread.")
 
     def next_response(self, step: int):
         self.step = step
-        if self.queue.empty():
+        queue_depth = self.queue.qsize()
+        if queue_depth == 0:
             prefetch_log_debug("Queue is empty. Waiting for data.")
-        while self.queue.empty():
-            continue
-        prefetch_log_debug("Queue has data. Yielding next item.")
-        return self.queue.get()
+        start = time.perf_counter()
+        response = self.queue.get()
+        wait_time = time.perf_counter() - start
+        with self._metrics_lock:
+            self._metrics["batches"] += 1
+            self._metrics["wait_time"] += wait_time
+            self._metrics["max_wait_time"] = max(
+                self._metrics["max_wait_time"], wait_time
+            )
+            self._metrics["queue_depth"] += queue_depth
+        prefetch_log_debug(
+            f"Queue has data. Waited {wait_time:.3f}s for the next item."
+        )
+        return response
+
+    def get_metrics(self, reset: bool = True):
+        """
+        Average queue depth seen by the consumer, consumer wait time and producer latency
+        (in seconds) since the last call.
+        """
+        with self._metrics_lock:
+            metrics = self._metrics
+            batches = max(1, metrics["batches"])
+            result = {
+                "prefetch/queue_depth": metrics["queue_depth"] / batches,
+                "prefetch/wait_time": metrics["wait_time"] / batches,
+                "prefetch/max_wait_time": metrics["max_wait_time"],
+                "prefetch/producer_latency": metrics["producer_time"]
+                / max(1, metrics["produced"]),
+            }
+            if reset:
+                for key in metrics:
+                    metrics[key] = type(metrics[key])(0)
+        return result
 
     def stop_fetching(self):
-        self.keep_running = False
+        self._stop_event.set()
+        with self._state:
+            self._state.notify_all()
@@ -47,6 +47,20 @@ class LocalDataBackend(BaseDataBackend):
                 )
             file.write(data)
 
+    def append(self, filepath: str, data: bytes) -> int:
+        """Append the bytes to the file and return the offset they were written at."""
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, "ab") as file:
+            offset = file.tell()
+            file.write(data)
+        return offset
+
+    def read_range(self, filepath, offset: int, length: int) -> bytes:
+        """Read `length` bytes of the file, starting at `offset`."""
+        with open(filepath, "rb") as file:
+            file.seek(offset)
+            return file.read(length)
+
     def delete(self, filepath):
         """Delete the specified file."""
         if os.path.exists(filepath):
@@ -0,0 +1,360 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import numpy as np
+import torch
+
+from videotuna.third_party.flux.data_backend.base import BaseDataBackend
+
+logger = logging.getLogger("PackedDataBackend")
+logger.setLevel(os.environ.get("SIMPLETUNER_LOG_LEVEL", "INFO"))
+
+SHARD_NAME = "{prefix}-rank{rank:03d}-{shard:05d}.bin"
+INDEX_SUFFIX = ".idx.jsonl"
+# kept apart from the entries' own paths, so that listing the shards never walks a legacy cache
+PACKED_DIR = "_packed"
+SHARD_PATTERN = re.compile(r"^(?P<prefix>.+)-rank(?P<rank>\d+)-(?P<shard>\d+)\.bin$")
+# tensors start on aligned offsets, so that memory-mapped views can be reinterpreted as any dtype
+ALIGNMENT = 64
+
+
+def _dtype_from_str(name: str) -> torch.dtype:
+    return getattr(torch, name.replace("torch.", ""))
+
+
+def _pack(data):
+    """
+    Flatten a tensor, or a tuple/list of tensors (and Nones), into its raw bytes and an index record.
+    """
+    if isinstance(data, torch.Tensor):
+        structure, tensors = "tensor", [data]
+    elif isinstance(data, (tuple, list)):
+        structure, tensors = type(data).__name__, list(data)
+    else:
+        raise ValueError(f"Cannot pack cache entries of type {type(data)}.")
+    specs, chunks = [], []
+    for tensor in tensors:
+        if tensor is None:
+            specs.append(None)
+            continue
+        tensor = tensor.detach().to("cpu").contiguous()
+        raw = tensor.reshape(-1).view(torch.uint8).numpy().tobytes()
+        specs.append([str(tensor.dtype), list(tensor.shape), len(raw)])
+        chunks.append(raw)
+    return structure, specs, chunks
+
+
+def _unpack(structure, tensors):
+    if structure == "tensor":
+        return tensors[0]
+    return tuple(tensors) if structure == "tuple" else list(tensors)
+
+
+class PackedDataBackend(BaseDataBackend):
+    """
+    Store cache entries (latents, text embeds) in large append-only shards instead of one
+    `.pt` file per sample.
+
+    A batch of entries is written with a single append to the current shard of this rank,
+    followed by one line per entry in the shard's `.idx.jsonl` offset index. Entries keep
+    their usual cache paths as keys, so the caches address them exactly like files. The
+    whole index is held in memory: `exists` and `list_files` never touch the storage, and
+    the index files written by the other ranks are merged incrementally with `refresh`.
+
+    Local shards are read through memory maps, so a cached latent is a zero-copy view.
+    S3 objects cannot be appended to, so there every write batch becomes its own shard
+    object and entries are read with ranged GETs.
+
+    Any other operation is forwarded to the wrapped backend.
+    """
+
+    def __init__(
+        self,
+        data_backend: BaseDataBackend,
+        cache_dir: str,
+        prefix: str = "packed",
+        rank: int = 0,
+        shard_size_mb: int = 1024,
+        refresh_interval: float = None,
+    ):
+        self.data_backend = data_backend
+        self.id = data_backend.id
+        self.type = data_backend.type
+        self.compress_cache = False
+        self.cache_dir = cache_dir.rstrip("/")
+        self.prefix = prefix
+        self.rank = rank
+        self.shard_size = int(shard_size_mb * 1024**2)
+        if refresh_interval is None:
+            # a local refresh only stats a few index files, listing a bucket is expensive
+            refresh_interval = 0.0 if self.type == "local" else 10.0
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        # key -> (shard name, offset, structure, specs)
+        self.index = {}
+        self._index_offsets = {}
+        self._mmaps = {}
+        self._last_refresh = 0.0
+        self._shard = None
+        self._shard_bytes = 0
+        if self.type == "local":
+            os.makedirs(self._path(""), exist_ok=True)
+        self.refresh(force=True)
+
+    def __getattr__(self, name):
+        # image reads, metadata and everything else stay on the wrapped backend
+        data_backend = self.__dict__.get("data_backend")
+        if data_backend is None:
+            raise AttributeError(name)
+        return getattr(data_backend, name)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.cache_dir, PACKED_DIR, name)
+
+    def _key(self, identifier) -> str:
+        identifier = str(identifier)
+        if self.type == "local":
+            identifier = os.path.abspath(identifier)
+        return os.path.relpath(identifier, self.cache_dir)
+
+    def _list_index_files(self) -> list:
+        if self.type == "local":
+            if not os.path.isdir(self._path("")):
+                return []
+            names = os.listdir(self._path(""))
+        else:
+            names = [
+                os.path.basename(key)
+                for key in self.data_backend.list_by_prefix(self._path(""))
+            ]
+        return sorted(
+            name
+            for name in names
+            if name.endswith(INDEX_SUFFIX) and name.startswith(self.prefix + "-rank")
+        )
+
+    def refresh(self, force: bool = False):
+        """Merge the index lines written since the last refresh, by any rank."""
+        with self._lock:
+            if not force and time.time() - self._last_refresh < self.refresh_interval:
+                return
+            self._last_refresh = time.time()
+            for index_name in self._list_index_files():
+                index_path = self._path(index_name)
+                consumed = self._index_offsets.get(index_name, 0)
+                if self.type == "local":
+                    if os.path.getsize(index_path) <= consumed:
+                        continue
+                    with open(index_path, "rb") as f:
+                        f.seek(consumed)
+                        content = f.read()
+                elif consumed > 0:
+                    # S3 index objects are written once, together with their shard
+                    continue
+                else:
+                    content = self.data_backend.read(index_path) or b""
+                # a writer may be half-way through a line, keep it for the next refresh
+                complete = content[: content.rfind(b"\n") + 1]
+                self._index_offsets[index_name] = consumed + len(complete)
+                shard_name = index_name[: -len(INDEX_SUFFIX)] + ".bin"
+                for line in complete.decode("utf-8").splitlines():
+                    if not line:
+                        continue
+                    record = json.loads(line)
+                    if record.get("d"):
+                        self.index.pop(record["k"], None)
+                    else:
+                        self.index[record["k"]] = (
+                            shard_name,
+                            record["o"],
+                            record["s"],
+                            record["t"],
+                        )
+
+    def _next_shard(self) -> str:
+        shards = [-1]
+        for index_name in self._index_offsets:
+            match = SHARD_PATTERN.match(index_name[: -len(INDEX_SUFFIX)] + ".bin")
+            if match and int(match["rank"]) == self.rank:
+                shards.append(int(match["shard"]))
+        if self._shard is not None:
+            shards.append(int(SHARD_PATTERN.match(self._shard)["shard"]))
+        return SHARD_NAME.format(
+            prefix=self.prefix, rank=self.rank, shard=max(shards) + 1
+        )
+
+    def write_batch(self, identifiers, data_list) -> None:
+        """Append a batch of entries to this rank's current shard, with a single write."""
+        payload, records = bytearray(), []
+        with self._lock:
+            if (
+                self.type != "local"
+                or self._shard is None
+                or self._shard_bytes >= self.shard_size
+            ):
+                self._shard = self._next_shard()
+                self._shard_bytes = 0
+            base = self._shard_bytes
+            for identifier, data in zip(identifiers, data_list):
+                structure, specs, chunks = _pack(data)
+                payload.extend(b"\0" * (-(base + len(payload)) % ALIGNMENT))
+                records.append(
+                    {
+                        "k": self._key(identifier),
+                        "o": base + len(payload),
+                        "s": structure,
+                        "t": specs,
+                    }
+                )
+                for chunk in chunks:
+                    payload.extend(chunk)
+                    payload.extend(b"\0" * (-(base + len(payload)) % ALIGNMENT))
+            shard_path = self._path(self._shard)
+            index_name = self._shard[: -len(".bin")] + INDEX_SUFFIX
+            index_lines = "".join(
+                json.dumps(record) + "\n" for record in records
+            ).encode()
+            if self.type == "local":
+                offset = self.data_backend.append(shard_path, bytes(payload))
+                if offset != base:
+                    raise ValueError(
+                        f"Packed shard {shard_path} was modified by another writer, expected offset {base} but got {offset}."
+                    )
+                # the data is on disk before its index lines
+                self.data_backend.append(self._path(index_name), index_lines)
+                self._index_offsets[index_name] = self._index_offsets.get(
+                    index_name, 0
+                ) + len(index_lines)
+            else:
+                self.data_backend.write(shard_path, bytes(payload))
+                self.data_backend.write(self._path(index_name), index_lines)
+                self._index_offsets[index_name] = len(index_lines)
+            self._shard_bytes = base + len(payload)
+            for record in records:
+                self.index[record["k"]] = (
+                    self._shard,
+                    record["o"],
+                    record["s"],
+                    record["t"],
+                )
+
+    def write(self, identifier, data) -> None:
+        if isinstance(data, (torch.Tensor, tuple, list)):
+            return self.write_batch([identifier], [data])
+        return self.data_backend.write(identifier, data)
+
+    def torch_save(self, data, filename):
+        return self.write_batch([filename], [data])
+
+    def _read_bytes(self, shard_name, offset, length) -> torch.Tensor:
+        if length == 0:
+            return torch.empty(0, dtype=torch.uint8)
+        if self.type != "local":
+            data = self.data_backend.read_range(self._path(shard_name), offset, length)
+            return torch.frombuffer(bytearray(data), dtype=torch.uint8)
+        mmap = self._mmaps.get(shard_name)
+        if mmap is None or mmap.shape[0] < offset + length:
+            # the current shard keeps growing, map it again once the entry is past its end
+            mmap = np.memmap(self._path(shard_name), dtype=np.uint8, mode="c")
+            self._mmaps[shard_name] = mmap
+        return torch.from_numpy(mmap[offset : offset + length])
+
+    def torch_load(self, filename):
+        key = self._key(filename)
+        entry = self.index.get(key)
+        if entry is None:
+            self.refresh(force=True)
+            entry = self.index.get(key)
+        if entry is None:
+            raise FileNotFoundError(f"{filename} not found in the packed cache.")
+        shard_name, offset, structure, specs = entry
+        tensors = []
+        for spec in specs:
+            if spec is None:
+                tensors.append(None)
+                continue
+            dtype, shape, nbytes = spec
+            raw = self._read_bytes(shard_name, offset, nbytes)
+            tensors.append(raw.view(_dtype_from_str(dtype)).reshape(shape))
+            offset += nbytes + (-nbytes % ALIGNMENT)
+        return _unpack(structure, tensors)
+
+    def read(self, identifier, *args, **kwargs):
+        if self._key(identifier) in self.index:
+            return self.torch_load(identifier)
+        return self.data_backend.read(identifier, *args, **kwargs)
+
+    def exists(self, identifier) -> bool:
+        if identifier is None:
+            return False
+        key = self._key(identifier)
+        if key not in self.index:
+            self.refresh()
+        return key in self.index
+
+    def delete(self, identifier):
+        """Drop the entry from the index. The bytes stay in the shard, which is append-only."""
+        key = self._key(identifier)
+        with self._lock:
+            if key not in self.index:
+                raise FileNotFoundError(f"{identifier} not found in the packed cache.")
+            shard_name = self.index.pop(key)[0]
+            tombstone = (json.dumps({"k": key, "d": 1}) + "\n").encode()
+            index_name = shard_name[: -len(".bin")] + INDEX_SUFFIX
+            if self.type == "local":
+                self.data_backend.append(self._path(index_name), tombstone)
+                self._index_offsets[index_name] = self._index_offsets.get(
+                    index_name, 0
+                ) + len(tombstone)
+            else:
+                # objects are immutable, record the deletion in an index object of its own
+                self._shard = self._next_shard()
+                index_name = self._shard[: -len(".bin")] + INDEX_SUFFIX
+                self.data_backend.write(self._path(index_name), tombstone)
+                self._index_offsets[index_name] = len(tombstone)
+
+    def clear(self):
+        """Delete every shard and index file of this cache."""
+        with self._lock:
+            for index_name in self._list_index_files():
+                shard_name = index_name[: -len(INDEX_SUFFIX)] + ".bin"
+                for name in [index_name, shard_name]:
+                    self._mmaps.pop(name, None)
+                    try:
+                        self.data_backend.delete(self._path(name))
+                    except FileNotFoundError:
+                        pass
+            self.index.clear()
+            self._index_offsets.clear()
+            self._shard = None
+            self._shard_bytes = 0
+
+    def list_files(self, file_extensions: list = None, instance_data_dir: str = None):
+        """
+        List the cache entries in the same `(subdir, [], files)` layout as the file-based
+        backends, straight from the in-memory index.
+        """
+        self.refresh(force=True)
+        extensions = {f".{ext.lower()}" for ext in file_extensions or []}
+        files = [
+            os.path.join(self.cache_dir, key)
+            for key in self.index
+            if not extensions or os.path.splitext(key)[1].lower() in extensions
+        ]
+        return [(self.cache_dir, [], files)] if files else []
+
+    def open_file(self, identifier, mode):
+        return self.data_backend.open_file(identifier, mode)
+
+    def read_image(self, *args, **kwargs):
+        return self.data_backend.read_image(*args, **kwargs)
+
+    def read_image_batch(self, *args, **kwargs):
+        return self.data_backend.read_image_batch(*args, **kwargs)
+
+    def create_directory(self, directory_path):
+        return self.data_backend.create_directory(directory_path)
@@ -92,6 +92,8 @@ class MultiAspectSampler(torch.utils.data.Sampler):
         self.exhausted_buckets = []
         self.buckets = self.load_buckets()
         self.state_manager = BucketStateManager(self.id)
+        # per bucket, the unseen image paths and their positions, kept up to date by _mark_batch_as_seen
+        self._unseen_pools = {}
 
     def save_state(self, state_path: str):
         """
@@ -104,7 +106,10 @@ class MultiAspectSampler(torch.utils.data.Sampler):
             "exhausted_buckets": self.exhausted_buckets,
             "batch_size": self.batch_size,
             "current_bucket": self.current_bucket,
-            "seen_images": self.metadata_backend.seen_images,
+            "seen_bitmaps": self.state_manager.pack_seen_images(
+                self.metadata_backend.aspect_ratio_bucket_indices,
+                lambda image: self.metadata_backend.is_seen(self._image_path(image)),
+            ),
             "current_epoch": self.current_epoch,
         }
         self.state_manager.save_state(state, state_path)
@@ -128,11 +133,24 @@ class MultiAspectSampler(torch.utils.data.Sampler):
             )
             self.current_epoch = previous_state["current_epoch"]
         # Merge seen_images into self.state_manager.seen_images Manager.dict:
-        if "seen_images" in previous_state:
+        if "seen_bitmaps" in previous_state:
+            seen_images = self.state_manager.unpack_seen_images(
+                previous_state.get(
+                    "aspect_ratio_bucket_indices",
+                    self.metadata_backend.aspect_ratio_bucket_indices,
+                ),
+                previous_state["seen_bitmaps"],
+            )
+            self.logger.info(f"Previous checkpoint had {len(seen_images)} seen images.")
+            self.metadata_backend.mark_batch_as_seen(
+                [self._image_path(image) for image in seen_images]
+            )
+        elif "seen_images" in previous_state:
             self.logger.info(
                 f"Previous checkpoint had {len(previous_state['seen_images'])} seen images."
             )
             self.metadata_backend.seen_images.update(previous_state["seen_images"])
+        self._unseen_pools = {}
 
     def load_buckets(self):
         return list(
@@ -242,7 +260,7 @@ class MultiAspectSampler(torch.utils.data.Sampler):
     def _reset_buckets(self):
         if (
             len(self.metadata_backend.seen_images) == 0
-            and len(self._get_unseen_images()) == 0
+            and self._count_unseen_images() == 0
         ):
             raise Exception(
                 f"No images found in the dataset: {self.metadata_backend.aspect_ratio_bucket_indices}"
@@ -259,38 +277,70 @@ class MultiAspectSampler(torch.utils.data.Sampler):
         self.exhausted_buckets = []
         self.buckets = self.load_buckets()
         self.metadata_backend.reset_seen_images()
+        self._unseen_pools = {}
         self.change_bucket()
         raise MultiDatasetExhausted()
 
+    def _image_path(self, image: str) -> str:
+        if image.startswith("http"):
+            return image
+        return os.path.join(self.metadata_backend.instance_data_dir, image)
+
+    def _get_unseen_pool(self, bucket) -> dict:
+        """
+        Return the unseen images of a bucket, scanning the bucket only on first use
+        or after images were added to or removed from it.
+        """
+        images = self.metadata_backend.aspect_ratio_bucket_indices[bucket]
+        pool = self._unseen_pools.get(bucket)
+        if pool is None or pool["size"] != len(images):
+            unseen = [
+                image_path
+                for image_path in map(self._image_path, images)
+                if not self.metadata_backend.is_seen(image_path)
+            ]
+            pool = {
+                "size": len(images),
+                "unseen": unseen,
+                "positions": {image: i for i, image in enumerate(unseen)},
+            }
+            self._unseen_pools[bucket] = pool
+        return pool
+
+    def _mark_batch_as_seen(self, image_paths: list, bucket):
+        """Mark the images as seen and drop them from the bucket's unseen pool, in O(1) each."""
+        self.metadata_backend.mark_batch_as_seen(image_paths)
+        pool = self._unseen_pools.get(bucket)
+        if pool is None:
+            return
+        unseen, positions = pool["unseen"], pool["positions"]
+        for image_path in image_paths:
+            index = positions.pop(image_path, None)
+            if index is None:
+                continue
+            # swap the last unseen image into the freed slot
+            last = unseen.pop()
+            if index < len(unseen):
+                unseen[index] = last
+                positions[last] = index
+
+    def _count_unseen_images(self) -> int:
+        return sum(
+            len(self._get_unseen_pool(bucket)["unseen"])
+            for bucket in self.metadata_backend.aspect_ratio_bucket_indices
+        )
+
     def _get_unseen_images(self, bucket=None):
         """
         Get unseen images from the specified bucket.
         If bucket is None, get unseen images from all buckets.
         """
         if bucket and bucket in self.metadata_backend.aspect_ratio_bucket_indices:
-            return [
-                (
-                    os.path.join(self.metadata_backend.instance_data_dir, image)
-                    if not image.startswith("http")
-                    else image
-                )
-                for image in self.metadata_backend.aspect_ratio_bucket_indices[bucket]
-                if not self.metadata_backend.is_seen(image)
-            ]
+            return list(self._get_unseen_pool(bucket)["unseen"])
         elif bucket is None:
             unseen_images = []
-            for b, images in self.metadata_backend.aspect_ratio_bucket_indices.items():
-                unseen_images.extend(
-                    [
-                        (
-                            os.path.join(self.metadata_backend.instance_data_dir, image)
-                            if not image.startswith("http")
-                            else image
-                        )
-                        for image in images
-                        if not self.metadata_backend.is_seen(image)
-                    ]
-                )
+            for b in self.metadata_backend.aspect_ratio_bucket_indices:
+                unseen_images.extend(self._get_unseen_pool(b)["unseen"])
             return unseen_images
         else:
             return []
@@ -373,8 +423,8 @@ class MultiAspectSampler(torch.utils.data.Sampler):
         if alt_stats:
             # Return an overview instead of a snapshot.
             # Eg. return totals, and not "as it is now"
-            total_image_count = len(self.metadata_backend.seen_images) + len(
-                self._get_unseen_images()
+            total_image_count = (
+                len(self.metadata_backend.seen_images) + self._count_unseen_images()
             )
             if self.accelerator.num_processes > 1:
                 # We don't know the direct count without more work, so we'll estimate it here for multi-GPU training.
@@ -397,7 +447,7 @@ class MultiAspectSampler(torch.utils.data.Sampler):
             # Return a snapshot of the current state during training.
             printed_state = (
                 f"\n{self.rank_info if show_rank else ''}    -> Number of seen images: {len(self.metadata_backend.seen_images)}"
-                f"\n{self.rank_info if show_rank else ''}    -> Number of unseen images: {len(self._get_unseen_images())}"
+                f"\n{self.rank_info if show_rank else ''}    -> Number of unseen images: {self._count_unseen_images()}"
                 f"\n{self.rank_info if show_rank else ''}    -> Current Bucket: {self.current_bucket}"
                 f"\n{self.rank_info if show_rank else ''}    -> {len(self.buckets)} Buckets: {self.buckets}"
                 f"\n{self.rank_info if show_rank else ''}    -> {len(self.exhausted_buckets)} Exhausted Buckets: {self.exhausted_buckets}"
@@ -508,9 +558,10 @@ class MultiAspectSampler(torch.utils.data.Sampler):
             # Loop through all buckets to find one with sufficient images
             for _ in range(len(self.buckets)):
                 self._clear_batch_accumulator()
-                available_images = self._get_unseen_images(
+                # the live pool, _mark_batch_as_seen shrinks it in place
+                available_images = self._get_unseen_pool(
                     self.buckets[self.current_bucket]
-                )
+                )["unseen"]
                 self.debug_log(
                     f"From {len(self.buckets)} buckets, selected {self.buckets[self.current_bucket]} ({self.buckets[self.current_bucket]}) -> {len(available_images)} available images, and our accumulator has {len(self.batch_accumulator)} images ready for yielding."
                 )
@@ -521,6 +572,8 @@ class MultiAspectSampler(torch.utils.data.Sampler):
                     # Current bucket doesn't have enough images, try the next bucket
                     self.move_to_exhausted()
                     self.change_bucket()
+            # the number of unseen images of the bucket before the last batch was drawn
+            available_count = len(available_images)
             while len(available_images) > 0:
                 if len(available_images) < self.batch_size:
                     need_image_count = self.batch_size - len(available_images)
@@ -533,7 +586,7 @@ class MultiAspectSampler(torch.utils.data.Sampler):
                     # add the available images
                     to_yield.extend(
                         self._validate_and_yield_images_from_samples(
-                            available_images, self.buckets[self.current_bucket]
+                            list(available_images), self.buckets[self.current_bucket]
                         )
                     )
                 else:
@@ -563,8 +616,10 @@ class MultiAspectSampler(torch.utils.data.Sampler):
                     self.debug_log(
                         f"Yielding samples and marking {len(final_yield)} images as seen, we have {len(self.metadata_backend.seen_images.values())} seen images before adding."
                     )
-                    self.metadata_backend.mark_batch_as_seen(
-                        [instance["image_path"] for instance in final_yield]
+                    available_count = len(available_images)
+                    self._mark_batch_as_seen(
+                        [instance["image_path"] for instance in final_yield],
+                        self.buckets[self.current_bucket],
                     )
                     self.accelerator.wait_for_everyone()
                     # if applicable, we'll append TrainingSample(s) to the end for conditioning inputs.
@@ -576,15 +631,16 @@ class MultiAspectSampler(torch.utils.data.Sampler):
                     break
 
                 # Update available images after yielding
-                available_images = self._get_unseen_images(
+                available_images = self._get_unseen_pool(
                     self.buckets[self.current_bucket]
-                )
+                )["unseen"]
+                available_count = len(available_images)
                 self.debug_log(
                     f"Bucket {self.buckets[self.current_bucket]} now has {len(available_images)} available images after yielding."
                 )
 
             # Handle exhausted bucket
-            if len(available_images) < self.batch_size:
+            if available_count < self.batch_size:
                 self.debug_log(
                     f"Bucket {self.buckets[self.current_bucket]} is now exhausted and sleepy, and we have to move it to the sleepy list before changing buckets."
                 )
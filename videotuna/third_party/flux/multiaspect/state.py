@@ -1,3 +1,4 @@
+import base64
 import json
 import logging
 import os
@@ -31,6 +32,33 @@ class BucketStateManager:
         with open(state_path, "w") as f:
             json.dump(seen_images, f)
 
+    def pack_seen_images(self, bucket_indices: dict, is_seen) -> dict:
+        """
+        Encode the seen images as one base64 bitmap per bucket, in the order of `bucket_indices`,
+        which is a small fraction of the size of the `{path: True}` dict.
+        """
+        bitmaps = {}
+        for bucket, images in bucket_indices.items():
+            bits = bytearray((len(images) + 7) // 8)
+            for i, image in enumerate(images):
+                if is_seen(image):
+                    bits[i >> 3] |= 1 << (i & 7)
+            bitmaps[bucket] = base64.b64encode(bytes(bits)).decode("ascii")
+        return bitmaps
+
+    def unpack_seen_images(self, bucket_indices: dict, bitmaps: dict) -> list:
+        """Return the images marked in `bitmaps`, as written by `pack_seen_images`."""
+        seen_images = []
+        for bucket, bitmap in bitmaps.items():
+            images = bucket_indices.get(bucket, [])
+            bits = base64.b64decode(bitmap)
+            seen_images.extend(
+                image
+                for i, image in enumerate(images)
+                if i >> 3 < len(bits) and bits[i >> 3] & (1 << (i & 7))
+            )
+        return seen_images
+
     def deep_convert_dict(self, d):
         if isinstance(d, dict):
             return {key: self.deep_convert_dict(value) for key, value in d.items()}
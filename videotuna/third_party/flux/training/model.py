@@ -2144,6 +2144,7 @@ class Model(pl.LightningModule):
             self.bf = BatchFetcher(
                 datasets=train_backends,
                 max_size=self.config.dataloader_prefetch_qlen,
+                num_workers=self.config.dataloader_prefetch_workers,
                 step=self.step,
             )
             if self.fetch_thread is not None:
@@ -2583,6 +2584,8 @@ class Model(pl.LightningModule):
                 self.guidance_values_list = []
             if grad_norm is not None:
                 wandb_logs["grad_norm"] = grad_norm
+            if self.bf is not None:
+                wandb_logs.update(self.bf.get_metrics())
             self.progress_bar.update(1)
             self.state["global_step"] += 1
             self.current_epoch_step += 1
@@ -2133,6 +2133,7 @@ class Trainer:
                 self.bf = BatchFetcher(
                     datasets=train_backends,
                     max_size=self.config.dataloader_prefetch_qlen,
+                    num_workers=self.config.dataloader_prefetch_workers,
                     step=step,
                 )
                 if fetch_thread is not None:
@@ -2595,6 +2596,8 @@ class Trainer:
                         self.guidance_values_list = []
                     if grad_norm is not None:
                         wandb_logs["grad_norm"] = grad_norm
+                    if self.bf is not None:
+                        wandb_logs.update(self.bf.get_metrics())
                     progress_bar.update(1)
                     self.state["global_step"] += 1
                     current_epoch_step += 1
@@ -18,6 +18,10 @@ from typing import List, Union
 from argparse import Namespace
 
 
+# bytes of weights streamed to the gpu by the offload engine in `inference_utils`, read by `monitor_resources`
+offload_stats = {"bytes": 0}
+
+
 precision_to_dtype = {
     "float32": torch.float32,
     "float16": torch.float16,
@@ -161,6 +165,7 @@ def monitor_resources(return_metrics=True):
             process = psutil.Process()
             start_time = time.time()
             start_cpu_mem = process.memory_info().rss / 1024 / 1024 / 1024 # GB
+            start_offload_bytes = offload_stats["bytes"]
 
             if torch.cuda.is_available():
                 torch.cuda.reset_peak_memory_stats()
@@ -181,12 +186,16 @@ def monitor_resources(return_metrics=True):
                 torch.cuda.synchronize()
                 gpu_mem_used = torch.cuda.max_memory_allocated() / 1024 / 1024 / 1024 # GB
                 logger.info(f"Peak GPU memory used: {gpu_mem_used:.2f} GB")
+            offload_gb = (offload_stats["bytes"] - start_offload_bytes) / 1024 / 1024 / 1024 # GB
+            if offload_gb > 0:
+                logger.info(f"Weights streamed to GPU: {offload_gb:.2f} GB ({offload_gb / max(time_used, 1e-6):.2f} GB/s)")
 
             if return_metrics:
                 return {
                     "time": round(time_used, 2),
                     "cpu": round(cpu_mem_used, 2),
                     "gpu": round(gpu_mem_used, 2) if gpu_mem_used is not None else None,
+                    "offload": round(offload_gb, 2),
                     "result": result,
                 }
             else:
@@ -1,17 +1,19 @@
 import glob
+import itertools
 import os
 import sys
 from collections import OrderedDict
 
 import cv2
 import numpy as np
-import torch, copy
+import torch
 import torchvision
 import torchvision.transforms as transforms
 from decord import VideoReader, cpu
 from einops import rearrange, repeat
 from PIL import Image
 
+from videotuna.utils.common_utils import offload_stats
 from videotuna.utils.load_weights import load_safetensors, init_weights_on_device
 
 
@@ -460,8 +462,123 @@ def cast_to(weight, dtype, device):
     return r
 
 
+def pin_module_(module: torch.nn.Module):
+    """
+    Pin the cpu parameters and buffers of `module` in place, so that they can be copied to the gpu asynchronously.
+    """
+    if not torch.cuda.is_available():
+        return module
+    for tensor in itertools.chain(module.parameters(), module.buffers()):
+        if tensor.device.type == "cpu" and not tensor.is_pinned():
+            try:
+                tensor.data = tensor.data.pin_memory()
+            except RuntimeError:
+                # out of page-locked memory, the remaining tensors stay pageable
+                return module
+    return module
+
+
+class WeightStreamer:
+    """
+    Stream the weights of offloaded modules to the computation device, one module at a time.
+
+    Modules are recorded in the order of their first forward. While module i computes, the weights of
+    module i+1 are copied from pinned host memory on a side stream. The device buffers are recycled
+    through a pool keyed by (shape, dtype), so that no memory is allocated after the first step.
+
+    Args:
+        device: the computation device.
+        dtype: the computation dtype of floating point weights.
+        prefetch: whether to copy the next module on a side stream.
+    """
+
+    def __init__(self, device, dtype, prefetch=True):
+        self.device = torch.device(device)
+        self.dtype = dtype
+        self.stream = torch.cuda.Stream(self.device) if prefetch and self.device.type == "cuda" else None
+        self.order = []
+        self.position = {}
+        self.pending = None
+        self.pool = {}
+
+    def _acquire(self, shape, dtype, stream=None):
+        free = self.pool.get((tuple(shape), dtype))
+        if free:
+            buffer, event = free.pop()
+            if event is not None:
+                # the buffer may still be read by the computation that released it
+                (stream or torch.cuda.current_stream(self.device)).wait_event(event)
+            return buffer
+        return torch.empty(shape, dtype=dtype, device=self.device)
+
+    def _release(self, tensors, event):
+        for tensor in tensors:
+            self.pool.setdefault((tuple(tensor.shape), tensor.dtype), []).append((tensor, event))
+
+    def _copy(self, host_tensors, stream=None):
+        tensors = []
+        for tensor in host_tensors:
+            dtype = self.dtype if tensor.is_floating_point() else tensor.dtype
+            buffer = self._acquire(tensor.shape, dtype, stream)
+            buffer.copy_(tensor, non_blocking=True)
+            tensors.append(buffer)
+            offload_stats["bytes"] += tensor.numel() * tensor.element_size()
+        return tensors
+
+    def _prefetch(self, module):
+        with torch.cuda.stream(self.stream):
+            tensors = self._copy(module.host_tensors(), self.stream)
+            event = torch.cuda.Event()
+            event.record(self.stream)
+        return tensors, event
+
+    def fetch(self, module):
+        """
+        Get the weights of `module` on the computation device, and start prefetching the next module.
+        """
+        key = id(module)
+        if key not in self.position:
+            self.position[key] = len(self.order)
+            self.order.append(module)
+
+        tensors = None
+        if self.pending is not None:
+            pending_key, pending_tensors, event = self.pending
+            self.pending = None
+            if pending_key == key:
+                torch.cuda.current_stream(self.device).wait_event(event)
+                tensors = pending_tensors
+            else:
+                # the execution order changed, drop the prefetched weights
+                self._release(pending_tensors, event)
+        if tensors is None:
+            tensors = self._copy(module.host_tensors())
+
+        if self.stream is not None and len(self.order) > 1:
+            next_module = self.order[(self.position[key] + 1) % len(self.order)]
+            if next_module is not module:
+                self.pending = (id(next_module), *self._prefetch(next_module))
+        return tensors
+
+    def release(self, tensors):
+        """
+        Return the weights fetched for one forward to the buffer pool.
+        """
+        event = None
+        if self.device.type == "cuda":
+            event = torch.cuda.Event()
+            event.record(torch.cuda.current_stream(self.device))
+        self._release(tensors, event)
+
+    def clear(self):
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+        self.pending = None
+        self.pool = {}
+
+
 class AutoWrappedModule(torch.nn.Module):
-    def __init__(self, module: torch.nn.Module, offload_dtype, offload_device, onload_dtype, onload_device, computation_dtype, computation_device):
+    def __init__(self, module: torch.nn.Module, offload_dtype, offload_device, onload_dtype, onload_device, computation_dtype, computation_device, streamer: WeightStreamer = None):
         super().__init__()
         self.module = module.to(dtype=offload_dtype, device=offload_device)
         self.offload_dtype = offload_dtype
@@ -471,6 +588,9 @@ class AutoWrappedModule(torch.nn.Module):
         self.computation_dtype = computation_dtype
         self.computation_device = computation_device
         self.state = 0
+        self.streamer = streamer
+        if streamer is not None:
+            pin_module_(self.module)
 
     def offload(self):
         if self.state == 1 and (self.offload_dtype != self.onload_dtype or self.offload_device != self.onload_device):
@@ -482,18 +602,37 @@ class AutoWrappedModule(torch.nn.Module):
             self.module.to(dtype=self.onload_dtype, device=self.onload_device)
             self.state = 1
 
+    def named_host_tensors(self):
+        return list(self.module.named_parameters()) + list(self.module.named_buffers())
+
+    def host_tensors(self):
+        return [tensor for _, tensor in self.named_host_tensors()]
+
     @torch.inference_mode
     def forward(self, *args, **kwargs):
         if self.onload_dtype == self.computation_dtype and self.onload_device == self.computation_device:
-            module = self.module
+            return self.module(*args, **kwargs)
+        # run the module with weights on the computation device, without copying the module itself
+        named_tensors = self.named_host_tensors()
+        names = [name for name, _ in named_tensors]
+        host_tensors = [tensor for _, tensor in named_tensors]
+        if self.streamer is not None:
+            tensors = self.streamer.fetch(self)
         else:
-            module = copy.deepcopy(self.module).to(dtype=self.computation_dtype, device=self.computation_device)
-        return module(*args, **kwargs)
-    
+            tensors = [
+                cast_to(t, self.computation_dtype if t.is_floating_point() else t.dtype, self.computation_device)
+                for t in host_tensors
+            ]
+        try:
+            return torch.func.functional_call(self.module, dict(zip(names, tensors)), args, kwargs)
+        finally:
+            if self.streamer is not None:
+                self.streamer.release(tensors)
+
 
 class AutoWrappedLinear(torch.nn.Linear):
 
-    def __init__(self, module: torch.nn.Linear, offload_dtype, offload_device, onload_dtype, onload_device, computation_dtype, computation_device):
+    def __init__(self, module: torch.nn.Linear, offload_dtype, offload_device, onload_dtype, onload_device, computation_dtype, computation_device, streamer: WeightStreamer = None):
         with init_weights_on_device(device=torch.device("meta")):
             super().__init__(in_features=module.in_features, out_features=module.out_features, bias=module.bias is not None, dtype=offload_dtype, device=offload_device)
         self.weight = module.weight
@@ -505,6 +644,9 @@ class AutoWrappedLinear(torch.nn.Linear):
         self.computation_dtype = computation_dtype
         self.computation_device = computation_device
         self.state = 0
+        self.streamer = streamer
+        if streamer is not None:
+            pin_module_(self)
 
     def offload(self):
         if self.state == 1 and (self.offload_dtype != self.onload_dtype or self.offload_device != self.onload_device):
@@ -516,13 +658,22 @@ class AutoWrappedLinear(torch.nn.Linear):
             self.to(dtype=self.onload_dtype, device=self.onload_device)
             self.state = 1
 
+    def host_tensors(self):
+        return [self.weight] if self.bias is None else [self.weight, self.bias]
+
     @torch.inference_mode
     def forward(self, x, *args, **kwargs):
         if self.onload_dtype == self.computation_dtype and self.onload_device == self.computation_device:
-            weight, bias = self.weight, self.bias
-        else:
-            weight = cast_to(self.weight, self.computation_dtype, self.computation_device)
-            bias = None if self.bias is None else cast_to(self.bias, self.computation_dtype, self.computation_device)
+            return torch.nn.functional.linear(x, self.weight, self.bias)
+        if self.streamer is not None:
+            tensors = self.streamer.fetch(self)
+            weight, bias = tensors[0], (tensors[1] if len(tensors) > 1 else None)
+            try:
+                return torch.nn.functional.linear(x, weight, bias)
+            finally:
+                self.streamer.release(tensors)
+        weight = cast_to(self.weight, self.computation_dtype, self.computation_device)
+        bias = None if self.bias is None else cast_to(self.bias, self.computation_dtype, self.computation_device)
         return torch.nn.functional.linear(x, weight, bias)
 
 
@@ -544,6 +695,41 @@ def enable_vram_management_recursively(model: torch.nn.Module, module_map: dict,
     return total_num_param
 
 
-def enable_vram_management(model: torch.nn.Module, module_map: dict, module_config: dict, max_num_param=None, overflow_module_config: dict = None):
+def enable_vram_management(model: torch.nn.Module, module_map: dict, module_config: dict, max_num_param=None, overflow_module_config: dict = None, prefetch=True):
+    """
+    Wrap the modules of `model` listed in `module_map`. The first `max_num_param` parameters use `module_config`,
+    the rest `overflow_module_config`. Modules that are onloaded to a different device than the computation device
+    share one `WeightStreamer`, which streams their weights from pinned memory and prefetches the next module.
+    """
+    streamer = None
+
+    def with_streamer(config):
+        nonlocal streamer
+        if config is None:
+            return None
+        computation_device = torch.device(config["computation_device"])
+        if computation_device.type != "cuda" or torch.device(config["onload_device"]) == computation_device:
+            return config
+        if streamer is None:
+            streamer = WeightStreamer(computation_device, config["computation_dtype"], prefetch=prefetch)
+        return dict(config, streamer=streamer)
+
+    module_config = with_streamer(module_config)
+    overflow_module_config = with_streamer(overflow_module_config)
     enable_vram_management_recursively(model, module_map, module_config, max_num_param, overflow_module_config, total_num_param=0)
-    model.vram_management_enabled = True
\ No newline at end of file
+    model.vram_management_enabled = True
+    model.weight_streamer = streamer
+
+
+def get_persistent_param_budget(dtype, device, vram_budget_gb=None, reserve_gb=8.0):
+    """
+    Get the number of parameters that can stay on `device` during sequential offload.
+    Uses `vram_budget_gb` if it is given, otherwise the free memory of the device minus `reserve_gb` for activations.
+    """
+    bytes_per_param = torch.empty((), dtype=dtype).element_size()
+    if vram_budget_gb is None:
+        free_memory, _ = torch.cuda.mem_get_info(device)
+        budget = free_memory - reserve_gb * 1024**3
+    else:
+        budget = vram_budget_gb * 1024**3
+    return max(int(budget // bytes_per_param), 0)
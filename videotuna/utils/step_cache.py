@@ -0,0 +1,174 @@
+from typing import Callable, List, Optional
+
+import torch
+from loguru import logger
+
+
+class StepCache:
+    """
+    Training-free residual cache for the block stack of a video DiT, after TeaCache
+    (https://arxiv.org/abs/2411.19108).
+
+    At every denoising step the model passes the timestep-modulated input of its first block.
+    Its relative L1 change to the previous step, optionally rescaled by the polynomial
+    `coefficients` (highest degree first), is accumulated; while the sum stays below `threshold`
+    the block stack is skipped and the residual it added at the last computed step is reused.
+    Every sample of the batch has its own state, so the cond and uncond CFG branches of a
+    batched forward are cached separately, and only the samples that need it are recomputed.
+
+    The first `warmup_steps` and last `cooldown_steps` steps of `reset(num_steps)` are always
+    computed, as are steps after `max_consecutive_skips` skips. With sequence parallelism the
+    distances are summed over the ranks with `all_reduce` (in place), so all ranks agree.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.1,
+        warmup_steps: int = 1,
+        cooldown_steps: int = 1,
+        max_consecutive_skips: Optional[int] = None,
+        coefficients: Optional[List[float]] = None,
+        all_reduce: Optional[Callable[[torch.Tensor], None]] = None,
+    ):
+        self.threshold = threshold
+        self.warmup_steps = warmup_steps
+        self.cooldown_steps = cooldown_steps
+        self.max_consecutive_skips = max_consecutive_skips
+        self.coefficients = list(coefficients) if coefficients is not None else None
+        self.all_reduce = all_reduce
+        self.reset()
+
+    @classmethod
+    def from_config(cls, config, **kwargs) -> Optional["StepCache"]:
+        """
+        Build the cache from the `step_cache` section of an inference config, None if the
+        section is missing or not `enabled`.
+        """
+        if config is None or not config.get("enabled", False):
+            return None
+        params = {k: v for k, v in config.items() if k != "enabled"}
+        params.update(kwargs)
+        return cls(**params)
+
+    def reset(self, num_steps: Optional[int] = None):
+        """Start a new generation of `num_steps` denoising steps."""
+        self.num_steps = num_steps
+        self.step = 0
+        self.computed: List[int] = []
+        self.skipped: List[int] = []
+        self._prev = None
+        self._residual = None
+        self._accumulated: List[float] = []
+        self._consecutive: List[int] = []
+
+    def _rescale(self, distance: float) -> float:
+        if self.coefficients is None:
+            return distance
+        value = 0.0
+        for c in self.coefficients:
+            value = value * distance + c
+        return value
+
+    def _select(self, modulated: torch.Tensor) -> List[bool]:
+        """Decide for every sample whether its block stack is computed at this step."""
+        batch = modulated.shape[0]
+        step = self.step
+        self.step += 1
+        forced = (
+            self._prev is None
+            or self._prev.shape != modulated.shape
+            or step < self.warmup_steps
+            or (
+                self.num_steps is not None
+                and step >= self.num_steps - self.cooldown_steps
+            )
+        )
+        if forced:
+            self._accumulated = [0.0] * batch
+            self._consecutive = [0] * batch
+            return [True] * batch
+
+        prev = self._prev.float()
+        stats = torch.stack(
+            [
+                (modulated.float() - prev).abs().flatten(1).sum(1),
+                prev.abs().flatten(1).sum(1),
+            ]
+        )
+        if self.all_reduce is not None:
+            self.all_reduce(stats)
+        # the only host sync of the cache
+        distances = (stats[0] / stats[1].clamp(min=1e-12)).tolist()
+
+        compute = []
+        for i, distance in enumerate(distances):
+            self._accumulated[i] += self._rescale(distance)
+            skip = self._accumulated[i] < self.threshold and (
+                self.max_consecutive_skips is None
+                or self._consecutive[i] < self.max_consecutive_skips
+            )
+            if skip:
+                self._consecutive[i] += 1
+            else:
+                self._accumulated[i] = 0.0
+                self._consecutive[i] = 0
+            compute.append(not skip)
+        return compute
+
+    def __call__(
+        self,
+        hidden: torch.Tensor,
+        modulated: torch.Tensor,
+        run_blocks: Callable[[torch.Tensor, Optional[List[int]]], torch.Tensor],
+    ) -> torch.Tensor:
+        """
+        Return the output of the block stack for `hidden` [B, ...].
+
+        `modulated` [B, ...] is the timestep-modulated input of the first block.
+        `run_blocks(hidden, index)` runs the blocks on the samples `index` of the batch
+        (all of them if None), `hidden` holding only those samples.
+        """
+        batch = hidden.shape[0]
+        if self._residual is not None and self._residual.shape != hidden.shape:
+            self._prev = None
+        if len(self.computed) != batch:
+            self.computed = [0] * batch
+            self.skipped = [0] * batch
+
+        compute = self._select(modulated)
+        self._prev = modulated.detach()
+        index = [i for i, c in enumerate(compute) if c]
+        for i, c in enumerate(compute):
+            if c:
+                self.computed[i] += 1
+            else:
+                self.skipped[i] += 1
+
+        if len(index) == batch:
+            out = run_blocks(hidden, None)
+            self._residual = out - hidden
+            return out
+        out = hidden + self._residual
+        if index:
+            computed = run_blocks(hidden[index], index)
+            self._residual[index] = computed - hidden[index]
+            out[index] = computed
+        return out
+
+    def report(self) -> dict:
+        """Computed and skipped block-stack evaluations of every batch slot since the last `reset`."""
+        return {
+            "steps": self.step,
+            "computed": list(self.computed),
+            "skipped": list(self.skipped),
+        }
+
+    def log_report(self, name: str = "step cache") -> dict:
+        report = self.report()
+        total = sum(report["computed"]) + sum(report["skipped"])
+        if total > 0:
+            logger.info(
+                f"{name}: skipped {sum(report['skipped'])}/{total} block-stack evaluations "
+                f"over {report['steps']} steps, per batch slot {report['skipped']}"
+            )
+        return report
@@ -0,0 +1,342 @@
+import atexit
+import multiprocessing as mp
+import threading
+import time
+from fractions import Fraction
+from multiprocessing import shared_memory
+from typing import Dict, Optional
+
+import numpy as np
+import torch
+from loguru import logger
+
+
+def to_uint8_frames(video: torch.Tensor) -> torch.Tensor:
+    """
+    Convert a [c, t, h, w] video in [-1, 1] to [t, h, w, c] uint8 frames, on the device of the video.
+    """
+    video = torch.clamp(video.detach().float(), -1.0, 1.0)
+    video = (video + 1.0) / 2.0
+    return (video * 255).to(torch.uint8).permute(1, 2, 3, 0).contiguous()
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before python 3.13 attaching registers the block with the resource tracker,
+        # which would unlink it when this process exits, the writer owns it
+        from multiprocessing import resource_tracker
+
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class _StreamEncoder:
+    """Encode frames into an h264 mp4 one at a time, with the settings of `torchvision.io.write_video`."""
+
+    def __init__(
+        self, savepath: str, fps: float, height: int, width: int, codec: str, crf: int
+    ):
+        import av
+
+        self.av = av
+        self.container = av.open(savepath, mode="w")
+        self.stream = self.container.add_stream(codec, rate=Fraction(round(fps)))
+        self.stream.width = width
+        self.stream.height = height
+        self.stream.pix_fmt = "yuv420p"
+        self.stream.options = {"crf": str(crf)}
+        self.encode_time = 0.0
+
+    def encode(self, frames: np.ndarray):
+        start = time.perf_counter()
+        for frame in frames:
+            frame = self.av.VideoFrame.from_ndarray(frame, format="rgb24")
+            for packet in self.stream.encode(frame):
+                self.container.mux(packet)
+        self.encode_time += time.perf_counter() - start
+
+    def close(self) -> float:
+        start = time.perf_counter()
+        for packet in self.stream.encode():
+            self.container.mux(packet)
+        self.container.close()
+        self.encode_time += time.perf_counter() - start
+        return self.encode_time
+
+
+def _encode_worker(task_queue, result_queue):
+    """
+    Encoder process. A video is announced with ("open", ...), its frames are encoded as
+    ("frames", job, end) messages report them copied into the shared buffer, and ("close", job)
+    finishes the file.
+    """
+    jobs = {}
+    while True:
+        message = task_queue.get()
+        if message is None:
+            break
+        kind, job = message[0], message[1]
+        if kind != "open" and job not in jobs:
+            # the job failed already
+            continue
+        try:
+            if kind == "open":
+                _, job, savepath, fps, shm_name, shape, codec, crf = message
+                shm = _attach_shared_memory(shm_name)
+                jobs[job] = {
+                    "savepath": savepath,
+                    "shm": shm,
+                    "frames": np.ndarray(shape, dtype=np.uint8, buffer=shm.buf),
+                    "encoded": 0,
+                    "encoder": None,
+                }
+                jobs[job]["encoder"] = _StreamEncoder(
+                    savepath, fps, shape[1], shape[2], codec, crf
+                )
+            elif kind == "frames":
+                state = jobs[job]
+                end = message[2]
+                state["encoder"].encode(state["frames"][state["encoded"] : end])
+                state["encoded"] = end
+            elif kind == "close":
+                state = jobs.pop(job)
+                encode_time = state["encoder"].close()
+                del state["frames"]
+                state["shm"].close()
+                result_queue.put((job, state["savepath"], encode_time, None))
+        except Exception as e:
+            state = jobs.pop(job, None)
+            if state is not None:
+                state.pop("frames", None)
+                state["shm"].close()
+            result_queue.put(
+                (job, message[2] if kind == "open" else None, None, repr(e))
+            )
+
+
+class AsyncVideoWriter:
+    """
+    Save videos in background encoder processes, so that sampling continues while they are muxed.
+
+    `submit` converts the video to uint8 on its device and streams it to the host in chunks of
+    `chunk_frames` frames, through two pinned buffers on a side CUDA stream, into a shared
+    memory block. The encoder process assigned to the video encodes every chunk as soon as it
+    is reported copied. At most `max_pending` videos are in flight, `submit` blocks beyond that.
+    `flush` waits for every submitted video and returns the encode latency of each of them.
+
+    With `num_workers=0` the videos are encoded synchronously on the calling thread.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 2,
+        max_pending: int = 4,
+        chunk_frames: int = 16,
+        codec: str = "h264",
+        crf: int = 10,
+    ):
+        self.num_workers = num_workers
+        self.chunk_frames = chunk_frames
+        self.codec = codec
+        self.crf = crf
+        self.latencies: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        # reentrant, `flush` finishes the jobs of crashed encoders while holding it
+        self._cond = threading.Condition(threading.RLock())
+        # job -> (savepath, shared memory, worker)
+        self._pending = {}
+        self._next_job = 0
+        self._pinned = {}
+        self._copy_stream = None
+        self._closed = False
+        if num_workers > 0:
+            # fork is not safe once CUDA is initialized
+            ctx = mp.get_context("spawn")
+            self._result_queue = ctx.Queue()
+            self._task_queues = [ctx.Queue() for _ in range(num_workers)]
+            self._workers = [
+                ctx.Process(
+                    target=_encode_worker,
+                    args=(task_queue, self._result_queue),
+                    daemon=True,
+                )
+                for task_queue in self._task_queues
+            ]
+            for worker in self._workers:
+                worker.start()
+            self._collector = threading.Thread(target=self._collect, daemon=True)
+            self._collector.start()
+        atexit.register(self.close)
+
+    def _get_pinned(self, shape) -> torch.Tensor:
+        shape = tuple(shape)
+        if shape not in self._pinned:
+            # double buffered, the next chunk is copied while the previous one is moved on
+            self._pinned[shape] = [
+                torch.empty(shape, dtype=torch.uint8, pin_memory=True) for _ in range(2)
+            ]
+        return self._pinned[shape]
+
+    def _stream_to_host(self, frames: torch.Tensor, host: torch.Tensor, on_chunk):
+        t = frames.shape[0]
+        chunks = [
+            (start, min(start + self.chunk_frames, t))
+            for start in range(0, t, self.chunk_frames)
+        ]
+        if not frames.is_cuda:
+            for start, end in chunks:
+                host[start:end].copy_(frames[start:end])
+                on_chunk(end)
+            return
+        if self._copy_stream is None:
+            self._copy_stream = torch.cuda.Stream(device=frames.device)
+        buffers = self._get_pinned((self.chunk_frames,) + tuple(frames.shape[1:]))
+        self._copy_stream.wait_stream(torch.cuda.current_stream(frames.device))
+
+        def issue(i):
+            start, end = chunks[i]
+            with torch.cuda.stream(self._copy_stream):
+                buffers[i % 2][: end - start].copy_(
+                    frames[start:end], non_blocking=True
+                )
+                event = torch.cuda.Event()
+                event.record(self._copy_stream)
+            return event
+
+        event = issue(0)
+        for i, (start, end) in enumerate(chunks):
+            next_event = issue(i + 1) if i + 1 < len(chunks) else None
+            event.synchronize()
+            host[start:end].copy_(buffers[i % 2][: end - start])
+            on_chunk(end)
+            event = next_event
+
+    def submit(self, video: torch.Tensor, savepath: str, fps: float = 10) -> None:
+        """
+        Queue a [c, t, h, w] video in [-1, 1] to be saved as an mp4, blocking while
+        `max_pending` videos are still being encoded.
+        """
+        assert video.dim() == 4, "Invalid video tensor shape."
+        frames = to_uint8_frames(video)
+        if self.num_workers == 0:
+            start = time.perf_counter()
+            encoder = _StreamEncoder(
+                savepath, fps, frames.shape[1], frames.shape[2], self.codec, self.crf
+            )
+            encoder.encode(frames.cpu().numpy())
+            encoder.close()
+            self._record(savepath, time.perf_counter() - start, None)
+            return
+
+        # a crashed encoder never reports its jobs, their slots are reclaimed while waiting
+        while not self._slots.acquire(timeout=1.0):
+            self._reap_crashed_jobs()
+        try:
+            shm = shared_memory.SharedMemory(create=True, size=max(1, frames.numel()))
+        except BaseException:
+            self._slots.release()
+            raise
+        host = torch.from_numpy(
+            np.ndarray(tuple(frames.shape), dtype=np.uint8, buffer=shm.buf)
+        )
+        with self._cond:
+            job = self._next_job
+            self._next_job += 1
+            worker = job % self.num_workers
+            self._pending[job] = (savepath, shm, worker)
+        task_queue = self._task_queues[worker]
+        task_queue.put(
+            (
+                "open",
+                job,
+                savepath,
+                fps,
+                shm.name,
+                tuple(frames.shape),
+                self.codec,
+                self.crf,
+            )
+        )
+        try:
+            self._stream_to_host(
+                frames, host, lambda end: task_queue.put(("frames", job, end))
+            )
+        finally:
+            del host
+            task_queue.put(("close", job))
+
+    def _record(
+        self, savepath: str, encode_time: Optional[float], error: Optional[str]
+    ):
+        if error is not None:
+            self.errors[savepath] = error
+            logger.error(f"Failed to save {savepath}: {error}")
+        else:
+            self.latencies[savepath] = encode_time
+            logger.debug(f"Saved {savepath}, encoded in {encode_time:.2f}s")
+
+    def _finish(self, job: int, encode_time: Optional[float], error: Optional[str]):
+        with self._cond:
+            entry = self._pending.pop(job, None)
+            if entry is None:
+                return
+            savepath, shm, _ = entry
+            shm.close()
+            shm.unlink()
+            self._record(savepath, encode_time, error)
+            self._slots.release()
+            self._cond.notify_all()
+
+    def _collect(self):
+        while True:
+            result = self._result_queue.get()
+            if result is None:
+                break
+            job, _, encode_time, error = result
+            self._finish(job, encode_time, error)
+
+    def _reap_crashed_jobs(self):
+        """fail the pending jobs of encoder processes that exited, they are never reported"""
+        with self._cond:
+            for job, (_, _, worker) in list(self._pending.items()):
+                if not self._workers[worker].is_alive():
+                    self._finish(job, None, "the encoder process exited")
+
+    def flush(self, timeout: Optional[float] = None) -> Dict[str, float]:
+        """
+        Wait until every submitted video is written and return the encode latency (in seconds)
+        of each saved path.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._pending:
+                if deadline is not None and time.time() > deadline:
+                    raise TimeoutError(
+                        f"{len(self._pending)} videos are still being encoded."
+                    )
+                self._cond.wait(timeout=1.0)
+                self._reap_crashed_jobs()
+        if self.latencies:
+            latencies = list(self.latencies.values())
+            logger.info(
+                f"Saved {len(latencies)} videos, encode latency mean {np.mean(latencies):.2f}s, max {np.max(latencies):.2f}s"
+            )
+        return dict(self.latencies)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self.num_workers == 0:
+            return
+        self.flush()
+        for task_queue in self._task_queues:
+            task_queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._result_queue.put(None)
+        self._collector.join()